@@ -18,13 +18,81 @@ example videoConfig.json:
 import fs from 'fs';
 import path from 'path';
 
+// The decode writes clip_catalog.jsonl into every batch it produces (one JSON line per clip,
+// the last line for a path wins). Batches with a catalog are listed from it; older batches
+// are still walked. Catalogs, the config and the reference listing are kept in memory and
+// only re-read when the file or directory they come from changes.
+const CATALOG_FILENAME = 'clip_catalog.jsonl';
+const cache = new Map();
+
+// value of load(filePath), recomputed only when filePath's mtime or size changes
+function cachedBy(filePath, load) {
+  const stat = fs.statSync(filePath);
+  const hit = cache.get(filePath);
+  if (hit && hit.mtimeMs === stat.mtimeMs && hit.size === stat.size) {
+    return hit.value;
+  }
+  const value = load();
+  cache.set(filePath, { mtimeMs: stat.mtimeMs, size: stat.size, value });
+  return value;
+}
+
+// { sign: [filenames] } of the clips in a catalog. Only clips at <sign>/<filename> can be
+// served by the review API; a line being written while we read is skipped.
+function readCatalog(catalogPath) {
+  const latest = new Map();
+  for (const line of fs.readFileSync(catalogPath, 'utf-8').split('\n')) {
+    if (line.trim() === '') {
+      continue;
+    }
+    try {
+      const entry = JSON.parse(line);
+      latest.set(entry.path, entry);
+    } catch {
+      continue;
+    }
+  }
+
+  const signs = {};
+  for (const entry of latest.values()) {
+    if (entry.status !== 'ok' || entry.path !== `${entry.sign}/${entry.filename}`) {
+      continue;
+    }
+    (signs[entry.sign] ??= []).push(entry.filename);
+  }
+  for (const files of Object.values(signs)) {
+    files.sort();
+  }
+  return signs;
+}
+
+// Same shape, walked from disk, for batches decoded before the catalog existed
+function walkBatch(batchPath) {
+  const signs = {};
+  // Hidden dirs (.review proxies/posters) are not signs
+  const signDirs = fs.readdirSync(batchPath, { withFileTypes: true }).filter(dir => dir.isDirectory() && !dir.name.startsWith('.'));
+  for (const signDir of signDirs) {
+    const signPath = path.join(batchPath, signDir.name);
+    signs[signDir.name] = fs.readdirSync(signPath).filter(file => file.endsWith('.mp4'));
+  }
+  return signs;
+}
+
+function batchSigns(batchPath) {
+  const catalogPath = path.join(batchPath, CATALOG_FILENAME);
+  if (fs.existsSync(catalogPath)) {
+    return cachedBy(catalogPath, () => readCatalog(catalogPath));
+  }
+  return walkBatch(batchPath);
+}
+
 export async function GET() {
   const configPath = path.resolve('src/routes/config/videoConfig.json');
   const signListPath = path.resolve('src/routes/config/sign_list.txt');
 
   try {
-    const configData = JSON.parse(fs.readFileSync(configPath, 'utf-8'));
-    const signListData = fs.readFileSync(signListPath, 'utf-8');
+    const configData = cachedBy(configPath, () => JSON.parse(fs.readFileSync(configPath, 'utf-8')));
+    const signListData = cachedBy(signListPath, () => fs.readFileSync(signListPath, 'utf-8'));
 
     const reviewSource = path.resolve(configData.review_source)
     const referenceSource = path.resolve(configData.reference_source);
@@ -33,8 +101,6 @@ export async function GET() {
     const batchesToLoad = configData.batches || [];
     const batches = {};
 
-    const relativePath = (fullPath) => fullPath.replace(path.resolve('static'), '');
-
     const signListByLine = signListData.split("\n")
 
     //If batches specified, only include those
@@ -47,28 +113,20 @@ export async function GET() {
       const batchName = batchDir.name;
       const batchPath = path.join(reviewSource, batchName);
       batches[batchName] = {};
-      
-      const signDirs = fs.readdirSync(batchPath, { withFileTypes: true }).filter(dir => dir.isDirectory());
 
       //add all signs words in batch 
-      for (const signDir of signDirs) {
+      for (const [signName, videos] of Object.entries(batchSigns(batchPath))) {
         //if sign list contains words, skip those not specified
-        if (signListData.trim() != "" && !signListByLine.includes(signDir.name)) {
+        if (signListData.trim() != "" && !signListByLine.includes(signName)) {
           continue;
         }
-        const signName = signDir.name;
-        const signPath = path.join(batchPath, signName);
-        const videos = fs.readdirSync(signPath).filter(file => file.endsWith('.mp4'));
-        
+
         if (!batches[batchName][signName]) {
           batches[batchName][signName] = { reference: null, reviews: [] };
         }
 
         //add all videos to each sign
         for (const file of videos) {
-          //const filePath = path.join(signPath, file);
-          //batches[batchName][signName].reviews.push(relativePath(filePath));
-
           // Have the pages refer to the API when loading the videos (such that it can load outside of static)
           const filePath = path.join(reviewAPI, batchName, signName, file);
           batches[batchName][signName].reviews.push(filePath);
@@ -78,7 +136,7 @@ export async function GET() {
         delete batches[batchName];
       }
     }
-    const referenceFiles = fs.readdirSync(referenceSource).filter(file => file.endsWith('.mp4'));
+    const referenceFiles = cachedBy(referenceSource, () => fs.readdirSync(referenceSource).filter(file => file.endsWith('.mp4')));
         
     //reference videos
     for (const file of referenceFiles) {
@@ -87,13 +145,11 @@ export async function GET() {
         continue;
       }
       const signName = path.parse(file).name;
-      const referencePath = path.join(referenceSource, file);
       const apiPath = path.join(referenceAPI, file)
 
 
       for (const batchName in batches) {
         if (batches[batchName][signName]) {
-          //batches[batchName][signName].reference = relativePath(referencePath);
           batches[batchName][signName].reference = apiPath;
         }
       }
@@ -0,0 +1,32 @@
+import fs from 'fs';
+import path from 'path';
+/* API used to load the poster frame the decode wrote for a review video (sign/.review/name.jpg, see --review_proxies).
+   Takes the review video's filename, so the page can derive it from the review URL. */
+
+export async function GET({ params }) {
+  try {
+    const configPath = path.resolve('src/routes/config/videoConfig.json');
+    const configData = JSON.parse(fs.readFileSync(configPath, 'utf-8'));
+
+    const { batch, sign, filename } = params;
+    const posterName = path.parse(filename).name + '.jpg';
+    const filePath = path.join(path.resolve(configData.review_source, batch, sign), '.review', posterName);
+
+    if (!fs.existsSync(filePath)) {
+      return new Response(JSON.stringify({ error: "Poster not found" }), { status: 404 });
+    }
+
+    const stat = fs.statSync(filePath);
+    return new Response(fs.createReadStream(filePath), {
+      headers: {
+        'Content-Type': 'image/jpeg',
+        'Content-Length': stat.size,
+        'Cache-Control': 'public, max-age=3600'
+      }
+    });
+
+  } catch (error) {
+    console.error("Error serving poster:", error);
+    return new Response(JSON.stringify({ error: "Internal Server Error" }), { status: 500 });
+  }
+}
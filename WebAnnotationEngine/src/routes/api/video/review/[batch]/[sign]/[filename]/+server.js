@@ -1,8 +1,10 @@
 import fs from 'fs';
 import path from 'path';
-/* API used to load review videos in from the filepath specified in the config file */
+/* API used to load review videos in from the filepath specified in the config file.
+   When the decode wrote a review proxy (sign/.review/filename, see --review_proxies),
+   that is served instead; ?original=1 asks for the full-resolution clip. */
 
-export async function GET({ params, request }) {
+export async function GET({ params, request, url }) {
   try {
     const configPath = path.resolve('src/routes/config/videoConfig.json');
     const configData = JSON.parse(fs.readFileSync(configPath, 'utf-8'));
@@ -11,7 +13,9 @@ export async function GET({ params, request }) {
     console.log(`Fetching review video: ${batch}/${sign}/${filename}`);
 
     const baseDir = path.resolve(configData.review_source, batch, sign);
-    const filePath = path.join(baseDir, filename);
+    const proxyPath = path.join(baseDir, '.review', filename);
+    const useProxy = !url.searchParams.has('original') && fs.existsSync(proxyPath);
+    const filePath = useProxy ? proxyPath : path.join(baseDir, filename);
     console.log(`The full filepath is: ${filePath}`);
 
     if (!fs.existsSync(filePath)) {
@@ -80,7 +84,7 @@ export async function GET({ params, request }) {
     }
 
     // Default full file response
-    const nodeStream = fs.createReadStream(filePath, { start, end });
+    const nodeStream = fs.createReadStream(filePath);
     let controllerClosed = false;
     
     const webStream = new ReadableStream({
@@ -121,6 +125,7 @@ export async function GET({ params, request }) {
 
     return new Response(webStream, {
       headers: {
+        'Accept-Ranges': 'bytes',
         'Content-Type': 'video/mp4',
         'Content-Length': fileSize
       }
@@ -0,0 +1,86 @@
+import fcntl
+import json
+import os
+import threading
+import time
+
+from cut_plan import clean_sign
+
+
+CATALOG_FILENAME = "clip_catalog.jsonl"
+
+
+# Every clip a decode wrote into dest_dir, for the annotation UI's /api/batches to read
+# instead of walking the batch's directories. One JSON line per clip and outcome,
+# appended as clips finish; for the same path the last line wins, and close() compacts
+# the file down to one line per clip. Paths are relative to dest_dir, which is one batch
+# of the UI (review_source/<batch>/<sign>/<filename>). Shard jobs can share a dest_dir,
+# so every write holds an flock on the file. Used from the planning thread and the
+# scheduler loop.
+class ClipCatalog:
+    def __init__(self, dest_dir, batch):
+        self.dest_dir = dest_dir
+        self.batch = batch
+        self.path = os.path.join(dest_dir, CATALOG_FILENAME)
+        self.lock = threading.Lock()
+        self.file = open(self.path, "a")
+
+    def entry(self, clip, status):
+        return {
+            "batch": self.batch,
+            "sign": clean_sign(clip.sign_name),
+            "filename": os.path.basename(clip.path),
+            "path": os.path.relpath(clip.path, self.dest_dir),
+            "uid": clip.uid,
+            "sign_name": clip.sign_name,
+            "attempt": clip.attempt,
+            "is_valid": bool(clip.is_valid),
+            "duration": round(float(clip.duration), 3),
+            "size": os.path.getsize(clip.path) if status == "ok" else None,
+            "status": status,
+            "updated_at": time.time(),
+        }
+
+    # status is "ok" for clips on disk and "failed" for clips ffmpeg couldn't write
+    def add(self, clips, status):
+        entries = []
+        for clip in clips:
+            clip_status = status
+            if status == "ok" and not os.path.exists(clip.path):
+                clip_status = "failed"
+            entries.append(self.entry(clip, clip_status))
+        if not entries:
+            return
+        text = "".join(json.dumps(entry) + "\n" for entry in entries)
+        with self.lock:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+            try:
+                self.file.write(text)
+                self.file.flush()
+            finally:
+                fcntl.flock(self.file, fcntl.LOCK_UN)
+
+    # Rewrites the file in place with the last line of every clip. In place rather than
+    # replaced, so other jobs appending to it keep writing to the same file.
+    def compact(self):
+        with self.lock, open(self.path, "r+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                latest = {}
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    latest[entry["path"]] = entry
+                f.seek(0)
+                f.truncate()
+                for entry in latest.values():
+                    f.write(json.dumps(entry) + "\n")
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def close(self):
+        self.compact()
+        with self.lock:
+            self.file.close()
@@ -0,0 +1,111 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+MANIFEST_FILENAME = "clip_manifest.sqlite"
+
+
+# Identifies one planned clip. Any change to the source recording (size/mtime), the
+# computed cut or the encoding parameters gives a new key, so the clip is re-cut
+def clip_key(clip, videopath, source_stat, encoding):
+    parts = [
+        os.path.abspath(videopath),
+        str(source_stat.st_size),
+        str(int(source_stat.st_mtime)),
+        clip.sign_name,
+        str(clip.attempt),
+        f"{clip.start:.2f}",
+        f"{clip.duration:.2f}",
+        encoding,
+    ]
+    return hashlib.sha1("\x1f".join(parts).encode()).hexdigest()
+
+
+# Persistent record of every clip a decode run has planned and finished, stored in
+# dest_dir so a rerun only cuts clips that are new, changed or were left half-written.
+# The connection is shared by the planner thread (is_complete) and the scheduler loop (mark).
+class ClipManifest:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS clips (
+                output_path TEXT PRIMARY KEY,
+                clip_key TEXT NOT NULL,
+                source_video TEXT NOT NULL,
+                sign TEXT NOT NULL,
+                attempt INTEGER NOT NULL,
+                start REAL NOT NULL,
+                duration REAL NOT NULL,
+                status TEXT NOT NULL,
+                output_size INTEGER,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+
+    # A clip is complete when the last run finished it with the same key and the
+    # file on disk still has the size we recorded. Anything else (never run,
+    # interrupted mid-encode, changed inputs, deleted or truncated output) is redone.
+    def is_complete(self, clip, key):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT clip_key, status, output_size FROM clips WHERE output_path = ?",
+                (os.path.abspath(clip.path),)
+            ).fetchone()
+
+        if row is None:
+            return False
+        stored_key, status, output_size = row
+        if stored_key != key or status != "done":
+            return False
+        try:
+            return os.path.getsize(clip.path) == output_size
+        except OSError:
+            return False
+
+    # status is "running" when a clip is handed to ffmpeg and "done"/"failed" once it returns
+    def mark(self, clips, keys, videopath, status):
+        rows = []
+        now = time.time()
+        for clip, key in zip(clips, keys):
+            clip_status, output_size = status, None
+            if status == "done":
+                try:
+                    output_size = os.path.getsize(clip.path)
+                except OSError:
+                    clip_status = "failed"
+            rows.append((
+                os.path.abspath(clip.path), key, videopath, clip.sign_name, clip.attempt,
+                clip.start, clip.duration, clip_status, output_size, now
+            ))
+
+        with self.lock:
+            self.conn.executemany(
+                """
+                INSERT INTO clips (output_path, clip_key, source_video, sign, attempt, start, duration, status, output_size, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(output_path) DO UPDATE SET
+                    clip_key = excluded.clip_key,
+                    source_video = excluded.source_video,
+                    sign = excluded.sign,
+                    attempt = excluded.attempt,
+                    start = excluded.start,
+                    duration = excluded.duration,
+                    status = excluded.status,
+                    output_size = excluded.output_size,
+                    updated_at = excluded.updated_at
+                """,
+                rows
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
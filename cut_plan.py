@@ -0,0 +1,202 @@
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+
+
+# A single planned cut: where it starts in the source video, how long it is and where it is written to
+Clip = namedtuple(
+    "Clip",
+    ["start", "duration", "path", "is_valid", "filename", "sign_name", "uid", "attempt", "is_hold"],
+    defaults=(False,)
+)
+
+# Recordings whose sign lasted longer than this were held down rather than tapped
+HOLD_THRESHOLD = np.timedelta64(1, "s")
+
+ONE_SECOND = np.timedelta64(1, "s")
+
+# Cuts with less than this left once clamped to the video aren't worth an encode
+MIN_CLIP_SECONDS = 0.1
+
+# Clamping more than this off a cut is more than the buffers explain; usually the
+# recorder's clock was off
+SKEW_TOLERANCE = 1.0
+
+
+def clean_sign(sign):
+    sign = sign.replace(" / ", "")
+    sign = sign.replace(" ", "")
+    sign = sign.replace("-", "")
+    sign = sign.replace(",", "")
+    sign = sign.replace("(", "")
+    sign = sign.replace(")", "")
+    sign = sign.replace("'", "") # Maybe replacing single quotes won't break everything?
+    return sign
+
+
+# Per-uid buffer/invert overrides, read once per run:
+#   {"4a.2.1032": {"buffer_start": -0.3, "buffer_end": 0.6, "invert": false}, ...}
+def load_buffer_config(path="config.json"):
+    with open(path) as f:
+        return json.load(f)
+
+
+# The buffer (start, end) and invert flag used for one uid
+def uid_buffers(args, uid, buffer_config):
+    if uid in buffer_config:
+        return (
+            buffer_config[uid]["buffer_start"],
+            buffer_config[uid]["buffer_end"],
+            buffer_config[uid]["invert"],
+        )
+    return args.buffer[0], args.buffer[1], args.invert
+
+
+# Recorder timestamps look like 2024_03_01_10_15_42.123; numpy wants 2024-03-01T10:15:42.123
+def parse_timestamps(timestamps):
+    iso = [f"{t[0:4]}-{t[5:7]}-{t[8:10]}T{t[11:13]}:{t[14:16]}:{t[17:]}" for t in timestamps]
+    return np.array(iso, dtype="datetime64[us]")
+
+
+# Every cut of one source video, as parallel arrays (one entry per recording, in
+# sign-end order). Encoders only ever see the Clips this hands out.
+class CutPlan:
+    def __init__(self, uid, start, duration, is_hold, is_valid, paths, signs, filenames, attempts):
+        self.uid = uid
+        self.start = start
+        self.duration = duration
+        self.is_hold = is_hold
+        self.is_valid = is_valid
+        self.paths = paths
+        self.signs = signs
+        self.filenames = filenames
+        self.attempts = attempts
+
+    def __len__(self):
+        return len(self.paths)
+
+    def clip(self, i):
+        return Clip(
+            float(self.start[i]), float(self.duration[i]), self.paths[i], bool(self.is_valid[i]),
+            self.filenames[i], self.signs[i], self.uid, self.attempts[i], bool(self.is_hold[i])
+        )
+
+    def clips(self):
+        return [self.clip(i) for i in range(len(self))]
+
+    def subset(self, keep):
+        index = np.flatnonzero(keep)
+        return CutPlan(
+            self.uid, self.start[index], self.duration[index], self.is_hold[index], self.is_valid[index],
+            [self.paths[i] for i in index], [self.signs[i] for i in index],
+            [self.filenames[i] for i in index], [self.attempts[i] for i in index]
+        )
+
+
+# Computes the cut of every recording of one video in one pass.
+# Tapped signs (sign shorter than HOLD_THRESHOLD) run from the end of the previous
+# sign (or the start of the video) to this sign's start; held signs run from their
+# own start to end. Either is then shifted by the uid's buffers, or anchored on the
+# end of the span when the uid is inverted.
+def build_cut_plan(args, uid, recordings, buffer_config, make_dirs=True):
+    n = len(recordings)
+    if n == 0:
+        return CutPlan(uid, np.zeros(0), np.zeros(0), np.zeros(0, bool), np.zeros(0, bool), [], [], [], [])
+
+    signs, filenames, video_starts, sign_starts, sign_ends, is_valid, attempts = zip(*recordings)
+    is_valid = np.array(is_valid, dtype=bool)
+
+    times = parse_timestamps(video_starts + sign_starts + sign_ends)
+    video_start, sign_start, sign_end = times[:n], times[n:2 * n], times[2 * n:]
+
+    is_hold = (sign_end - sign_start) > HOLD_THRESHOLD
+
+    # To split based on taps, we set the current sign's start time to be the previous sign's end time
+    prev_end = np.empty_like(sign_end)
+    prev_end[0] = video_start[0]
+    prev_end[1:] = sign_end[:-1]
+
+    span_start = np.where(is_hold, sign_start, prev_end)
+    span_end = np.where(is_hold, sign_end, sign_start)
+
+    start = (span_start - video_start) / ONE_SECOND
+    end = (span_end - video_start) / ONE_SECOND
+
+    buffer_start, buffer_end, invert = uid_buffers(args, uid, buffer_config)
+    if invert:
+        start = end + buffer_start
+    else:
+        start = start + buffer_start
+    end = end + buffer_end
+
+    # The string that names the clip is the start of its span: the previous sign's end for taps
+    span_start_names = [
+        sign_starts[i] if is_hold[i] else (sign_ends[i - 1] if i > 0 else video_starts[0])
+        for i in range(n)
+    ]
+
+    paths = []
+    output_dirs = set()
+    for i in range(n):
+        sign = clean_sign(signs[i])
+        video_start_time = video_starts[i]
+        sign_start_time = span_start_names[i]
+        recording_idx = attempts[i]
+
+        if args.make_structured_dirs:
+            video_filename = f"{sign_start_time}-{recording_idx}.mp4"
+            output_dir = os.path.join(args.dest_dir, f"{uid}", f"{sign}")
+        elif args.make_sign_dirs:
+            if args.old_filenames:
+                video_filename = f"{uid}-{sign}-{video_start_time}-{recording_idx}.mp4"
+            else:
+                video_filename = f"{uid}-{sign}-{sign_start_time}-{recording_idx}.mp4"
+
+            output_dir = os.path.join(args.dest_dir, f"{sign}")
+        else:
+            output_dir = args.dest_dir
+            video_filename = f"{uid}-{sign}-{video_start_time}-{recording_idx}.mp4"
+
+        # Invalid held signs are set aside; invalid taps are kept with the rest since they can still be useful data
+        if is_hold[i] and not is_valid[i]:
+            output_dir = os.path.join(args.dest_dir, "invalid", f"{sign}")
+
+        output_dirs.add(output_dir)
+        paths.append(os.path.join(output_dir, video_filename))
+
+    if make_dirs:
+        for output_dir in output_dirs:
+            os.makedirs(output_dir, exist_ok=True)
+
+    return CutPlan(uid, start, end - start, is_hold, is_valid, paths, list(signs), list(filenames), list(attempts))
+
+
+# Fits every cut inside a video of video_duration seconds. Cuts running past the end are
+# cut short there (a start before 0 is left to ffmpeg, as it always was). Returns the plan
+# of the cuts still worth encoding and one problem dict per cut that was either dropped
+# ("impossible": (almost) none of it is inside the video) or cut short by more than
+# SKEW_TOLERANCE ("clamped")
+def clamp_cut_plan(plan, video_duration):
+    end = plan.start + plan.duration
+    clamped_end = np.minimum(end, video_duration)
+    keep = (clamped_end - np.maximum(plan.start, 0.0)) >= MIN_CLIP_SECONDS
+
+    problems = []
+    for i in np.flatnonzero(~keep | (end - clamped_end > SKEW_TOLERANCE)):
+        problems.append({
+            "status": "clamped" if keep[i] else "impossible",
+            "dest": plan.paths[i],
+            "sign_name": plan.signs[i],
+            "attempt": plan.attempts[i],
+            "start": float(plan.start[i]),
+            "end": float(end[i]),
+            "video_duration": float(video_duration),
+        })
+
+    clamped = CutPlan(
+        plan.uid, plan.start, clamped_end - plan.start, plan.is_hold, plan.is_valid,
+        plan.paths, plan.signs, plan.filenames, plan.attempts
+    )
+    return clamped.subset(keep), problems
@@ -0,0 +1,137 @@
+import json
+import os
+import resource
+import threading
+import time
+from collections import defaultdict
+
+
+# Wall and CPU time of a block. CPU is the calling thread's, since planning runs in a
+# thread next to the scheduler loop.
+class Stopwatch:
+    def __enter__(self):
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self.wall_start
+        self.cpu = time.thread_time() - self.cpu_start
+        return False
+
+
+# CPU time of every child process (ffmpeg) reaped so far
+def children_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+# Appends one JSON event per stage to a metrics file and keeps the totals the end of
+# run summary needs. Stages:
+#   exif_read, parse   per timestamps file (status "error" with the reason on failure)
+#   probe              per source video checked against its real length while planning
+#   plan               per timestamps file that yields clips
+#   video              per source video handed to the scheduler
+#   encode             per ffmpeg job (status "failed" with the reason on failure; in
+#                      smart_cut mode, fallbacks lists why clips were fully re-encoded)
+#
+# The file is created with the first event, so a run that records nothing leaves none behind.
+class DecodeMetrics:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+        self.started = time.perf_counter()
+
+        self.stages = defaultdict(lambda: {"count": 0, "wall": 0.0, "cpu": 0.0, "errors": 0})
+        self.by_uid = defaultdict(lambda: {
+            "videos": 0, "clips": 0, "clip_seconds": 0.0, "encode_wall": 0.0,
+            "input_bytes": 0, "output_bytes": 0, "failures": 0,
+        })
+        self.by_video = defaultdict(lambda: {"uid": None, "clips": 0, "clip_seconds": 0.0, "encode_wall": 0.0})
+        self.failure_reasons = defaultdict(int)
+        self.fallback_reasons = defaultdict(int)
+
+    def event(self, stage, **fields):
+        fields = dict(fields, stage=stage, time=time.time())
+        with self.lock:
+            if self.file is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self.file = open(self.path, "a")
+            self.file.write(json.dumps(fields) + "\n")
+            self.record(stage, fields)
+
+    def record(self, stage, fields):
+        stats = self.stages[stage]
+        stats["count"] += 1
+        stats["wall"] += fields.get("wall", 0.0)
+        stats["cpu"] += fields.get("cpu", 0.0)
+        if fields.get("status", "ok") != "ok":
+            stats["errors"] += 1
+            self.failure_reasons[f"{stage}: {fields.get('reason')}"] += 1
+
+        uid = fields.get("uid")
+        if stage == "video":
+            self.by_uid[uid]["videos"] += 1
+            self.by_uid[uid]["input_bytes"] += fields["source_bytes"]
+        elif stage == "encode":
+            uid_stats = self.by_uid[uid]
+            video = self.by_video[fields["source"]]
+            video["uid"] = uid
+            for counts in (uid_stats, video):
+                counts["clips"] += fields["clips"]
+                counts["clip_seconds"] += fields["clip_seconds"]
+                counts["encode_wall"] += fields["wall"]
+            uid_stats["output_bytes"] += fields["output_bytes"]
+            for reason in fields.get("fallbacks", ()):
+                self.fallback_reasons[reason] += 1
+            if fields["status"] != "ok":
+                uid_stats["failures"] += 1
+
+    def summary(self, top=10):
+        elapsed = time.perf_counter() - self.started
+        where = f"Metrics in {self.path}" if self.file is not None else "No metrics recorded"
+        lines = [f"{where} ({elapsed:.1f}s wall)", ""]
+
+        lines.append(f"{'stage':10} {'count':>7} {'wall s':>9} {'cpu s':>9} {'cpu/wall':>8} {'errors':>7}")
+        for stage, stats in self.stages.items():
+            ratio = stats["cpu"] / stats["wall"] if stats["wall"] else 0.0
+            lines.append(f"{stage:10} {stats['count']:7d} {stats['wall']:9.1f} {stats['cpu']:9.1f} {ratio:8.2f} {stats['errors']:7d}")
+
+        lines += ["", f"{'uid':16} {'videos':>6} {'clips':>6} {'clip s':>8} {'encode s':>9} {'clips/s':>8} {'in MB':>8} {'out MB':>8} {'failed':>6}"]
+        for uid, stats in sorted(self.by_uid.items(), key=lambda item: str(item[0])):
+            rate = stats["clips"] / stats["encode_wall"] if stats["encode_wall"] else 0.0
+            lines.append(
+                f"{str(uid):16} {stats['videos']:6d} {stats['clips']:6d} {stats['clip_seconds']:8.1f} {stats['encode_wall']:9.1f} "
+                f"{rate:8.2f} {stats['input_bytes'] / 1e6:8.1f} {stats['output_bytes'] / 1e6:8.1f} {stats['failures']:6d}"
+            )
+
+        slowest = sorted(self.by_video.items(), key=lambda item: item[1]["encode_wall"], reverse=True)[:top]
+        if slowest:
+            lines += ["", f"Slowest {len(slowest)} videos (encode s / clip s):"]
+            for source, stats in slowest:
+                ratio = stats["encode_wall"] / stats["clip_seconds"] if stats["clip_seconds"] else 0.0
+                lines.append(f"  {stats['encode_wall']:8.1f} {ratio:6.2f}x  {stats['clips']:4d} clips  {source}")
+
+        if self.fallback_reasons:
+            lines += ["", "Smart cut fallbacks to a full re-encode:"]
+            for reason, count in sorted(self.fallback_reasons.items(), key=lambda item: -item[1])[:top]:
+                lines.append(f"  {count:6d}  {reason}")
+
+        if self.failure_reasons:
+            lines += ["", "Failures:"]
+            for reason, count in sorted(self.failure_reasons.items(), key=lambda item: -item[1])[:top]:
+                lines.append(f"  {count:6d}  {reason}")
+        return "\n".join(lines)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
@@ -1,29 +1,87 @@
-from PIL import Image
-from PIL.ExifTags import TAGS
 import datetime
 from tqdm import tqdm
-from multiprocess import Pool, Lock
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 
-import re
 import os
 import argparse
 import json
 
+from clip_catalog import CATALOG_FILENAME, ClipCatalog
+from clip_manifest import ClipManifest, MANIFEST_FILENAME, clip_key
+from cut_plan import build_cut_plan, clamp_cut_plan, load_buffer_config
+from decode_metrics import DecodeMetrics, Stopwatch, file_size
+from encoding_profiles import (
+    AUDIO_MODES, PROFILES, ProfileStats, audio_args, cpu_count, encoder_threads, profile_signature, resolve_profile, video_args
+)
+from ffmpeg_runner import FFmpegError, FFmpegRunner
+from probe_cache import PROBE_CACHE_FILENAME, ProbeCache, probe_video
+from review_proxy import PROXY_CRF, PROXY_HEIGHT, review_dir, review_output_args
+from plan_files import PlanSummary, PlanWriter, clip_from_row, plan_rows, read_plan, shard_path
+from sharding import SHARD_STRATEGIES, assign_shards
+from source_index import INDEX_CACHE_FILENAME, index_sources
+from timestamps_parser import TimestampsParseError, load_timestamps, parse_description, read_image_description
+
 import subprocess
+import shutil
+import tempfile
+import queue
+import asyncio
+import threading
+import time
+
+# One ffmpeg-level unit of work for the scheduler: one or more clips cut from the same source video
+# threads is how many of the --cpu_budget threads its encoders use between them
+ClipJob = namedtuple("ClipJob", ["videopath", "clips", "probe", "keys", "threads"])
 
-log_lock = Lock()
+# Heads shorter than this (roughly a frame) are not worth re-encoding, the clip just starts on the keyframe
+SMART_CUT_MIN_HEAD = 0.02
+
+# Source H.264 profiles we can match with libx264 so the re-encoded head and the copied tail share a profile
+SMART_CUT_PROFILES = {
+    "Constrained Baseline": "baseline",
+    "Baseline": "baseline",
+    "Main": "main",
+    "High": "high",
+}
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("--job_array_num", required=False, type=int) #Matthew said not to worry about this
-    parser.add_argument("--backup_dir", required=True, type=str, help="Also known as the source directory")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=["run", "plan", "execute"],
+        default="run",
+        help="run: plan and extract in one go (default). plan: only parse the timestamps files and write the cut plan to --plan_file. "
+             "execute: extract the clips listed in --plan_file (or one shard of it) without looking at --backup_dir",
+    )
+    parser.add_argument("--job_array_num", required=False, type=int, help="Same as --shard_index, e.g. --job_array_num $SLURM_ARRAY_TASK_ID. Needs --num_shards set to the size of the array")
+    parser.add_argument("--backup_dir", type=str, nargs="+", help="Also known as the source directory. Several can be given to decode multiple users in one run")
     parser.add_argument("--dest_dir", required=True, type=str)
     parser.add_argument("--video_dim", nargs=2, type=int, default=(1080, 1920))
     parser.add_argument("--log_file", type=str, default=None)
-    parser.add_argument("--skip_extraction", action="store_true")
+    parser.add_argument("--metrics_file", type=str, default=None, help="JSONL file that per-stage timings, sizes and failures are appended to. Defaults to <log_file>.metrics.jsonl")
+    parser.add_argument("--skip_extraction", action="store_true", help="Same as the plan command")
+    parser.add_argument("--plan_file", type=str, default=None, help="Cut plan written by plan and read by execute, .jsonl or .parquet (needs pyarrow). Defaults to dest_dir/plan.jsonl")
+    parser.add_argument("--num_shards", type=int, default=None, help="Split the source videos into this many shards. run and execute process the shard given by --shard_index; plan writes one plan file per shard unless --shard_index is given. Defaults to 1; required with --job_array_num")
+    parser.add_argument("--shard_index", type=int, default=None, help="Which shard (0-based) this job processes")
+    parser.add_argument(
+        "--shard_strategy",
+        choices=SHARD_STRATEGIES,
+        default="hash",
+        help="hash: by a stable hash of the video name, so shards only change for added/removed videos (default). "
+             "balance: greedily even out the estimated clip-seconds per shard; every job parses all timestamps files to agree on the split",
+    )
+    parser.add_argument("--max_parse_errors", type=int, default=50, help="Abort the run once more than this many timestamps files fail to parse")
+    parser.add_argument("--index_cache", type=str, default=None, help=f"Where the listing of each backup dir is cached between runs. Defaults to dest_dir/{INDEX_CACHE_FILENAME}")
+    parser.add_argument("--no_index_cache", action="store_true", help="List every backup dir and don't read or write the index cache")
+    parser.add_argument("--rescan", action="store_true", help="List every backup dir again and refresh the index cache, e.g. after files were replaced in place")
+    parser.add_argument("--probe_cache", type=str, default=None, help=f"SQLite cache of ffprobe results per source video. Defaults to dest_dir/{PROBE_CACHE_FILENAME}")
+    parser.add_argument("--no_probe", action="store_true", help="Don't probe source videos while planning, so cuts aren't checked against the video's real length")
+    parser.add_argument("--no_catalog", action="store_true", help=f"Don't record the clips written in dest_dir/{CATALOG_FILENAME}, which the annotation UI lists batches from")
+    parser.add_argument("--batch_name", type=str, default=None, help="Batch the clips are catalogued under. Defaults to the name of dest_dir")
+    parser.add_argument("--no_manifest", action="store_true", help="Don't use dest_dir/clip_manifest.sqlite to skip clips finished by an earlier run; re-encode everything")
     parser.add_argument(
         "--buffer",
         nargs=2,
@@ -34,7 +92,33 @@ def parse_args():
     parser.add_argument(
         "--invert", action="store_true", help="Switch start/end timestamps."
     )
-    parser.add_argument("--num_threads", type=int, default=5)
+    parser.add_argument("--num_threads", type=int, default=None, help="The most ffmpeg processes running at once. Defaults to --cpu_budget")
+    parser.add_argument("--cpu_budget", type=int, default=None, help="Total encoder threads across all running ffmpegs. Defaults to the number of usable cores")
+    parser.add_argument("--queue_size", type=int, default=None, help="Maximum number of planned files waiting for ffmpeg. Defaults to 4x --num_threads")
+    parser.add_argument("--ffmpeg_timeout", type=float, default=60.0, help="Seconds every ffmpeg process gets on top of --ffmpeg_timeout_per_second")
+    parser.add_argument("--ffmpeg_timeout_per_second", type=float, default=10.0, help="Seconds of ffmpeg time allowed per second of clip before it is killed")
+    parser.add_argument("--ffmpeg_retries", type=int, default=1, help="How many times a failed or timed out ffmpeg is retried")
+    parser.add_argument(
+        "--encoding_profile",
+        choices=["auto"] + list(PROFILES),
+        default="auto",
+        help="auto: encode taps with the tap profile (single-threaded, many at once) and holds with the hold profile (threads scaled to the clip length)",
+    )
+    parser.add_argument("--preset", type=str, default=None, help="Override the profile's libx264 preset")
+    parser.add_argument("--crf", type=int, default=None, help="Override the profile's libx264 CRF")
+    parser.add_argument("--encoder_threads", type=int, default=None, help="Override the profile's threads per ffmpeg process")
+    parser.add_argument("--audio", choices=AUDIO_MODES, default=None, help="Override the profile's audio handling")
+    parser.add_argument(
+        "--extract_mode",
+        choices=["clip", "video", "smart_cut"],
+        default="clip",
+        help="clip: one ffmpeg process per sign (default). video: decode each source video once and extract all of its clips in a single ffmpeg process. "
+             "smart_cut: only re-encode each clip up to its first keyframe and stream-copy the rest, falling back to clip when that is not possible",
+    )
+    parser.add_argument("--clips_per_ffmpeg", type=int, default=0, help="With --extract_mode video, cap the number of clips (encoders) per ffmpeg process. 0 means all clips of a video in one process")
+    parser.add_argument("--review_proxies", action="store_true", help="Also write a small faststart proxy and a poster JPEG of every clip to a .review dir next to it, from the same decode. The annotation UI serves the proxy when there is one")
+    parser.add_argument("--proxy_height", type=int, default=PROXY_HEIGHT, help="Height of the review proxies and posters (never upscaled)")
+    parser.add_argument("--proxy_crf", type=int, default=PROXY_CRF, help="libx264 CRF of the review proxies")
     parser.add_argument("--make_structured_dirs", action="store_true", help="Creates directories in the format of (uid)(sign)/sign_start_time-recording_idx.mp4 instead of uid-sign-video_start_time-recording_idx.mp4")
     parser.add_argument("--make_sign_dirs", action="store_true", help="Creates directories in the format of (sign)/uid-sign-sign_start_time-recording_idx.mp4")
     parser.add_argument("--use_cuda", type=bool, default=False, help="Use CUDA acceleration")
@@ -57,551 +141,739 @@ def parse_args():
 
     
     args = parser.parse_args()
+    if args.skip_extraction:
+        args.command = "plan"
+    if args.command != "execute" and not args.backup_dir:
+        parser.error(f"--backup_dir is required for {args.command}")
+    if args.job_array_num is not None:
+        # --job_array_num used to pick a batch file; the shard count can't be guessed
+        if args.num_shards is None:
+            parser.error("--job_array_num needs --num_shards (the size of the job array)")
+        args.shard_index = args.job_array_num
+    if args.num_shards is None:
+        args.num_shards = 1
+    if args.num_shards < 1:
+        parser.error("--num_shards must be at least 1")
+    if args.shard_index is None and args.num_shards > 1 and args.command != "plan":
+        parser.error(f"--shard_index is required for {args.command} with --num_shards")
+    if args.shard_index is not None and not 0 <= args.shard_index < args.num_shards:
+        parser.error(f"--shard_index must be between 0 and {args.num_shards - 1}")
+    if args.review_proxies and args.use_cuda:
+        parser.error("--review_proxies needs the libx264 path, not --use_cuda")
+    if args.batch_name is None:
+        args.batch_name = os.path.basename(os.path.abspath(args.dest_dir))
+    if args.plan_file is None:
+        args.plan_file = os.path.join(args.dest_dir, "plan.jsonl")
+    if args.probe_cache is None:
+        args.probe_cache = os.path.join(args.dest_dir, PROBE_CACHE_FILENAME)
+    if args.index_cache is None:
+        args.index_cache = os.path.join(args.dest_dir, INDEX_CACHE_FILENAME)
+    if args.cpu_budget is None:
+        args.cpu_budget = cpu_count()
+    if args.num_threads is None:
+        args.num_threads = args.cpu_budget
+    if args.queue_size is None:
+        args.queue_size = 4 * args.num_threads
     return args
 
 
-def get_image_description(exifdata):
-    description = ""
-    # iterating over all EXIF data fields
-    for tag_id in exifdata:
-        # get the tag name, instead of human unreadable tag id
-        tag = TAGS.get(tag_id, tag_id)
-        data = exifdata.get(tag_id)
-        # decode bytes
-        if isinstance(data, bytes):
-            data = data.decode()
-        # print(f"{tag:25}: {data}")
-        if tag == "ImageDescription":
-            description = data
-
-    #print("Image Description:", description)
-    return description
-
-error_count = 0
-def get_data_from_description(description, error_log='/data/Mobile-Data-Processing-Pipeline/decode_split_by_length.log'):
-    is_valid_exists = "isValid" in description
-
-    subbed = re.sub(r"file=(.*?),", r'"\1",', description)
-    subbed = re.sub(r"videoStart=(.*?),", r'"\1",', subbed)
-    subbed = re.sub(r"signStart=(.*?),", r'"\1",', subbed)
-
-    if is_valid_exists:
-        subbed = re.sub(r"signEnd=(.*?),", r'"\1",', subbed)
-        subbed = re.sub(r"isValid=(.*?),", r'\1,', subbed)
-    else:
-        subbed = re.sub(r"signEnd=(.*?),", r'"\1")', subbed)
+def clip_result(clip):
+    if clip.is_valid:
+        return True, None, None
+    return False, clip.filename, clip.sign_name
 
-    #Purposely break things for now
-    subbed = re.sub(r'\\/', '/', subbed) # Replace all instances of \\/ with /
-    subbed = re.sub(r'"\[', '[', subbed) # Replaces all instances of "[ with [
-    subbed = re.sub(r'\]"', ']', subbed) # Replaces all instances of ]" with ]
-    subbed = re.sub(r'\\r', '', subbed) # Remove all return carriages
-    subbed = re.sub(r'\."', '"', subbed) # Remove all periods at the end of phrases
 
-    subbed = re.sub(r'attempt=(.*?)', r'\1', subbed) #Remove the attribute "attempt=*" as it was causing issues in terms of decoding
-    subbed = re.sub(r'isValid=(.*?)', r'\1', subbed) #Remove the attribute "IsValid=True" -> "True" for similar reason as above
-    
-    subbed = clean_contractions(subbed) # Replace common contractions to ensure json parses correctly
+# The profile a clip is encoded with and its libx264 thread count
+def clip_encoding(args, clip):
+    profile = resolve_profile(args, clip.is_hold)
+    return profile, encoder_threads(profile, clip.duration, args.cpu_budget)
 
-    # There are often many errors when it comes to parsing the files
-    # Don't want to kill the process simply because there was one corrupt file
-    # Only kill if 50 files fail to load
-    try:
-        data = eval(subbed)
-    except:
-        global error_count
-        error_count += 1
-        log = open(error_log, "w")
-        log.write(subbed)
-        if (error_count > 50):
-            raise("Decode Error. 50 files failed to decode")
-        return -1, -1
-
-    return data, is_valid_exists
-
-
-def clean_sign(sign):
-    sign = sign.replace(" / ", "")
-    sign = sign.replace(" ", "")
-    sign = sign.replace("-", "")
-    sign = sign.replace(",", "")
-    sign = sign.replace("(", "")
-    sign = sign.replace(")", "")
-    sign = sign.replace("'", "") # Maybe replacing single quotes won't break everything?
-    return sign
-
-#Only cleaning up stuff that appears in review_313 right now
-def clean_contractions(input_string):
-    #When parsing strings that use '' as boundary markers, replace apostrophes
-    #in common contractions with \'
-    
-    #input_string = input_string.replace('don\'t', 'dont')
-    #input_string = input_string.replace('pet\'s name', 'pets name')
-    input_string = re.sub(r'pet\'s name', 'pets name', input_string)
-    input_string = re.sub(r'don\'t', 'dont', input_string)
-    return input_string
-
-
-# Extracts a video clip if the user held down the button instead of tapping
-# args: CLI arguments; uid: User ID of the sign; recording_idx: attempt # of the sign;
-def extract_clip_from_video_hold(
-        args, uid, sign, recording_idx, recording, videopath, is_valid_exists, reject=False
-):
-    with open("config.json") as f:
-        config = json.load(f)
-
-    #print("Recording: ", recording)
-    if is_valid_exists:
-        signName, filename, video_start_time, sign_start_time, sign_end_time, is_valid, attempt = recording
-    else:
-        signName, filename, video_start_time, sign_start_time, sign_end_time = recording
-        is_valid = True
 
-    video_start_time_date = datetime.datetime.strptime(
-        video_start_time + "000", "%Y_%m_%d_%H_%M_%S.%f"
-    )
-    sign_start_time_date = datetime.datetime.strptime(
-        sign_start_time + "000", "%Y_%m_%d_%H_%M_%S.%f"
-    )
-    sign_end_time_date = datetime.datetime.strptime(
-        sign_end_time + "000", "%Y_%m_%d_%H_%M_%S.%f"
-    )
-    sign = clean_sign(sign)
-
-    #if is_valid:
-    #    print(sign_end_time_date - sign_start_time_date)
-    # print(
-    #     "Video Info: ", sign, filename, video_start_time, sign_start_time, sign_end_time
-    # )
-
-    start_seconds = sign_start_time_date - video_start_time_date
-    end_seconds = sign_end_time_date - video_start_time_date
-
-    start_subclip = start_seconds.seconds + start_seconds.microseconds / 1e6
-    end_subclip = end_seconds.seconds + end_seconds.microseconds / 1e6
-
-    if uid in config:
-        
-        buffer_0 = config[uid]["buffer_start"]
-        buffer_1 = config[uid]["buffer_end"]
-        invert = config[uid]["invert"]
-        #print(f"Found {uid} in config.json")
-        #print(f"SIGN, filename: {sign}, {filename}")
-        #print(f"Start_subclip, end_subclip: {start_subclip}, {end_subclip}\n Buffer: ({buffer_0}, {buffer_1})")
-        if invert:
-            start_subclip = end_subclip + buffer_0
-            end_subclip += buffer_1
-        else:
-            start_subclip += buffer_0
-            end_subclip += buffer_1
-        #print(f"New Start_subclip, end_subclip: {start_subclip}, {end_subclip}")
+# How many budget threads a job takes while it runs
+def job_threads(args, clips):
+    if args.use_cuda:
+        return 1
+    threads = sum(clip_encoding(args, clip)[1] for clip in clips)
+    return max(1, min(args.cpu_budget, threads))
 
-    else:
-        #print(f"Could not find {uid} in config.json file")
-        #print(f"SIGN, filename: {sign}, {filename}")
-        #print(f"Start_subclip, end_subclip: {start_subclip}, {end_subclip}\n Buffer: ({args.buffer[0]}, {args.buffer[1]})")
-        if args.invert:
-            start_subclip = end_subclip + args.buffer[0]
-            end_subclip += args.buffer[1]
-        else:
-           
-            start_subclip += args.buffer[0]
-            end_subclip += args.buffer[1]
-        #print(f"New Start_subclip, end_subclip: {start_subclip}, {end_subclip}")
 
-            
-    output_dir = args.dest_dir
-    
-
-    if args.make_structured_dirs:
-        video_filename = f"{sign_start_time}-{recording_idx}.mp4"
-        output_dir = os.path.join(args.dest_dir, f"{uid}", f"{sign}")
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-    elif args.make_sign_dirs:
-        
+def build_clip_command(args, clip, videopath):
+    if args.use_cuda:
+        return [
+            "ffmpeg", "-y", "-nostdin",
+            "-loglevel", args.ffmpeg_loglevel,
+            "-hwaccel", "cuda",
+            "-hwaccel_output_format", "cuda",
+            "-i", videopath,
+            "-vf", f"scale={str(args.video_dim[0])}:{str(args.video_dim[1])}",
+            "-ss", f"{clip.start:.2f}",
+            "-t", f"{clip.duration:.2f}",
+            "-c:v", "hevc_nvenc",
+            "-c:a", "copy",
+            str(clip.path),
+        ]
+
+    profile, threads = clip_encoding(args, clip)
+    return [
+        "ffmpeg", "-y", "-nostdin",
+        "-loglevel", args.ffmpeg_loglevel,
+        "-threads", str(threads),
+        "-ss", f"{clip.start:.2f}",
+        "-i", videopath,
+        "-t", f"{clip.duration:.2f}",
+    ] + video_args(profile, threads) + audio_args(profile) + [
+        clip.path,
+    ] + clip_review_args(args, clip)
+
+
+# With --review_proxies, the outputs that write a clip's proxy and poster in the same
+# ffmpeg as the clip. offset is where the clip starts relative to the input's seek.
+def clip_review_args(args, clip, offset=0.0):
+    if not args.review_proxies:
+        return []
+    profile = resolve_profile(args, clip.is_hold)
+    return review_output_args(clip.path, clip.duration, offset, args.proxy_height, args.proxy_crf, audio=profile.audio != "none")
+
+
+async def run_clip_ffmpeg(args, runner, clip, videopath):
+    return await runner.run(build_clip_command(args, clip, videopath), clip.duration)
+
+
+# Builds a single ffmpeg command that decodes the source video once and feeds one
+# libx264 encoder per clip. The input is fast-seeked to the earliest clip so the
+# head of the recording is never decoded; every output then trims itself with an
+# output-side -ss/-t relative to that point.
+def build_multi_clip_command(args, videopath, clips):
+    seek = max(0.0, round(min(clip.start for clip in clips), 2))
+
+    cmd = [
+        "ffmpeg", "-y", "-nostdin",
+        "-loglevel", args.ffmpeg_loglevel,
+        "-threads", str(job_threads(args, clips)),
+        "-ss", f"{seek:.2f}",
+        "-i", videopath,
+    ]
+    for clip in clips:
+        offset = max(0.0, round(clip.start, 2) - seek)
+        profile, threads = clip_encoding(args, clip)
+        cmd += [
+            "-ss", f"{offset:.2f}",
+            "-t", f"{clip.duration:.2f}",
+        ] + video_args(profile, threads) + audio_args(profile) + [
+            clip.path,
+        ] + clip_review_args(args, clip, offset)
+    return cmd
+
+
+# Groups the clips of one source video into ffmpeg invocations: all of them in one
+# process unless --clips_per_ffmpeg caps the number of simultaneous encoders. Clips
+# have unique paths by now (see dedupe_clips).
+def chunk_clips(args, clips):
+    chunk_size = args.clips_per_ffmpeg if args.clips_per_ffmpeg > 0 else len(clips)
+    return [clips[i:i + chunk_size] for i in range(0, len(clips), chunk_size)]
+
+
+# Two recordings can map to the same output file (legacy recorders without an attempt
+# number give every retake attempt 0). Only the later one is kept, in every extract
+# mode: encoding both would race on the file and leave the manifest keyed on whichever
+# finished last. Dropped clips go to error/duplicateClips.jsonl.
+def dedupe_clips(args, filename, videopath, clips):
+    unique = {}
+    duplicates = []
+    for clip in clips:
+        dropped = unique.pop(clip.path, None)
+        if dropped is not None:
+            duplicates.append((dropped, clip))
+        unique[clip.path] = clip
+    if duplicates:
+        with open(os.path.join(args.dest_dir, "error", "duplicateClips.jsonl"), "a") as f:
+            for dropped, kept in duplicates:
+                f.write(json.dumps({
+                    "filename": filename,
+                    "source": videopath,
+                    "path": kept.path,
+                    "sign_name": kept.sign_name,
+                    "kept": {"start": round(float(kept.start), 3), "duration": round(float(kept.duration), 3), "attempt": kept.attempt},
+                    "dropped": {"start": round(float(dropped.start), 3), "duration": round(float(dropped.duration), 3), "attempt": dropped.attempt},
+                }) + "\n")
+    return list(unique.values()), len(duplicates)
+
+
+async def extract_clips_from_video(args, runner, videopath, clips):
+    cmd = build_multi_clip_command(args, videopath, clips)
+    return await runner.run(cmd, sum(clip.duration for clip in clips))
+
+
+def first_keyframe_in(keyframes, start, end):
+    for keyframe in keyframes:
+        if keyframe >= start - 0.001:
+            return keyframe if keyframe < end else None
+    return None
+
+
+# Why a source can't be smart-cut with this profile, or None if it can. A rotated
+# source would come out with the re-encoded head turned upright by autorotate but the
+# copied tail not (MPEG-TS drops the display matrix); the head's audio is re-encoded
+# to AAC, so the copied tail's must be AAC already.
+def smart_cut_blocker(probe, profile):
+    if probe is None:
+        return "no probe"
+    if probe.codec_name != "h264":
+        return f"codec {probe.codec_name}"
+    if probe.pix_fmt != "yuv420p":
+        return f"pix_fmt {probe.pix_fmt}"
+    if probe.profile not in SMART_CUT_PROFILES:
+        return f"profile {probe.profile}"
+    if probe.rotation:
+        return f"rotation {probe.rotation}"
+    if profile.audio != "none" and probe.audio_codec not in (None, "aac"):
+        return f"audio {probe.audio_codec}"
+    return None
+
+
+# Cuts a clip by re-encoding only the part before the first keyframe inside it and
+# stream-copying the rest. Both parts go through MPEG-TS so they can be joined with
+# the concat protocol. Anything we can't do cleanly falls back to a full re-encode.
+# Returns the FFmpegResult of every process it ran and why it fell back (None if it
+# didn't); an ffmpeg failure that made it fall back is logged to error/smartCutFallbacks.txt.
+async def smart_cut_clip(args, runner, clip, videopath, probe):
+    start = max(0.0, round(clip.start, 2))
+    end = round(clip.start, 2) + round(clip.duration, 2)
+
+    profile, threads = clip_encoding(args, clip)
+    fallback = smart_cut_blocker(probe, profile)
+    keyframe = None
+    if fallback is None:
+        keyframe = first_keyframe_in(probe.keyframes, start, end)
+        if keyframe is None:
+            fallback = "no keyframe in clip"
+
+    if keyframe is None:
+        return [await run_clip_ffmpeg(args, runner, clip, videopath)], fallback
+
+    # The head's audio is re-encoded to AAC so both parts concatenate
+    head_audio = ["-an"] if profile.audio == "none" else ["-c:a", "aac"]
+    tail_audio = ["-an"] if profile.audio == "none" else []
 
-        if args.old_filenames:
-            video_filename = f"{uid}-{sign}-{video_start_time}-{recording_idx}.mp4"
+    results = []
+    tmp_dir = tempfile.mkdtemp(prefix=".smartcut-", dir=os.path.dirname(clip.path))
+    try:
+        parts = []
+        head_duration = keyframe - start
+        if head_duration > SMART_CUT_MIN_HEAD:
+            head = os.path.join(tmp_dir, "head.ts")
+            results.append(await runner.run(
+                [
+                    "ffmpeg", "-y", "-nostdin", "-loglevel", args.ffmpeg_loglevel,
+                    "-threads", str(threads),
+                    "-ss", f"{start:.2f}", "-i", videopath,
+                    "-t", f"{head_duration:.6f}",
+                ] + video_args(profile, threads) + [
+                    "-profile:v", SMART_CUT_PROFILES[probe.profile], "-pix_fmt", "yuv420p",
+                ] + head_audio + [
+                    "-f", "mpegts", head,
+                ],
+                head_duration
+            ))
+            parts.append(head)
         else:
-            video_filename = f"{uid}-{sign}-{sign_start_time}-{recording_idx}.mp4"
+            head_duration = 0.0
 
-        print(f"Sign: {sign}:\n\targs.old_filenames: {args.old_filenames}, video_filename: {video_filename}\n\tvideo_start_time: {video_start_time}, sign_start_time: {sign_start_time}")
-
-        output_dir = os.path.join(args.dest_dir, f"{sign}")
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-    else:
-        output_dir = args.dest_dir
-        #print("Filename Struct: ", uid, sign, video_start_time, recording_idx)
-        video_filename = f"{uid}-{sign}-{video_start_time}-{recording_idx}.mp4"
-    
-    
-    if not is_valid:
-        output_dir = os.path.join(args.dest_dir, "invalid", f"{sign}")
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
-    time = end_subclip - start_subclip
-    full_filename = os.path.join(output_dir, video_filename)
-
-    if args.use_cuda:
-        subprocess.run(
+        tail = os.path.join(tmp_dir, "tail.ts")
+        results.append(await runner.run(
+            [
+                "ffmpeg", "-y", "-nostdin", "-loglevel", args.ffmpeg_loglevel,
+                "-ss", f"{keyframe:.6f}", "-i", videopath,
+                "-t", f"{end - keyframe:.6f}",
+                "-c", "copy", "-bsf:v", "h264_mp4toannexb",
+            ] + tail_audio + [
+                "-output_ts_offset", f"{head_duration:.6f}",
+                "-f", "mpegts", tail,
+            ],
+            end - keyframe
+        ))
+        parts.append(tail)
+
+        results.append(await runner.run(
             [
-                "ffmpeg",
-                "-hwaccel",
-                "cuda",
-                "-hwaccel_output_format",
-                "cuda",
-                "-i",
-                videopath,
-                "-vf",
-                f"scale={str(args.video_dim[0])}:{str(args.video_dim[1])}",
-                "-ss",
-                start_subclip.strftime("%H:%M:%S.%f")[:-3],
-                "-t",
-                end_subclip.strftime("%H:%M:%S.%f")[:-3],
-                "-c:v",
-                "hevc_nvenc",
-                "-c:a",
-                "copy",
-                str(full_filename),
-                "-loglevel",
-                args.ffmpeg_loglevel,
-            ]
+                "ffmpeg", "-y", "-nostdin", "-loglevel", args.ffmpeg_loglevel,
+                "-i", "concat:" + "|".join(parts),
+                "-c", "copy", "-bsf:a", "aac_adtstoasc",
+                clip.path,
+            ] + clip_review_args(args, clip),
+            clip.duration
+        ))
+    except FFmpegError as e:
+        fallback = f"smart cut failed: {e.reason}"
+        with open(os.path.join(args.dest_dir, "error", "smartCutFallbacks.txt"), "a") as f:
+            f.write(f"{videopath}, {clip.path}, {failure_summary(e)}\n")
+        results.append(await run_clip_ffmpeg(args, runner, clip, videopath))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return results, fallback
+
+
+# Everything that changes the bytes ffmpeg writes for a given cut; part of each clip's manifest key
+def encoding_signature(args, clip):
+    signature = f"mode={args.extract_mode};cuda={args.use_cuda};dim={args.video_dim[0]}x{args.video_dim[1]}"
+    profile = profile_signature(resolve_profile(args, clip.is_hold))
+    if profile:
+        signature += f";x264={profile}"
+    if args.review_proxies:
+        signature += f";review={args.proxy_height}/{args.proxy_crf}"
+    return signature
+
+
+# Reads and parses one timestamps file, recording each stage in metrics
+def load_timestamps_timed(path, uid, metrics=None):
+    if metrics is None:
+        return load_timestamps(path)
+
+    stage = "exif_read"
+    try:
+        with Stopwatch() as read_time:
+            description = read_image_description(path)
+        metrics.event(stage, file=os.path.basename(path), uid=uid, wall=read_time.wall, cpu=read_time.cpu, bytes=file_size(path), status="ok")
+
+        stage = "parse"
+        with Stopwatch() as parse_time:
+            timestamps = parse_description(description, path)
+        metrics.event(stage, file=os.path.basename(path), uid=uid, wall=parse_time.wall, cpu=parse_time.cpu, recordings=len(timestamps.recordings), status="ok")
+    except TimestampsParseError as e:
+        metrics.event(stage, file=os.path.basename(path), uid=uid, status="error", reason=e.reason, offset=e.offset)
+        raise
+    return timestamps
+
+
+# Parses one timestamps file and computes the cut of every recording in its video.
+# With probes, cuts are then fitted to the video's real length (see clamp_cut_plan).
+# Returns (videopath, CutPlan), or None when the file yields no clips. Raises
+# TimestampsParseError for malformed files; the caller logs it and moves on.
+def plan_file(args, source, buffer_config, make_dirs=True, metrics=None, probes=None):
+    filename = os.path.basename(source.timestamps_path)
+    timestamps = load_timestamps_timed(source.timestamps_path, source.uid, metrics)
+
+    if len(timestamps.keys) > 1:  # We want to skip videos that only have 1 sign in them
+        with Stopwatch() as plan_time:
+            # Sort the data by date
+            sortedData = sorted(timestamps.recordings, key=lambda tup: tup[4])
+            plan = build_cut_plan(args, source.uid, sortedData, buffer_config, make_dirs)
+        if metrics is not None:
+            metrics.event("plan", file=filename, uid=source.uid, wall=plan_time.wall, cpu=plan_time.cpu, clips=len(plan), status="ok")
+        if probes is not None:
+            plan = fit_to_video(args, source, plan, probes, metrics)
+        return source.video_path, plan
+
+    noSigns = open(os.path.join(args.dest_dir, "error/noSigns.txt"), "a")
+    noSigns.write(filename + "\n")
+    noSigns.close()
+    return None
+
+
+# Drops or shortens the cuts of a plan that run past the end of its video. What was
+# changed is logged to error/cutProblems.jsonl.
+def fit_to_video(args, source, plan, probes, metrics=None):
+    filename = os.path.basename(source.timestamps_path)
+    with Stopwatch() as probe_time:
+        hits = probes.hits
+        probe = probes.probe(source.video_path, source.video_size, source.video_mtime)
+    if metrics is not None:
+        metrics.event(
+            "probe", file=filename, uid=source.uid, wall=probe_time.wall, cpu=probe_time.cpu,
+            cached=probes.hits > hits, status="ok" if probe is not None else "error",
+            reason=None if probe is not None else "ffprobe failed",
         )
-    else:
-        args = (
-            f"ffmpeg -y -nostdin -ss {start_subclip:.2f} -i {videopath} "
-            f"-t {time:.2f} -c:v libx264 {full_filename}"
+    if probe is None or probe.duration is None:
+        return plan
+
+    plan, problems = clamp_cut_plan(plan, probe.duration)
+    if problems:
+        with open(os.path.join(args.dest_dir, "error", "cutProblems.jsonl"), "a") as f:
+            for problem in problems:
+                f.write(json.dumps(dict(problem, filename=filename, source=source.video_path)) + "\n")
+    return plan
+
+
+# Turns the clips of one source video into ffmpeg jobs, leaving out clips a previous run
+# already finished with the same inputs
+def make_clip_jobs(args, videopath, clips, manifest=None, probes=None):
+    todo = clips
+    key_by_path = {}
+    if manifest is not None:
+        source_stat = os.stat(videopath)
+        todo = []
+        for clip in clips:
+            key = clip_key(clip, videopath, source_stat, encoding_signature(args, clip))
+            key_by_path[clip.path] = key
+            if not manifest.is_complete(clip, key):
+                todo.append(clip)
+
+    def make_job(job_clips, probe=None):
+        return ClipJob(
+            videopath, job_clips, probe, [key_by_path.get(clip.path) for clip in job_clips], job_threads(args, job_clips)
         )
 
-        # Call ffmpeg directly
-        subprocess.run(args, shell=True, check=True) 
-
-    if is_valid:
-        return True, None, None
-    return False, filename, signName
-
-
-def extract_clip_from_video(
-        args, uid, sign, recording_idx, recording, prevRecording, videopath, is_valid_exists, reject=False
-):
-    with open("config.json") as f:
-        config = json.load(f)
-
-    #("Recording: ", recording)
-    #print("Previous Recording: ", prevRecording)
-
-    if is_valid_exists:
-        signName, filename, video_start_time, sign_start_time, sign_end_time, is_valid, attempt = recording
-    else:
-        signName, filename, video_start_time, sign_start_time, sign_end_time = recording
-        is_valid = True
-
-    #Commenting this out since we still want to look at videos that are invalid since it could be useful data
-    #if not is_valid:
-    #    return False, filename, signName
-
-    sign_start_time_date = datetime.datetime.strptime(
-        sign_start_time + "000", "%Y_%m_%d_%H_%M_%S.%f"
-    )
-    sign_end_time_date = datetime.datetime.strptime(
-        sign_end_time + "000", "%Y_%m_%d_%H_%M_%S.%f"
-    )
-
-    if sign_end_time_date - sign_start_time_date > datetime.timedelta(seconds=1):
-        return extract_clip_from_video_hold(args, uid, sign, recording_idx, recording, videopath, is_valid_exists, reject)
-
-    # To split based on taps, we set the current sign's start time to be the previous sign's end time
-    if (prevRecording is not None):
-        prevSignName, prevFilename, prev_video_start_time, prev_sign_start_time, prev_sign_end_time, prev_is_valid, prev_attempt = prevRecording
-
-        temp = sign_start_time
-        sign_start_time = prev_sign_end_time
-        sign_end_time = temp
-    else:
-        temp = sign_start_time
-        sign_start_time = video_start_time
-        sign_end_time = temp
-
-    video_start_time_date = datetime.datetime.strptime(
-        video_start_time + "000", "%Y_%m_%d_%H_%M_%S.%f"
-    )
-    sign_start_time_date = datetime.datetime.strptime(
-        sign_start_time + "000", "%Y_%m_%d_%H_%M_%S.%f"
-    )
-    sign_end_time_date = datetime.datetime.strptime(
-        sign_end_time + "000", "%Y_%m_%d_%H_%M_%S.%f"
-    )
-    sign = clean_sign(sign)
-
-    #print(
-    #    "Video Info: ", sign, filename, video_start_time, sign_start_time, sign_end_time
-    #)
-
-    start_seconds = sign_start_time_date - video_start_time_date
-    end_seconds = sign_end_time_date - video_start_time_date
-
-    start_subclip = start_seconds.seconds + start_seconds.microseconds / 1e6
-    end_subclip = end_seconds.seconds + end_seconds.microseconds / 1e6
-
-
-    if uid in config:
-        
-        buffer_0 = config[uid]["buffer_start"]
-        buffer_1 = config[uid]["buffer_end"]
-        invert = config[uid]["invert"]
-        #print(f"Found {uid} in config.json")
-        #print(f"SIGN, filename: {sign}, {filename}")
-        #print(f"Start_subclip, end_subclip: {start_subclip}, {end_subclip}\n Buffer: ({buffer_0}, {buffer_1})")
-        if invert:
-            start_subclip = end_subclip + buffer_0
-            end_subclip += buffer_1
-        else:
-            start_subclip += buffer_0
-            end_subclip += buffer_1
-        #print(f"New Start_subclip, end_subclip: {start_subclip}, {end_subclip}")
-
-    else:
-        #print(f"Could not find {uid} in config.json file")
-        #print(f"SIGN, filename: {sign}, {filename}")
-        #print(f"Start_subclip, end_subclip: {start_subclip}, {end_subclip}\n Buffer: ({args.buffer[0]}, {args.buffer[1]})")
-        if args.invert:
-            start_subclip = end_subclip + args.buffer[0]
-            end_subclip += args.buffer[1]
+    if not todo:
+        return []
+    if args.review_proxies:
+        for directory in {review_dir(clip.path) for clip in todo}:
+            os.makedirs(directory, exist_ok=True)
+    if args.extract_mode == "video":
+        # Decode the source once and cut every clip out of that single pass
+        return [make_job(chunk) for chunk in chunk_clips(args, todo)]
+    if args.extract_mode == "smart_cut":
+        # One probe per source video, shared by every clip cut from it
+        if probes is not None:
+            probe = probes.probe(videopath)
         else:
-           
-            start_subclip += args.buffer[0]
-            end_subclip += args.buffer[1]
-        #print(f"New Start_subclip, end_subclip: {start_subclip}, {end_subclip}")
-
-
-    output_dir = args.dest_dir
-
-    if args.make_structured_dirs:
-        video_filename = f"{sign_start_time}-{recording_idx}.mp4"
-        output_dir = os.path.join(args.dest_dir, f"{uid}", f"{sign}")
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-    elif args.make_sign_dirs:
-        #ONCE YOU ARE DONE PROCESSING unrecognizables, change this to sign start time
-        #But need to have it to video_start_time to have same file names as before :/
-        
-
-        if args.old_filenames:
-            video_filename = f"{uid}-{sign}-{video_start_time}-{recording_idx}.mp4"
+            try:
+                probe = probe_video(videopath)
+            except (subprocess.CalledProcessError, OSError, ValueError):
+                probe = None
+        return [make_job([clip], probe) for clip in todo]
+    return [make_job([clip]) for clip in todo]
+
+
+def log_parse_error(args, filename, error):
+    with open(os.path.join(args.dest_dir, "error", "parseErrors.jsonl"), "a") as f:
+        f.write(json.dumps(dict(error.to_dict(), filename=filename)) + "\n")
+
+
+# Plans every source in turn, yielding (source, planned) where planned is plan_file's
+# result. Shared by run and plan so both treat broken files the same way.
+def iter_cut_plans(args, sources, buffer_config, make_dirs=True, summary=None, metrics=None, probes=None):
+    parse_errors = 0
+    for source in sources:
+        try:
+            planned = plan_file(args, source, buffer_config, make_dirs, metrics, probes)
+        except TimestampsParseError as e:
+            # There are often many errors when it comes to parsing the files
+            # Don't want to kill the process simply because there was one corrupt file
+            log_parse_error(args, os.path.basename(source.timestamps_path), e)
+            parse_errors += 1
+            if summary is not None:
+                summary.parse_errors = parse_errors
+            if parse_errors > args.max_parse_errors:
+                raise RuntimeError(f"Decode Error. {parse_errors} files failed to decode")
+            planned = None
+        yield source, planned
+
+
+# (filename, videopath, clips) for every source file, as the scheduler consumes them
+def iter_source_clips(args, sources, buffer_config, metrics=None, probes=None):
+    for source, planned in iter_cut_plans(args, sources, buffer_config, metrics=metrics, probes=probes):
+        filename = os.path.basename(source.timestamps_path)
+        if planned is None:
+            yield filename, None, []
         else:
-            video_filename = f"{uid}-{sign}-{sign_start_time}-{recording_idx}.mp4"
-
-        print(f"Sign: {sign}:\n\targs.old_filenames: {args.old_filenames}, video_filename: {video_filename}\n\tvideo_start_time: {video_start_time}, sign_start_time: {sign_start_time}")
-
-        output_dir = os.path.join(args.dest_dir, f"{sign}")
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-    else:
-        output_dir = args.dest_dir
-        #print("Filename Struct: ", uid, sign, video_start_time, recording_idx)
-        video_filename = f"{uid}-{sign}-{video_start_time}-{recording_idx}.mp4"
-
-    # Only take the first video for a particular sign because subsequent ones tend to be bad
-    # Okay recording_idx corresponds to the number of attempts, but as discussed with Sahir
-    # this seems to be redudant with the valid attribute, so I am going to ignore this for now
-    #if recording_idx != 0:
-    #    output_dir = os.path.join(args.dest_dir, "error")
-
-    # If the video is to be rejected, put it in the reject folder instead
-    if reject:
-        output_dir = os.path.join(args.dest_dir, "invalid", f"{sign}")
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
-    # if not is_valid:
-    #     output_dir = os.path.join(args.dest_dir, "error")
-
-    time = end_subclip - start_subclip
-    full_filename = os.path.join(output_dir, video_filename)
-
-    if args.use_cuda:
-        subprocess.run(
-            [
-                "ffmpeg",
-                "-hwaccel",
-                "cuda",
-                "-hwaccel_output_format",
-                "cuda",
-                "-i",
-                videopath,
-                "-vf",
-                f"scale={str(args.video_dim[0])}:{str(args.video_dim[1])}",
-                "-ss",
-                start_subclip.strftime("%H:%M:%S.%f")[:-3],
-                "-t",
-                end_subclip.strftime("%H:%M:%S.%f")[:-3],
-                "-c:v",
-                "hevc_nvenc",
-                "-c:a",
-                "copy",
-                str(full_filename),
-                "-loglevel",
-                args.ffmpeg_loglevel,
-            ]
-        )
-
-        
-    else:
-        args = (
-            f"ffmpeg -y -nostdin -ss {start_subclip:.2f} -i {videopath} "
-            f"-t {time:.2f} -c:v libx264 {full_filename}"
-        )
+            videopath, plan = planned
+            yield filename, videopath, plan.clips()
 
-        # Call ffmpeg directly
-        subprocess.run(args, shell=True, check=True) 
 
-    if is_valid:
-        return True, None, None
-    return False, filename, signName
+# Same, but for the rows of a plan file: rows are grouped by source video (keeping the
+# order the plan listed them in) and their output dirs are created here, since plan doesn't
+def iter_plan_clips(rows):
+    by_source = {}
+    for row in rows:
+        by_source.setdefault(row["source"], []).append(row)
 
+    def clips():
+        for videopath, source_rows in by_source.items():
+            for output_dir in {os.path.dirname(row["dest"]) for row in source_rows}:
+                os.makedirs(output_dir, exist_ok=True)
+            filename = os.path.basename(source_rows[0]["timestamps_file"])
+            yield filename, videopath, [clip_from_row(row) for row in source_rows]
 
-def get_uid(args, filename):
-    imagepath = os.path.join(args.backup_dir, filename)
-    videopath = re.sub(r"-timestamps.jpg", r".mp4", imagepath)
-    _, videoname = os.path.split(videopath)
-    uid = videoname.split("-")[0]
-    return uid, videopath
+    return len(by_source), clips()
 
 
-#Keep an array of amount of signs available in recording_count (passed in)
-def count_recording(sign, recording, is_valid_exists, recording_count):
-    if is_valid_exists:
-        _, _, _, _, is_valid, _ = recording
-        if is_valid:
-            recording_count[sign] += 1
-    else:
-        recording_count[sign] += 1
-    return recording_count
+# What a source will cost to encode: the total length of the clips its timestamps plan.
+# Only the timestamps are read, never the probe cache: array jobs share that cache and
+# fill it as they go, so weights taken from it would differ between jobs that start at
+# different times and their shards would overlap or miss sources. Files that fail to
+# parse weigh nothing.
+def estimate_clip_seconds(args, source, buffer_config):
+    try:
+        timestamps = load_timestamps(source.timestamps_path)
+    except TimestampsParseError:
+        return 0.0
 
+    if len(timestamps.keys) <= 1:
+        return 0.0
+    recordings = sorted(timestamps.recordings, key=lambda tup: tup[4])
+    plan = build_cut_plan(args, source.uid, recordings, buffer_config, make_dirs=False)
+    return float(plan.duration.clip(min=0).sum())
 
-# Pool and Pbar are tools to help parallelize, with pool being pool of cpu resources
-# and pbar used to help increment stuff
-def process_file(args, pool, pbar, filename, results, signs, recording_count):
-    pbar.set_description("Processing Timestamps File: %s" % filename)
-    # results = []
-    # signs = set()
-    # recording_count = 0
 
-    if filename.endswith("-timestamps.jpg") and not filename.startswith("._"):
-        image = Image.open(os.path.join(args.backup_dir, filename))
-        exifdata = image.getexif()
+# Shard of every source, keyed on its video name
+def source_shards(args, sources, buffer_config):
+    keys = [source.video_path for source in sources]
+    weights = None
+    if args.shard_strategy == "balance":
+        weights = [estimate_clip_seconds(args, source, buffer_config) for source in sources]
+    return assign_shards(keys, args.num_shards, args.shard_strategy, weights)
 
-        description = get_image_description(exifdata)
 
-        data, is_valid_exists = get_data_from_description(description, os.path.join(args.dest_dir, "error", f"{filename[:-len('-timestamps.jpg')]}.log"))
+def select_source_shard(args, sources, buffer_config):
+    shards = source_shards(args, sources, buffer_config)
+    return [source for source, shard in zip(sources, shards) if shard == args.shard_index]
 
-        #File had errors, just skip this file
-        if (data == -1):
-            return
 
-        uid, videopath = get_uid(args, filename)
+# Shard selection for the rows of a plan file, keyed and weighted the same way as sources
+def select_row_shard(args, rows):
+    by_source = {}
+    for row in rows:
+        by_source.setdefault(row["source"], []).append(row)
 
-        noSigns = open(os.path.join(args.dest_dir, "error/noSigns.txt"), "a")
+    keys = list(by_source)
+    weights = [sum(max(0.0, row["duration"]) for row in by_source[key]) for key in keys]
+    shards = assign_shards(keys, args.num_shards, args.shard_strategy, weights)
+    return [row for key, shard in zip(keys, shards) if shard == args.shard_index for row in by_source[key]]
 
-        if os.path.exists(videopath) and len(data) > 1:  # We want to skip videos that only have 1 sign in them
-            prevRecording = None
 
-            newList = []
-            max_attempt = {}
+def summary_path(plan_path):
+    return os.path.splitext(plan_path)[0] + ".summary.json"
 
-            for sign, recording_list in data.items():
 
-                #If the recording list isn't actually a list, probably just metadata like version number
-                #Recording list contains the {sign, file_path_to_source, video_start time, sign_start, sign_stop, is_valid, attempt_number}
-                if (not isinstance(recording_list, list)):
-                    continue
+# Writes the cut plan of every source file without running ffmpeg, plus the per-sign
+# and per-uid counts of what executing it would produce
+def write_plan(args, sources, buffer_config, metrics=None, probes=None):
+    shards = [0] * len(sources)
+    if args.num_shards > 1:
+        shards = source_shards(args, sources, buffer_config)
+    if args.shard_index is not None:
+        sources = [source for source, shard in zip(sources, shards) if shard == args.shard_index]
+        shards = [args.shard_index] * len(sources)
 
-                for recording in recording_list:
-                    listRecording = list(recording) #May be a dictionary or set?
-                    listRecording.insert(0, sign)
+    shard_indices = sorted(set(range(args.num_shards)) if args.shard_index is None else {args.shard_index})
+    if args.num_shards > 1:
+        paths = {i: shard_path(args.plan_file, i, args.num_shards) for i in shard_indices}
+    else:
+        paths = {0: args.plan_file}
+    writers = {i: PlanWriter(path) for i, path in paths.items()}
 
-                    #If we have 6 attributes, it is probably a recording made by the legacy
-                    #Recorder when there weren't attempt numbers, so we set the max attempt to be 1
-                    if (len(listRecording) == 6):
-                        listRecording.append(0)
+    summary = PlanSummary()
+    planned_files = iter_cut_plans(args, sources, buffer_config, False, summary, metrics, probes)
+    for (source, planned), shard in tqdm(zip(planned_files, shards), total=len(sources)):
+        if planned is None:
+            continue
+        videopath, plan = planned
+        rows = plan_rows(os.path.abspath(source.timestamps_path), videopath, plan)
+        summary.add_video(rows)
+        writers[shard].write(rows)
+
+    for writer in writers.values():
+        writer.close()
+
+    totals = summary.to_dict()
+    with open(summary_path(args.plan_file), "w") as f:
+        json.dump(totals, f, indent=2)
+
+    print(f"{totals['videos']} videos, {totals['clips']} clips ({totals['valid']} valid, {totals['seconds']:.0f}s) across {totals['signs']} signs")
+    for uid, counts in totals["by_uid"].items():
+        print(f"  {uid}: {counts['videos']} videos, {counts['clips']} clips ({counts['valid']} valid, {counts['seconds']:.0f}s)")
+    print(f"Plan written to {', '.join(paths.values())}; counts in {summary_path(args.plan_file)}")
+
+
+# Runs every ffmpeg of one job; returns how long its ffmpegs ran, the CPU time they used,
+# how much they wrote and, in smart_cut mode, why clips were fully re-encoded instead
+async def run_clip_job(args, runner, job):
+    fallbacks = []
+    if args.extract_mode == "video":
+        results = [await extract_clips_from_video(args, runner, job.videopath, job.clips)]
+    elif args.extract_mode == "smart_cut":
+        results = []
+        for clip in job.clips:
+            clip_results, fallback = await smart_cut_clip(args, runner, clip, job.videopath, job.probe)
+            results += clip_results
+            if fallback is not None:
+                fallbacks.append(fallback)
+    else:
+        results = [await run_clip_ffmpeg(args, runner, clip, job.videopath) for clip in job.clips]
+    return {
+        "wall": sum(result.wall for result in results),
+        "cpu": sum(result.cpu for result in results),
+        "retries": sum(result.attempts - 1 for result in results),
+        "output_bytes": sum(file_size(clip.path) for clip in job.clips),
+        "fallbacks": fallbacks,
+    }
+
+
+def failure_reason(error):
+    if isinstance(error, FFmpegError):
+        return error.reason
+    return type(error).__name__
+
+
+# One line for failedClips.txt: the reason and the last thing ffmpeg said
+def failure_summary(error):
+    if isinstance(error, FFmpegError) and error.stderr_tail:
+        return f"{error.reason}: {error.stderr_tail[-1]}"
+    if isinstance(error, FFmpegError):
+        return error.reason
+    return repr(error)
+
+
+# Called once every job of a file has finished (successfully or not)
+def finish_file(args, file_state):
+    errorSignsFile = open(os.path.join(args.dest_dir, "error/errorSigns.txt"), "a")
+    for isValid, fileName, signName in (clip_result(clip) for clip in file_state["clips"]):
+        if not isValid:
+            errorSignsFile.write(fileName + ', ' + signName + '\n')
+    errorSignsFile.close()
+
+    if file_state["failures"]:
+        failedClipsFile = open(os.path.join(args.dest_dir, "error/failedClips.txt"), "a")
+        for clip_path, error in file_state["failures"]:
+            failedClipsFile.write(f"{file_state['filename']}, {clip_path}, {error}\n")
+        failedClipsFile.close()
+
+
+# Counts encoder threads in use so the running ffmpegs never ask for more than
+# --cpu_budget between them. Only the scheduler loop acquires; finished jobs release.
+class ThreadBudget:
+    def __init__(self, threads):
+        self.free = threads
+        self.condition = asyncio.Condition()
+
+    async def acquire(self, threads):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.free >= threads)
+            self.free -= threads
+
+    async def release(self, threads):
+        async with self.condition:
+            self.free += threads
+            self.condition.notify_all()
+
+
+# Planning thread: turns every planned source file into clip jobs and streams them into
+# the bounded queue, so parsing the next files overlaps with encoding
+def plan_jobs(args, planned_files, job_queue, manifest, metrics=None, probes=None, catalog=None):
+    try:
+        for filename, videopath, clips in planned_files:
+            clips, duplicates = dedupe_clips(args, filename, videopath, clips)
+            jobs = make_clip_jobs(args, videopath, clips, manifest, probes) if clips else []
+            if catalog is not None:
+                # Clips the manifest skipped are already done; make sure they are catalogued
+                queued = {clip.path for job in jobs for clip in job.clips}
+                catalog.add([clip for clip in clips if clip.path not in queued], "ok")
+            if metrics is not None and clips:
+                metrics.event(
+                    "video", file=filename, uid=clips[0].uid, source=videopath, source_bytes=file_size(videopath),
+                    clips=len(clips), duplicates=duplicates, queued=sum(len(job.clips) for job in jobs), jobs=len(jobs), status="ok"
+                )
+            file_state = {
+                "filename": filename,
+                "clips": clips,
+                "pending": len(jobs),
+                "failures": [],
+            }
+            job_queue.put((file_state, jobs))
+    except BaseException as e:
+        job_queue.put(e)
+        return
+    job_queue.put(None)
+
+
+# Streams clip jobs from all files into ffmpeg, keeping at most --num_threads processes
+# and --cpu_budget encoder threads busy instead of waiting for every clip of a video
+# before starting the next one. planned_files yields (filename, videopath, clips);
+# total is how many it will yield.
+def schedule_clip_jobs(args, planned_files, total, manifest=None, metrics=None, probes=None, catalog=None):
+    asyncio.run(run_clip_jobs(args, planned_files, total, manifest, metrics, probes, catalog))
+
+
+async def run_clip_jobs(args, planned_files, total, manifest=None, metrics=None, probes=None, catalog=None):
+    loop = asyncio.get_running_loop()
+    pbar = tqdm(total=total)
+    job_queue = queue.Queue(maxsize=args.queue_size)
+    runner = FFmpegRunner(args.num_threads, args.ffmpeg_retries, args.ffmpeg_timeout, args.ffmpeg_timeout_per_second)
+    budget = ThreadBudget(args.cpu_budget)
+    stats = ProfileStats()
+    started = time.perf_counter()
+
+    planner = threading.Thread(target=plan_jobs, args=(args, planned_files, job_queue, manifest, metrics, probes, catalog), daemon=True)
+    planner.start()
+
+    # Everything below runs on the event loop, so file bookkeeping needs no locking
+    def job_done(file_state, job, result=None, error=None):
+        if result is not None:
+            stats.add([resolve_profile(args, clip.is_hold).name for clip in job.clips], job.clips, result["wall"])
+        if metrics is not None:
+            clip_seconds = sum(max(0.0, clip.duration) for clip in job.clips)
+            fields = dict(
+                file=file_state["filename"], uid=job.clips[0].uid, source=job.videopath, clips=len(job.clips),
+                clip_seconds=clip_seconds, threads=job.threads,
+            )
+            if result is not None:
+                metrics.event(
+                    "encode", **fields, wall=result["wall"], cpu=result["cpu"], output_bytes=result["output_bytes"],
+                    retries=result["retries"], encode_ratio=result["wall"] / clip_seconds if clip_seconds else None,
+                    fallbacks=result["fallbacks"], status="ok"
+                )
+            else:
+                # Failed jobs only count towards failures, not encode time
+                metrics.event(
+                    "encode", **fields, wall=0.0, cpu=0.0, output_bytes=0,
+                    status="failed", reason=failure_reason(error), error=str(error)
+                )
+        if error is not None:
+            for clip in job.clips:
+                file_state["failures"].append((clip.path, failure_summary(error)))
+        if manifest is not None:
+            manifest.mark(job.clips, job.keys, job.videopath, "failed" if error is not None else "done")
+        if catalog is not None:
+            catalog.add(job.clips, "failed" if error is not None else "ok")
+        file_state["pending"] -= 1
+        if file_state["pending"] == 0:
+            finish_file(args, file_state)
+            pbar.update(1)
+
+    async def run_job(file_state, job):
+        try:
+            result = await run_clip_job(args, runner, job)
+        except Exception as e:
+            job_done(file_state, job, error=e)
+        else:
+            job_done(file_state, job, result)
+        finally:
+            await budget.release(job.threads)
+
+    tasks = set()
+    while True:
+        item = await loop.run_in_executor(None, job_queue.get)
+        if item is None:
+            break
+        if isinstance(item, BaseException):
+            raise item
+
+        file_state, jobs = item
+        pbar.set_description("Processing Timestamps File: %s" % file_state["filename"])
+        if not jobs:
+            finish_file(args, file_state)
+            pbar.update(1)
+            continue
 
-                    listRecording = tuple(listRecording)
-                    newList.append(listRecording)
+        for job in jobs:
+            # Short taps take one thread each, so many run side by side; long holds take several
+            await budget.acquire(job.threads)
+            if manifest is not None:
+                # Left as "running" if we die mid-encode, so the next run redoes the clip
+                manifest.mark(job.clips, job.keys, job.videopath, "running")
+            task = asyncio.create_task(run_job(file_state, job))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
 
+    if tasks:
+        await asyncio.wait(tasks)
+    pbar.close()
 
-                    if (listRecording[0] in max_attempt):
-                        max_attempt[sign] = max(max_attempt[sign], listRecording[6])
-                    else:
-                        #print(f"TEST")
-                        #print(f"ListRecording: {listRecording}")
-                        max_attempt[sign] = listRecording[6]
-
-            # Sort the data by date
-            sortedData = sorted(newList, key=lambda tup: tup[4])
-            reject_list = [(x[6] < max_attempt[x[0]]) for x in sortedData]
-            
-
-            #Add the pool.map once done (And this comment)
-            results = pool.map(
-                lambda i: extract_clip_from_video(
-                    args,
-                    uid,
-                    sortedData[i][0],
-                    sortedData[i][6], # 6th element is the nth attempt attribute (recording_idx)
-                    sortedData[i],
-                    sortedData[i - 1] if i > 0 else None,
-                    videopath,
-                    is_valid_exists
-                    #reject_list[i]
-                ),
-                range(len(sortedData))
-            )
-            
-
-            errorSignsFile = open(os.path.join(args.dest_dir, "error/errorSigns.txt"), "a")
-            for isValid, fileName, signName in results:
-                if not isValid:
-                    errorSignsFile.write(fileName + ', ' + signName + '\n')
-            errorSignsFile.close()
-
-
-        elif len(data) <= 1:
-            noSigns.write(filename + "\n")
-            noSigns.close()
-
-
-"""             for sign, recording_list in sortedData:
-                signs.add(clean_sign(sign))
-                print("Recording List: ", recording_list)
-                for idx, recording in enumerate(recording_list):
-                    count_recording(sign, recording, is_valid_exists, recording_count)
-                    if not args.skip_extraction:
-                        thread_args = (
-                            args,
-                            uid,
-                            sign,
-                            idx,
-                            recording,
-		                    prevRecording,
-                            videopath,
-                            is_valid_exists,
-                        )
-                        result = extract_clip_from_video(args,
-                            uid,
-                            sign,
-                            idx,
-                            recording,
-		                    prevRecording,
-                            videopath,
-                            is_valid_exists,)
-                        results.append(result)
-                    prevRecording = recording_list[0] """
-
-
-# return results, signs, recording_count
+    if not args.use_cuda:
+        print(stats.report(time.perf_counter() - started))
+    if metrics is not None:
+        print(metrics.summary())
 
 
 def make_missing_dirs(args):
@@ -618,6 +890,28 @@ def make_missing_dirs(args):
         os.mkdir("logs")
 
 
+def write_orphans(path, paths):
+    with open(path, "w") as f:
+        for orphan in paths:
+            f.write(orphan + "\n")
+
+
+# Every timestamps file with its video across the backup dirs. Files missing their
+# partner are listed in error/orphanTimestamps.txt and error/orphanVideos.txt.
+def list_sources(args):
+    cache_path = None if args.no_index_cache else args.index_cache
+    index = index_sources(args.backup_dir, cache_path, args.rescan)
+
+    write_orphans(os.path.join(args.dest_dir, "error", "orphanTimestamps.txt"), index.orphan_timestamps)
+    write_orphans(os.path.join(args.dest_dir, "error", "orphanVideos.txt"), index.orphan_videos)
+    print(
+        f"Indexed {len(index.records)} videos in {index.scanned_dirs + index.cached_dirs} backup dirs "
+        f"({index.cached_dirs} from cache); {len(index.orphan_timestamps)} timestamps files without a video, "
+        f"{len(index.orphan_videos)} videos without timestamps"
+    )
+    return index.records
+
+
 if __name__ == "__main__":
     args = parse_args()
     #print("Args: ", args)
@@ -628,35 +922,47 @@ if __name__ == "__main__":
             "logs", "decode_" + datetime.datetime.now().strftime("%Y-%m-%d_%H-%M")
         )
 
-    if args.job_array_num is not None:
-        backup_dir = os.fsencode(args.backup_dir)
-        with open(
-                f"/data/sign_language_videos/batches/batch_{args.job_array_num}.txt"
-        ) as fin:
-            assigned_videos = fin.read().splitlines()
+    if args.metrics_file is None:
+        args.metrics_file = args.log_file + ".metrics.jsonl"
+    metrics = DecodeMetrics(args.metrics_file)
 
-        pbar = tqdm(assigned_videos)
-        pool = Pool(args.num_threads)
+    probes = None
+    if not args.no_probe:
+        probes = ProbeCache(args.probe_cache)
 
+    if args.command == "plan":
+        write_plan(args, list_sources(args), load_buffer_config(), metrics, probes)
+        print(metrics.summary())
     else:
-        backup_dir = os.fsencode(args.backup_dir)
-        pbar = tqdm(os.listdir(backup_dir))
-        pool = Pool(args.num_threads) # Used for Multiprocessing
+        if args.command == "execute":
+            rows = read_plan(args.plan_file)
+            if args.num_shards > 1:
+                rows = select_row_shard(args, rows)
+            total, planned_files = iter_plan_clips(rows)
+        else:
+            buffer_config = load_buffer_config()
+            sources = list_sources(args)
+            if args.num_shards > 1:
+                sources = select_source_shard(args, sources, buffer_config)
+            total, planned_files = len(sources), iter_source_clips(args, sources, buffer_config, metrics, probes)
 
-    results = []
-    signs = set()
-    recording_count = defaultdict(int)
+        manifest = None
+        if not args.no_manifest:
+            manifest = ClipManifest(os.path.join(args.dest_dir, MANIFEST_FILENAME))
 
-    for file in pbar:
-        #print(file)
-        filename = os.fsdecode(file)
+        catalog = None
+        if not args.no_catalog:
+            catalog = ClipCatalog(args.dest_dir, args.batch_name)
 
-        if filename.endswith(".zip"):
-            continue
+        schedule_clip_jobs(args, planned_files, total, manifest, metrics, probes, catalog)
+
+        if manifest is not None:
+            manifest.close()
+        if catalog is not None:
+            catalog.close()
 
-        process_file(args, pool, pbar, filename, results, signs, recording_count)
+    if probes is not None:
+        print(f"Probed {probes.probed} source videos, {probes.hits} from {args.probe_cache}")
+        probes.close()
 
-    pool.close()
-    #print("Signs: ", signs)
-    #print("Recording Count (Total): ", sum(recording_count.values()))
-    #print("Recording Count (by Sign): ", recording_count)
+    metrics.close()
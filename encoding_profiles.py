@@ -0,0 +1,102 @@
+import os
+from collections import defaultdict, namedtuple
+
+
+# How a clip is encoded. threads is the libx264 thread count per ffmpeg process;
+# 0 means pick it from the clip length (see encoder_threads)
+EncodingProfile = namedtuple("EncodingProfile", ["name", "preset", "crf", "threads", "audio"])
+
+# Taps are short, so they run best as many single-threaded encoders side by side;
+# holds are long enough for x264's frame threading to pay off
+PROFILES = {
+    "tap": EncodingProfile("tap", "medium", 23, 1, "aac"),
+    "hold": EncodingProfile("hold", "medium", 23, 0, "aac"),
+    "fast": EncodingProfile("fast", "veryfast", 23, 1, "aac"),
+}
+
+AUDIO_MODES = ["aac", "copy", "none"]
+
+# What the bare "-c:v libx264" we used before profiles produces
+DEFAULT_QUALITY = ("medium", 23, "aac")
+
+# Automatic threads: one per this many seconds of clip, up to MAX_ENCODER_THREADS
+SECONDS_PER_THREAD = 2.0
+MAX_ENCODER_THREADS = 4
+
+
+def cpu_count():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# The profile a clip is encoded with: --encoding_profile (auto picks tap or hold from
+# the clip) with any of --preset/--crf/--encoder_threads/--audio applied on top
+def resolve_profile(args, is_hold):
+    name = args.encoding_profile
+    if name == "auto":
+        name = "hold" if is_hold else "tap"
+
+    profile = PROFILES[name]
+    overrides = {
+        "preset": args.preset,
+        "crf": args.crf,
+        "threads": args.encoder_threads,
+        "audio": args.audio,
+    }
+    return profile._replace(**{field: value for field, value in overrides.items() if value is not None})
+
+
+def encoder_threads(profile, duration, cpu_budget):
+    if profile.threads > 0:
+        return min(profile.threads, cpu_budget)
+    by_length = int(max(0.0, duration) // SECONDS_PER_THREAD) + 1
+    return max(1, min(MAX_ENCODER_THREADS, cpu_budget, by_length))
+
+
+def video_args(profile, threads):
+    return [
+        "-c:v", "libx264",
+        "-preset", profile.preset,
+        "-crf", str(profile.crf),
+        "-threads", str(threads),
+    ]
+
+
+def audio_args(profile):
+    if profile.audio == "none":
+        return ["-an"]
+    return ["-c:a", profile.audio]
+
+
+# Part of the manifest key. Empty for the default quality so clips cut before profiles
+# existed are not all redone; threads are left out since they don't change the picture.
+def profile_signature(profile):
+    if (profile.preset, profile.crf, profile.audio) == DEFAULT_QUALITY:
+        return ""
+    return f"{profile.preset}/{profile.crf}/{profile.audio}"
+
+
+# Clips/sec per profile, from the time workers spent encoding them
+class ProfileStats:
+    def __init__(self):
+        self.stats = defaultdict(lambda: {"clips": 0, "clip_seconds": 0.0, "encode_seconds": 0.0})
+
+    # A job's time is split evenly over its clips
+    def add(self, profiles, clips, encode_seconds):
+        for profile, clip in zip(profiles, clips):
+            stats = self.stats[profile]
+            stats["clips"] += 1
+            stats["clip_seconds"] += max(0.0, clip.duration)
+            stats["encode_seconds"] += encode_seconds / len(clips)
+
+    def report(self, wall_seconds):
+        lines = [f"{'profile':10} {'clips':>7} {'clip s':>9} {'encode s':>9} {'clips/s/worker':>15} {'clips/s':>8}"]
+        for profile, stats in sorted(self.stats.items()):
+            per_worker = stats["clips"] / stats["encode_seconds"] if stats["encode_seconds"] else 0.0
+            overall = stats["clips"] / wall_seconds if wall_seconds else 0.0
+            lines.append(
+                f"{profile:10} {stats['clips']:7d} {stats['clip_seconds']:9.1f} {stats['encode_seconds']:9.1f} "
+                f"{per_worker:15.2f} {overall:8.2f}"
+            )
+        return "\n".join(lines)
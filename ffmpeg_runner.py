@@ -0,0 +1,110 @@
+import asyncio
+import time
+from collections import namedtuple
+
+from decode_metrics import children_cpu_time
+
+
+# wall is the time the process ran (including retries, not waiting for a slot), cpu the
+# CPU time of its last attempt
+FFmpegResult = namedtuple("FFmpegResult", ["wall", "cpu", "attempts"])
+
+STDERR_TAIL_LINES = 20
+STDERR_TAIL_BYTES = 8192
+STDERR_DRAIN_SECONDS = 1.0
+
+
+class FFmpegError(Exception):
+    def __init__(self, argv, returncode, stderr_tail, timed_out=False, attempts=1):
+        self.argv = argv
+        self.returncode = returncode
+        self.stderr_tail = stderr_tail
+        self.timed_out = timed_out
+        self.attempts = attempts
+        super().__init__(argv, returncode)
+
+    @property
+    def reason(self):
+        if self.timed_out:
+            return "ffmpeg timed out"
+        return f"ffmpeg exited with {self.returncode}"
+
+    def __str__(self):
+        tail = "\n".join(self.stderr_tail)
+        return f"{self.reason} after {self.attempts} attempt(s): {' '.join(self.argv)}" + (f"\n{tail}" if tail else "")
+
+
+def stderr_tail(stderr, lines=STDERR_TAIL_LINES):
+    return stderr.decode("utf-8", errors="replace").splitlines()[-lines:]
+
+
+# Runs ffmpeg/ffprobe processes from the event loop. At most max_processes run at once;
+# each gets a timeout proportional to the media it has to process and is retried a
+# limited number of times. Commands are argv lists and are never passed through a shell.
+class FFmpegRunner:
+    def __init__(self, max_processes, retries=1, timeout_base=60.0, timeout_per_second=10.0):
+        self.slots = asyncio.Semaphore(max_processes)
+        self.retries = retries
+        self.timeout_base = timeout_base
+        self.timeout_per_second = timeout_per_second
+        self.last_children_cpu = children_cpu_time()
+
+    def timeout(self, media_seconds):
+        return self.timeout_base + self.timeout_per_second * max(0.0, media_seconds)
+
+    # Children's CPU time only grows when one is reaped, so the growth since the last
+    # reap is (up to two processes exiting at the same moment) this process's CPU time
+    def reaped_cpu(self):
+        now = children_cpu_time()
+        cpu, self.last_children_cpu = now - self.last_children_cpu, now
+        return cpu
+
+    async def run(self, argv, media_seconds=0.0):
+        wall = 0.0
+        for attempt in range(1, self.retries + 2):
+            async with self.slots:
+                started = time.perf_counter()
+                returncode, stderr, timed_out = await self.run_once(argv, self.timeout(media_seconds))
+                wall += time.perf_counter() - started
+                cpu = self.reaped_cpu()
+            if returncode == 0 and not timed_out:
+                return FFmpegResult(wall, cpu, attempt)
+        raise FFmpegError(argv, returncode, stderr_tail(stderr), timed_out, attempt)
+
+    async def run_once(self, argv, timeout):
+        process = await asyncio.create_subprocess_exec(
+            *argv,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stderr = bytearray()
+        reader = asyncio.ensure_future(read_tail(process.stderr, stderr))
+        timed_out = False
+        try:
+            await asyncio.wait_for(process.wait(), timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            process.kill()
+            await process.wait()
+        except asyncio.CancelledError:
+            process.kill()
+            await process.wait()
+            raise
+        finally:
+            # Something the process started may still hold stderr open; don't wait on it
+            try:
+                await asyncio.wait_for(reader, STDERR_DRAIN_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+        return process.returncode, bytes(stderr), timed_out
+
+
+# Keeps only the last STDERR_TAIL_BYTES of a stream, so a chatty -loglevel can't fill memory
+async def read_tail(stream, buffer):
+    while True:
+        chunk = await stream.read(4096)
+        if not chunk:
+            return
+        buffer += chunk
+        del buffer[:-STDERR_TAIL_BYTES]
@@ -1,6 +1,7 @@
 import sys
 from app import app
 from models import db, User
+from user_cache import bump_user_version
 
 def add_user(username):
     with app.app_context():
@@ -10,6 +11,8 @@ def add_user(username):
         new_user = User(username=username)
         db.session.add(new_user)
         db.session.commit()
+        # Running apps reload their user list on their next request
+        bump_user_version()
         print(f"User '{username}' added successfully.")
 
 if __name__ == "__main__":
@@ -0,0 +1,253 @@
+# Inter-annotator agreement and consensus labels over annots, per sign. Each sign is
+# held as a (video x annotator) matrix of label codes, from which NumPy computes each
+# video's label counts, its consensus (the label a strict majority gave), disagreements,
+# Fleiss' kappa for the sign and a confusion matrix for every pair of its annotators.
+# Cohen's kappa per pair comes from those confusion matrices, per sign and summed over
+# all signs.
+#
+# refresh() costs one GROUP BY sign over annots plus a read of sign_versions, and
+# reloads only the signs whose (annotations, latest id, version) changed since the last
+# one, swapping their share of the pair totals, so new annotations don't mean
+# recomputing every sign. The version is bumped by the server in the transaction of
+# every label change (see progress.write_annots); the annotation times come from the
+# browsers, so a relabel can carry an older time than the sign's latest. app.py serves
+# it at /agreement:
+#
+#   python agreement.py                 # kappas per sign and per annotator pair
+#   python agreement.py <sign>          # that sign's disagreements
+import sys
+import threading
+import time
+from collections import namedtuple
+from itertools import combinations
+
+import numpy as np
+from sqlalchemy import func
+
+from config import Config
+from models import db, Annot, SignVersion
+
+# The UI's labels, in keybind order (z/x/c/v); annotations with any other label are ignored
+LABELS = ("Good", "Variant", "Bad", "Further Review")
+LABEL_CODES = {label: code for code, label in enumerate(LABELS)}
+MISSING = -1
+
+
+def kappa(observed, expected):
+    # Undefined when chance agreement is already perfect (everyone used one label)
+    if expected >= 1:
+        return None
+    return float((observed - expected) / (1 - expected))
+
+
+# Cohen's kappa from a K x K confusion matrix of two annotators' labels
+def cohen_kappa(confusion):
+    n = confusion.sum()
+    if n == 0:
+        return None
+    observed = np.trace(confusion) / n
+    expected = confusion.sum(axis=1) @ confusion.sum(axis=0) / (n * n)
+    return kappa(observed, expected)
+
+
+# Fleiss' kappa from (videos x K) label counts, over the videos with two or more
+# annotations (which may have different numbers of them)
+def fleiss_kappa(counts):
+    raters = counts.sum(axis=1)
+    counts = counts[raters >= 2]
+    raters = raters[raters >= 2]
+    if not len(counts):
+        return None
+    observed = ((counts * (counts - 1)).sum(axis=1) / (raters * (raters - 1))).mean()
+    shares = counts.sum(axis=0) / raters.sum()
+    return kappa(observed, (shares ** 2).sum())
+
+
+# One sign's labels and what follows from them
+class SignAgreement:
+    def __init__(self, sign, video_paths, users, labels):
+        self.sign = sign
+        codes = np.array([LABEL_CODES.get(label, MISSING) for label in labels], dtype=np.int8)
+        known = codes != MISSING
+        self.ignored = int((~known).sum())
+
+        self.videos, video_index = np.unique(np.asarray(video_paths, dtype=object)[known], return_inverse=True)
+        self.users, user_index = np.unique(np.asarray(users, dtype=object)[known], return_inverse=True)
+        codes = codes[known]
+        n_videos, n_users, k = len(self.videos), len(self.users), len(LABELS)
+
+        # matrix[video, user] is the label code, or MISSING
+        self.matrix = np.full((n_videos, n_users), MISSING, dtype=np.int8)
+        self.matrix[video_index, user_index] = codes
+        self.counts = np.bincount(video_index * k + codes, minlength=n_videos * k).reshape(n_videos, k)
+        self.raters = self.counts.sum(axis=1)
+
+        top = self.counts.argmax(axis=1)
+        self.top_count = self.counts.max(axis=1)
+        self.consensus = np.where(self.top_count * 2 > self.raters, top, MISSING)
+        self.disagreement = (self.raters >= 2) & (self.top_count < self.raters)
+        self.fleiss = fleiss_kappa(self.counts)
+
+        # confusion[a, i, b, j]: videos user a labelled i and user b labelled j, from
+        # one product of the (video x user*label) one-hot matrix with itself
+        one_hot = np.zeros((n_videos, n_users * k), dtype=np.float32)
+        one_hot[video_index, user_index * k + codes] = 1
+        self.confusion = (one_hot.T @ one_hot).reshape(n_users, k, n_users, k).round().astype(np.int64)
+
+    # {(user_a, user_b): K x K confusion} for every pair that labelled a video in common
+    def pairs(self):
+        pairs = {}
+        for a, b in combinations(range(len(self.users)), 2):
+            confusion = self.confusion[a, :, b, :]
+            if confusion.any():
+                pairs[(self.users[a], self.users[b])] = confusion
+        return pairs
+
+    def summary(self):
+        return {
+            "videos": len(self.videos),
+            "annotations": int(self.raters.sum()),
+            "annotators": len(self.users),
+            "multi_annotated": int((self.raters >= 2).sum()),
+            "consensus": {label: int((self.consensus == code).sum()) for code, label in enumerate(LABELS)},
+            "no_consensus": int((self.consensus == MISSING).sum()),
+            "disagreements": int(self.disagreement.sum()),
+            "fleiss_kappa": self.fleiss,
+            "ignored": self.ignored,
+        }
+
+    def video_json(self, i):
+        return {
+            "video_path": self.videos[i],
+            "labels": {self.users[u]: LABELS[code] for u, code in enumerate(self.matrix[i]) if code != MISSING},
+            "consensus": LABELS[self.consensus[i]] if self.consensus[i] != MISSING else None,
+            "agreement": float(self.top_count[i] / self.raters[i]),
+        }
+
+    def disagreements(self):
+        return [self.video_json(i) for i in np.flatnonzero(self.disagreement)]
+
+    def videos_json(self):
+        return [self.video_json(i) for i in range(len(self.videos))]
+
+
+# Adds (sign=1) or takes away (sign=-1) one sign's pair confusions in pair_totals
+def add_pairs(pair_totals, sign_agreement, sign):
+    for pair, confusion in sign_agreement.pairs().items():
+        total = pair_totals.get(pair)
+        total = sign * confusion if total is None else total + sign * confusion
+        if total.any():
+            pair_totals[pair] = total
+        else:
+            del pair_totals[pair]
+
+
+def pair_json(pairs):
+    return [
+        {"users": [a, b], "videos": int(confusion.sum()), "cohen_kappa": cohen_kappa(confusion)}
+        for (a, b), confusion in sorted(pairs.items())
+    ]
+
+
+# What readers see: every sign's SignAgreement, the pair confusions summed over signs
+# and how many signs the last refresh reloaded. refresh() builds a new one and swaps it
+# in whole, so a request working from the one it took never sees a refresh half done.
+AgreementView = namedtuple("AgreementView", ["signs", "pair_totals", "reloaded"])
+
+
+# Refreshed at most every ttl seconds by current(); needs an app context
+class AgreementIndex:
+    def __init__(self, ttl=Config.AGREEMENT_REFRESH_SECONDS):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.view = AgreementView({}, {}, 0)
+        self.fingerprints = {}
+        self.refreshed_at = None
+
+    def load(self, sign):
+        rows = db.session.execute(
+            db.select(Annot.video_path, Annot.user, Annot.label).where(Annot.sign == sign)
+        ).all()
+        video_paths, users, labels = zip(*rows) if rows else ((), (), ())
+        return SignAgreement(sign, video_paths, users, labels)
+
+    def refresh(self):
+        versions = dict(db.session.execute(db.select(SignVersion.sign, SignVersion.version)).all())
+        fingerprints = {
+            sign: (count, last_id, versions.get(sign, 0))
+            for sign, count, last_id in db.session.execute(
+                db.select(Annot.sign, func.count(), func.max(Annot.id)).group_by(Annot.sign)
+            )
+        }
+        signs = dict(self.view.signs)
+        pair_totals = dict(self.view.pair_totals)
+        reloaded = 0
+        for sign in list(signs):
+            if sign not in fingerprints:
+                add_pairs(pair_totals, signs.pop(sign), -1)
+        for sign, fingerprint in fingerprints.items():
+            if self.fingerprints.get(sign) == fingerprint:
+                continue
+            if sign in signs:
+                add_pairs(pair_totals, signs[sign], -1)
+            signs[sign] = self.load(sign)
+            add_pairs(pair_totals, signs[sign], 1)
+            reloaded += 1
+        self.view = AgreementView(signs, pair_totals, reloaded)
+        self.fingerprints = fingerprints
+        self.refreshed_at = time.monotonic()
+
+    def current(self):
+        with self.lock:
+            if self.refreshed_at is None or time.monotonic() - self.refreshed_at > self.ttl:
+                self.refresh()
+        return self
+
+    def summary(self):
+        view = self.view
+        return {
+            "signs": {sign: agreement.summary() for sign, agreement in sorted(view.signs.items())},
+            "pairs": pair_json(view.pair_totals),
+            "reloaded_signs": view.reloaded,
+        }
+
+    def sign_detail(self, sign, videos=False):
+        agreement = self.view.signs.get(sign)
+        if agreement is None:
+            return None
+        detail = dict(agreement.summary(), sign=sign, pairs=pair_json(agreement.pairs()), disagreement_videos=agreement.disagreements())
+        if videos:
+            detail["videos"] = agreement.videos_json()
+        return detail
+
+
+def print_summary(summary):
+    print(f"{'sign':<24} {'videos':>7} {'multi':>6} {'disagree':>8} {'no cons.':>8} {'fleiss':>7}")
+    for sign, entry in summary["signs"].items():
+        fleiss = f"{entry['fleiss_kappa']:.3f}" if entry["fleiss_kappa"] is not None else "-"
+        print(f"{sign:<24} {entry['videos']:>7} {entry['multi_annotated']:>6} {entry['disagreements']:>8} {entry['no_consensus']:>8} {fleiss:>7}")
+    print()
+    print(f"{'annotators':<40} {'videos':>7} {'cohen':>7}")
+    for pair in summary["pairs"]:
+        cohen = f"{pair['cohen_kappa']:.3f}" if pair["cohen_kappa"] is not None else "-"
+        print(f"{' / '.join(pair['users']):<40} {pair['videos']:>7} {cohen:>7}")
+
+
+if __name__ == "__main__":
+    from app import app
+
+    with app.app_context():
+        index = AgreementIndex()
+        index.refresh()
+        if len(sys.argv) > 1:
+            detail = index.sign_detail(sys.argv[1])
+            if detail is None:
+                print(f"No annotations for {sys.argv[1]!r}")
+                sys.exit(1)
+            fleiss = f"{detail['fleiss_kappa']:.3f}" if detail["fleiss_kappa"] is not None else "-"
+            print(f"{detail['videos']} videos, {detail['disagreements']} disagreements, Fleiss' kappa {fleiss}")
+            for video in detail["disagreement_videos"]:
+                labels = ", ".join(f"{user}: {label}" for user, label in sorted(video["labels"].items()))
+                print(f"  {video['video_path']}  ->  {video['consensus'] or 'no consensus'}  ({labels})")
+        else:
+            print_summary(index.summary())
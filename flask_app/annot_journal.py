@@ -0,0 +1,339 @@
+# Write-behind journal for annotation writes (LABELS_ANNOT_JOURNAL in config.py). The
+# write endpoints append accepted rows to a local JSONL journal, fsync it and answer
+# right away; a background thread writes them to the database in batches, keeping only
+# the latest edit of each (user, video_path), so a slow database no longer holds up the
+# keystrokes of a room of annotators. Reads (/annots, /progress) see a write once it is
+# flushed, normally within the flush interval.
+#
+# <journal>.checkpoint holds the seq of the last entry known to be in the database. On
+# start every later entry is replayed; the database write is an upsert that moves the
+# progress counts by the change, so replaying an entry that did get written is harmless.
+# The journal is rewritten down to its unflushed entries once it outgrows compact_bytes.
+#
+# A batch the database rejects is retried one row at a time, so a row that can never be
+# written (say one journaled before the endpoints checked field types) doesn't hold up
+# the rest: it is moved to <journal>.dead with the error. Errors that say the database
+# is unavailable (transient(error)) leave every row waiting for the next try instead.
+#
+# One process owns a journal at a time (flock on <journal>.lock), so with the journal on
+# the app must run as a single process, with as many threads as it likes (e.g. gunicorn
+# --workers 1 --threads 16); another process using the same journal fails its requests.
+#
+#   python annot_journal.py <journal> status   # entries waiting, without touching them
+#   python annot_journal.py <journal> replay   # flush them while the app is stopped
+import fcntl
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+
+# Seconds between flushes, unless max_batch rows are waiting before then
+FLUSH_INTERVAL = 1.0
+MAX_BATCH = 500
+COMPACT_BYTES = 16 * 1024 * 1024
+# Seconds to wait before retrying after the database write failed
+RETRY_SECONDS = 5.0
+
+
+def encode_row(row):
+    return dict(row, time=row["time"].isoformat() if row.get("time") is not None else None)
+
+
+def decode_row(row):
+    return dict(row, time=datetime.fromisoformat(row["time"]) if row.get("time") is not None else None)
+
+
+def read_checkpoint(path):
+    try:
+        with open(path + ".checkpoint") as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+# Journal entries after the checkpoint, coalesced: {(user, video_path): (seq, appended_at, row)}.
+# Lines that don't parse (a write torn by a crash) are skipped.
+def read_unflushed(path, flushed_seq):
+    pending = {}
+    entries = 0
+    last_seq = flushed_seq
+    try:
+        f = open(path)
+    except FileNotFoundError:
+        return pending, entries, last_seq
+    with f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                seq, row = entry["seq"], entry["row"]
+            except (ValueError, KeyError, TypeError):
+                continue
+            last_seq = max(last_seq, seq)
+            if seq <= flushed_seq:
+                continue
+            entries += 1
+            key = (row["user"], row["video_path"])
+            at = entry.get("at", time.time())
+            if key in pending:
+                # The latest edit wins, waiting since the first unflushed one
+                first_at = min(at, pending[key][1])
+                if pending[key][0] < seq:
+                    pending[key] = (seq, first_at, row)
+                else:
+                    pending[key] = (pending[key][0], first_at, pending[key][2])
+            else:
+                pending[key] = (seq, at, row)
+    return pending, entries, last_seq
+
+
+def fsync_dir(path):
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# Every error counts as transient unless the caller knows better
+def always_transient(error):
+    return True
+
+
+# write(rows) stores annotation rows (as app.annot_row makes them) in the database and
+# raises if it couldn't; it is called from the flusher thread only. transient(error)
+# tells an unavailable database apart from rows it rejects.
+class AnnotJournal:
+    def __init__(self, path, write, flush_interval=FLUSH_INTERVAL, max_batch=MAX_BATCH, compact_bytes=COMPACT_BYTES, start=True, transient=always_transient):
+        self.path = path
+        self.write = write
+        self.transient = transient
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.compact_bytes = compact_bytes
+
+        self.lock_file = open(path + ".lock", "a")
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.lock_file.close()
+            raise RuntimeError(f"{path} is in use by another process; the annotation journal needs the app to run as a single process")
+
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopping = False
+        self.flushed_seq = read_checkpoint(path)
+        self.pending, self.replayed, self.last_seq = read_unflushed(path, self.flushed_seq)
+        self.file = open(path, "a")
+
+        self.appended = 0
+        self.coalesced = self.replayed - len(self.pending)
+        self.flushed = 0
+        self.dead_lettered = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_flush_at = None
+
+        self.thread = None
+        if start:
+            self.thread = threading.Thread(target=self.run, name="annot-journal", daemon=True)
+            self.thread.start()
+            if self.pending:
+                self.wake.set()
+
+    # Durably records rows; once this returns they will reach the database
+    def append(self, rows):
+        if not rows:
+            return
+        now = time.time()
+        with self.lock:
+            entries = [(self.last_seq + i + 1, row) for i, row in enumerate(rows)]
+            # Taken even if the write fails, so a torn line's seqs are never reused
+            self.last_seq = entries[-1][0]
+            self.file.write("".join(
+                json.dumps({"seq": seq, "at": now, "row": encode_row(row)}) + "\n" for seq, row in entries
+            ))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+            self.appended += len(entries)
+            for seq, row in entries:
+                key = (row["user"], row["video_path"])
+                at = now
+                if key in self.pending:
+                    # Lag counts from the first unflushed edit, however often it is edited since
+                    at = self.pending[key][1]
+                    self.coalesced += 1
+                self.pending[key] = (seq, at, encode_row(row))
+            if len(self.pending) >= self.max_batch:
+                self.wake.set()
+
+    def run(self):
+        while not self.stopping:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            if not self.flush() and not self.stopping:
+                # Don't hammer a database that is down
+                self.wake.wait(RETRY_SECONDS)
+        self.flush()
+
+    # Writes everything waiting; returns False if the database was unavailable, in which
+    # case the rows not yet written stay pending (behind any newer edit of the same video)
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return True
+            batch = self.pending
+            self.pending = {}
+            upto = self.last_seq
+
+        entries = sorted(batch.items(), key=lambda item: item[1][0])
+        unwritten = []
+        written = 0
+        error = None
+        for i in range(0, len(entries), self.max_batch):
+            chunk = entries[i:i + self.max_batch]
+            if error is not None:
+                unwritten += chunk
+                continue
+            try:
+                self.write([decode_row(row) for _, (_, _, row) in chunk])
+                written += len(chunk)
+            except Exception as e:
+                if self.transient(e):
+                    error = e
+                    unwritten += chunk
+                else:
+                    chunk_written, error = self.write_one_by_one(chunk, unwritten)
+                    written += chunk_written
+
+        with self.lock:
+            self.flushed += written
+            if error is not None:
+                for key, (seq, at, row) in unwritten:
+                    if key in self.pending:
+                        newer_seq, newer_at, newer_row = self.pending[key]
+                        self.pending[key] = (newer_seq, min(at, newer_at), newer_row)
+                    else:
+                        self.pending[key] = (seq, at, row)
+                self.failures += 1
+                self.last_error = f"{type(error).__name__}: {error}"
+            else:
+                self.flushed_seq = upto
+                self.last_flush_at = time.time()
+                self.write_checkpoint()
+                if os.path.getsize(self.path) > self.compact_bytes:
+                    self.compact()
+        if error is not None:
+            print(f"Annotation journal flush of {len(unwritten)} rows failed: {self.last_error}", file=sys.stderr)
+            return False
+        return True
+
+    # Writes the entries of a rejected batch one at a time, dead-lettering the ones the
+    # database rejects. Stops at a transient error, adding what is left to unwritten.
+    # Returns how many were written and the transient error, if any.
+    def write_one_by_one(self, entries, unwritten):
+        written = 0
+        for i, (key, (seq, at, row)) in enumerate(entries):
+            try:
+                self.write([decode_row(row)])
+                written += 1
+            except Exception as e:
+                if self.transient(e):
+                    unwritten += entries[i:]
+                    return written, e
+                self.dead_letter(seq, at, row, e)
+        return written, None
+
+    # Durably sets aside a row the database won't take, before the checkpoint passes it
+    def dead_letter(self, seq, at, row, error):
+        entry = {"seq": seq, "at": at, "row": row, "error": f"{type(error).__name__}: {error}", "dead_at": time.time()}
+        with open(self.path + ".dead", "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        with self.lock:
+            self.dead_lettered += 1
+        print(f"Annotation journal set aside seq {seq} in {self.path}.dead: {entry['error']}", file=sys.stderr)
+
+    # Callers hold self.lock
+    def write_checkpoint(self):
+        tmp_path = self.path + ".checkpoint.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(self.flushed_seq))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path + ".checkpoint")
+        fsync_dir(self.path)
+
+    # Rewrites the journal with just the pending entries. Callers hold self.lock.
+    def compact(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for seq, at, row in sorted(self.pending.values(), key=lambda value: value[0]):
+                f.write(json.dumps({"seq": seq, "at": at, "row": row}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        fsync_dir(self.path)
+        self.file.close()
+        self.file = open(self.path, "a")
+
+    # lag_seconds is how long the oldest unflushed edit has waited; it grows while the
+    # database is slow or down
+    def stats(self):
+        with self.lock:
+            oldest = min((at for _, at, _ in self.pending.values()), default=None)
+            return {
+                "pending": len(self.pending),
+                "unflushed_entries": self.last_seq - self.flushed_seq,
+                "lag_seconds": time.time() - oldest if oldest is not None else 0.0,
+                "appended": self.appended,
+                "coalesced": self.coalesced,
+                "flushed": self.flushed,
+                "dead_lettered": self.dead_lettered,
+                "replayed": self.replayed,
+                "failures": self.failures,
+                "last_error": self.last_error,
+                "last_flush_at": self.last_flush_at,
+                "journal_bytes": os.path.getsize(self.path),
+            }
+
+    # Stops the flusher after a last flush
+    def close(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.stopping = True
+            self.wake.set()
+            self.thread.join()
+        else:
+            self.flush()
+        self.file.close()
+        fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.lock_file.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[2] not in ("status", "replay"):
+        print("Usage: python annot_journal.py <journal> status | replay")
+        sys.exit(2)
+    path, command = sys.argv[1], sys.argv[2]
+
+    if command == "status":
+        flushed_seq = read_checkpoint(path)
+        pending, entries, last_seq = read_unflushed(path, flushed_seq)
+        print(f"{entries} entries after seq {flushed_seq} ({len(pending)} annotations once coalesced), last seq {last_seq}")
+        sys.exit(0)
+
+    from app import app, flush_annots, transient_write_error
+
+    journal = AnnotJournal(path, flush_annots, start=False, transient=transient_write_error)
+    ok = journal.flush()
+    journal.close()
+    if ok:
+        dead = f", set aside {journal.dead_lettered} in {path}.dead" if journal.dead_lettered else ""
+        print(f"Wrote {journal.flushed} annotations{dead}")
+    else:
+        print(f"Failed: {journal.last_error}")
+    sys.exit(0 if ok else 1)
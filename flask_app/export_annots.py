@@ -0,0 +1,188 @@
+# Streams annotations out of annots for training, as JSONL, CSV or Parquet, with the
+# clip's uid, sign, timestamp and attempt parsed from its filename. Rows are read with
+# yield_per (a server-side cursor on MySQL) and written as they arrive, so memory stays
+# flat however many annotations match. Parquet needs pyarrow and is written one row
+# group per --batch_size rows. app.py serves the JSONL and CSV streams at /export.
+#
+#   python export_annots.py annotations.jsonl
+#   python export_annots.py labels.csv --sign apple banana --label Good Variant --since 2025-01-01
+#   python export_annots.py labels.parquet --user ann --until 2025-06-30T12:00
+#   python export_annots.py - --batch b1 | gzip > b1.jsonl.gz
+import argparse
+import csv
+import io
+import json
+import re
+import sys
+from collections import namedtuple
+from datetime import datetime
+
+from models import db, Annot
+
+FORMATS = ("jsonl", "csv", "parquet")
+
+# Rows fetched from the database per round trip
+EXPORT_BATCH_SIZE = 1000
+
+ANNOT_COLUMNS = ("id", "batch", "sign", "user", "label", "comments", "time", "video_path")
+CLIP_COLUMNS = ("uid", "clip_sign", "timestamp", "attempt")
+EXPORT_COLUMNS = ANNOT_COLUMNS + CLIP_COLUMNS
+
+# Filters shared by the CLI and /export; each takes one or more values
+EXPORT_FILTERS = ("batch", "sign", "user", "label")
+
+# The decode's clip names: uid-sign-timestamp-attempt.mp4, or timestamp-attempt.mp4 from
+# --make_structured_dirs, where uid and sign are directories. Signs are cleaned of "-"
+# (cut_plan.clean_sign) and timestamps have none, so only the uid can contain one.
+CLIP_FILENAME = re.compile(r"^(?:(?P<uid>.+)-(?P<sign>[^-]+)-)?(?P<timestamp>[^-]+)-(?P<attempt>\d+)\.mp4$")
+
+ClipName = namedtuple("ClipName", ["uid", "sign", "timestamp", "attempt"])
+
+
+def parse_clip_filename(filename):
+    match = CLIP_FILENAME.match(filename)
+    if match is None:
+        return ClipName(None, None, None, None)
+    return ClipName(match["uid"], match["sign"], match["timestamp"], int(match["attempt"]))
+
+
+# A --since/--until bound: an ISO date or datetime, or milliseconds since the epoch
+# (like the page's annotation times)
+def parse_time(value):
+    if value is None:
+        return None
+    if value.isdigit():
+        return datetime.fromtimestamp(int(value) / 1000)
+    return datetime.fromisoformat(value)
+
+
+# annots rows matching every filter, in id order. Values are lists; since is inclusive
+# and until exclusive.
+def export_query(batch=None, sign=None, user=None, label=None, since=None, until=None):
+    query = db.select(*(getattr(Annot, column) for column in ANNOT_COLUMNS))
+    for field, values in (("batch", batch), ("sign", sign), ("user", user), ("label", label)):
+        if values:
+            query = query.where(getattr(Annot, field).in_(values))
+    if since is not None:
+        query = query.where(Annot.time >= since)
+    if until is not None:
+        query = query.where(Annot.time < until)
+    return query.order_by(Annot.id)
+
+
+# Lists of export rows (dicts in EXPORT_COLUMNS order), batch_size at a time
+def iter_export_batches(query, batch_size=EXPORT_BATCH_SIZE):
+    result = db.session.execute(query.execution_options(yield_per=batch_size))
+    for partition in result.partitions():
+        batch = []
+        for row in partition:
+            entry = dict(zip(ANNOT_COLUMNS, row))
+            clip = parse_clip_filename(entry["video_path"])
+            entry.update(uid=clip.uid, clip_sign=clip.sign, timestamp=clip.timestamp, attempt=clip.attempt)
+            batch.append(entry)
+        yield batch
+
+
+def time_text(time):
+    return time.isoformat() if time is not None else None
+
+
+def jsonl_chunks(batches):
+    for batch in batches:
+        yield "".join(json.dumps(dict(entry, time=time_text(entry["time"]))) + "\n" for entry in batch)
+
+
+def csv_chunks(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in batches:
+        for entry in batch:
+            writer.writerow([time_text(entry["time"]) if column == "time" else entry[column] for column in EXPORT_COLUMNS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Just the header when nothing matched
+    if buffer.getvalue():
+        yield buffer.getvalue()
+
+
+def write_parquet(batches, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("id", pa.int64()),
+        ("batch", pa.string()),
+        ("sign", pa.string()),
+        ("user", pa.string()),
+        ("label", pa.string()),
+        ("comments", pa.string()),
+        ("time", pa.timestamp("ms")),
+        ("video_path", pa.string()),
+        ("uid", pa.string()),
+        ("clip_sign", pa.string()),
+        ("timestamp", pa.string()),
+        ("attempt", pa.int64()),
+    ])
+    rows = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for batch in batches:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            rows += len(batch)
+    return rows
+
+
+def export(fmt, output, filters, batch_size=EXPORT_BATCH_SIZE):
+    batches = iter_export_batches(export_query(**filters), batch_size)
+    if fmt == "parquet":
+        return write_parquet(batches, output)
+
+    rows = 0
+
+    def counted(batches):
+        nonlocal rows
+        for batch in batches:
+            rows += len(batch)
+            yield batch
+
+    chunks = jsonl_chunks(counted(batches)) if fmt == "jsonl" else csv_chunks(counted(batches))
+    f = sys.stdout if output == "-" else open(output, "w", newline="")
+    try:
+        for chunk in chunks:
+            f.write(chunk)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    return rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("output", type=str, help="File to write, or - for stdout")
+    parser.add_argument("--format", type=str, choices=FORMATS, default=None, help="Defaults to the output's extension, or jsonl")
+    for field in EXPORT_FILTERS:
+        parser.add_argument(f"--{field}", type=str, nargs="+", default=None)
+    parser.add_argument("--since", type=parse_time, default=None, help="Annotations made at or after this ISO datetime or epoch milliseconds")
+    parser.add_argument("--until", type=parse_time, default=None, help="Annotations made before this ISO datetime or epoch milliseconds")
+    parser.add_argument("--batch_size", type=int, default=EXPORT_BATCH_SIZE, help="Rows per database fetch and Parquet row group")
+    args = parser.parse_args()
+    if args.format is None:
+        extension = args.output.rsplit(".", 1)[-1].lower()
+        args.format = extension if extension in FORMATS else "jsonl"
+    if args.format == "parquet" and args.output == "-":
+        parser.error("Parquet can't be written to stdout")
+    return args
+
+
+if __name__ == "__main__":
+    from app import app
+
+    args = parse_args()
+    filters = {field: getattr(args, field) for field in EXPORT_FILTERS + ("since", "until")}
+    with app.app_context():
+        try:
+            rows = export(args.format, args.output, filters, args.batch_size)
+        except ImportError:
+            sys.exit("Parquet export needs pyarrow (pip install pyarrow)")
+    print(f"Exported {rows} annotations as {args.format}", file=sys.stderr)
@@ -0,0 +1,66 @@
+# Brings an annots table created before the unique key and indexes up to date:
+# adds the batch column, removes duplicate (user, video_path) rows (keeping the newest,
+# the one the old upsert would have meant to update) and creates the unique key and
+# indexes declared on Annot. Safe to run again; it only does what is missing.
+#
+#   python migrate_annots.py            # report what would change
+#   python migrate_annots.py --apply
+import sys
+
+from sqlalchemy import inspect, text
+
+from app import app
+from models import db, Annot
+
+UNIQUE_INDEX_NAME = "uq_annots_user_video_path"
+
+
+def count_duplicates():
+    return db.session.execute(text(
+        "SELECT COALESCE(SUM(n - 1), 0) FROM "
+        "(SELECT COUNT(*) AS n FROM annots GROUP BY user, video_path HAVING COUNT(*) > 1) AS dups"
+    )).scalar()
+
+
+def migrate(apply):
+    inspector = inspect(db.engine)
+    columns = {column["name"] for column in inspector.get_columns("annots")}
+    existing = {index["name"] for index in inspector.get_indexes("annots")}
+    existing |= {constraint["name"] for constraint in inspector.get_unique_constraints("annots")}
+
+    steps = []
+    if "batch" not in columns:
+        steps.append(("add column batch", text("ALTER TABLE annots ADD COLUMN batch VARCHAR(255)")))
+
+    if UNIQUE_INDEX_NAME not in existing:
+        duplicates = count_duplicates()
+        if duplicates:
+            # The derived table lets MySQL delete from the table it selects from
+            steps.append((f"delete {duplicates} duplicate (user, video_path) rows", text(
+                "DELETE FROM annots WHERE id NOT IN "
+                "(SELECT id FROM (SELECT MAX(id) AS id FROM annots GROUP BY user, video_path) AS keep)"
+            )))
+        unique = db.Index(UNIQUE_INDEX_NAME, Annot.__table__.c.user, Annot.__table__.c.video_path, unique=True)
+        steps.append((f"create unique index {UNIQUE_INDEX_NAME}", unique))
+
+    for index in sorted(Annot.__table__.indexes, key=lambda index: index.name):
+        if index.name not in existing and index.name != UNIQUE_INDEX_NAME:
+            steps.append((f"create index {index.name}", index))
+
+    for description, step in steps:
+        print(("" if apply else "would ") + description)
+        if not apply:
+            continue
+        if isinstance(step, db.Index):
+            step.create(db.engine)
+        else:
+            db.session.execute(step)
+            db.session.commit()
+
+    if not steps:
+        print("annots is up to date")
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        migrate("--apply" in sys.argv[1:])
@@ -5,9 +5,26 @@ db = SQLAlchemy()
 
 class Annot(db.Model):
     __tablename__ = "annots"
+    # One annotation per user and video, which the upserts rely on; (user, sign) is the
+    # annotation page's preload. /annots pages through one filter's rows in id order, so
+    # each filter column has an index ending in id (sign's gets it implicitly, as both
+    # MySQL and SQLite end secondary indexes with the primary key). Existing databases
+    # get these from migrate_annots.py.
+    __table_args__ = (
+        db.UniqueConstraint("user", "video_path", name="uq_annots_user_video_path"),
+        db.Index("ix_annots_sign", "sign"),
+        db.Index("ix_annots_user_sign", "user", "sign"),
+        db.Index("ix_annots_video_path", "video_path"),
+        db.Index("ix_annots_batch_sign", "batch", "sign"),
+        db.Index("ix_annots_user_id", "user", "id"),
+        db.Index("ix_annots_batch_id", "batch", "id"),
+        db.Index("ix_annots_label_id", "label", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     video_path = db.Column(db.String(255), nullable=False)
+    # Batch of the review video, from its /api/video/review/<batch>/<sign>/<file> path
+    batch = db.Column(db.String(255))
     sign = db.Column(db.String(255), nullable=False)
     user = db.Column(db.String(255), nullable=False)
     time = db.Column(db.TIMESTAMP, default=datetime)
@@ -18,4 +35,31 @@ class User(db.Model):
     __tablename__ = "users"
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    username = db.Column(db.String(255), unique=True, nullable=False)
\ No newline at end of file
+    username = db.Column(db.String(255), unique=True, nullable=False)
+
+# Running count of annotations per (sign, user, label), kept in step with annots by
+# every write in app.py (see progress.py) so /progress never scans annots
+class AnnotCount(db.Model):
+    __tablename__ = "annot_counts"
+
+    sign = db.Column(db.String(255), primary_key=True)
+    user = db.Column(db.String(255), primary_key=True)
+    label = db.Column(db.String(255), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+# Bumped by every write in app.py that changes a sign's annotations (see progress.py),
+# in the same transaction, so agreement.py can tell which signs changed without
+# trusting the annotation times, which come from the annotators' browsers
+class SignVersion(db.Model):
+    __tablename__ = "sign_versions"
+
+    sign = db.Column(db.String(255), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+# Videos to review per batch and sign, loaded from the decode's clip catalogs by progress.py
+class SignVideos(db.Model):
+    __tablename__ = "sign_videos"
+
+    batch = db.Column(db.String(255), primary_key=True)
+    sign = db.Column(db.String(255), primary_key=True)
+    videos = db.Column(db.Integer, nullable=False, default=0)
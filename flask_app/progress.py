@@ -0,0 +1,206 @@
+# Review progress aggregates: annot_counts (annotations per sign, user and label) and
+# sign_videos (videos per batch and sign, from the decode's clip catalogs).
+#
+# annot_counts is maintained incrementally by app.py in the same transaction as every
+# annotation upsert. This script rebuilds it in bulk and checks the two agree:
+#
+#   python progress.py verify                         # compare, exit 1 on any difference
+#   python progress.py rebuild                        # recompute annot_counts from annots
+#   python progress.py load_catalogs <review_source>  # recount sign_videos
+import json
+import os
+import sys
+from collections import Counter
+
+from sqlalchemy import func
+
+from models import db, Annot, AnnotCount, SignVersion, SignVideos
+from storage import begin_write, upsert
+
+CATALOG_FILENAME = "clip_catalog.jsonl"
+
+
+# Adds signed deltas {(sign, user, label): n} to annot_counts in one upsert
+def add_counts(deltas):
+    rows = [
+        {"sign": sign, "user": user, "label": label, "count": n}
+        for (sign, user, label), n in deltas.items() if n
+    ]
+    if not rows:
+        return
+    db.session.execute(upsert(AnnotCount, rows, key=("sign", "user", "label"), increment=("count",)))
+
+
+# Bumps sign_versions for signs whose annotations changed, in one upsert
+def bump_sign_versions(signs):
+    if not signs:
+        return
+    rows = [{"sign": sign, "version": 1} for sign in sorted(signs)]
+    db.session.execute(upsert(SignVersion, rows, key=("sign",), increment=("version",)))
+
+
+# Updates annot_counts for annotation rows about to be upserted, in the caller's
+# transaction: a new annotation counts in its (sign, label) bucket, a changed one moves
+# from its old bucket to the new one. The current rows are read with FOR UPDATE on
+# MySQL, and on SQLite the caller's transaction began as a write (storage.begin_write),
+# so a concurrent write of the same annotation waits for this transaction. Returns the
+# deltas applied.
+def record_label_changes(rows):
+    current = {}
+    for user in {row["user"] for row in rows}:
+        paths = [row["video_path"] for row in rows if row["user"] == user]
+        existing = db.session.execute(
+            db.select(Annot.video_path, Annot.sign, Annot.label)
+            .where(Annot.user == user, Annot.video_path.in_(paths))
+            .with_for_update()
+        )
+        for video_path, sign, label in existing:
+            current[(user, video_path)] = (sign, label)
+
+    deltas = Counter()
+    for row in rows:
+        key = (row["user"], row["video_path"])
+        new = (row["sign"], row["label"])
+        old = current.get(key)
+        if old == new:
+            continue
+        if old is not None:
+            deltas[(old[0], row["user"], old[1])] -= 1
+        deltas[(new[0], row["user"], new[1])] += 1
+        # A later row for the same video in this batch replaces this one
+        current[key] = new
+    add_counts(deltas)
+    return deltas
+
+
+# One upsert for all rows on the (user, video_path) key
+def upsert_annots(rows):
+    return upsert(Annot, rows, key=("user", "video_path"), update=("sign", "batch", "label", "comments", "time"))
+
+
+# Upserts annotation rows (as app.annot_row makes them), moves their progress counts
+# and bumps the versions of the signs whose labels changed, in a write transaction the
+# caller commits
+def write_annots(rows):
+    begin_write()
+    deltas = record_label_changes(rows)
+    db.session.execute(upsert_annots(rows))
+    bump_sign_versions({sign for (sign, _, _), n in deltas.items() if n})
+
+
+# {sign: {"videos", "annotations", "labels": {label: n}, "users": {user: {label: n}}}}
+# from the aggregate tables alone, optionally for one sign and/or user
+def progress(sign=None, user=None):
+    counts = db.select(AnnotCount).where(AnnotCount.count != 0)
+    videos = db.select(SignVideos.sign, func.sum(SignVideos.videos)).group_by(SignVideos.sign)
+    if sign is not None:
+        counts = counts.where(AnnotCount.sign == sign)
+        videos = videos.where(SignVideos.sign == sign)
+    if user is not None:
+        counts = counts.where(AnnotCount.user == user)
+
+    signs = {}
+
+    def entry(name):
+        return signs.setdefault(name, {"videos": 0, "annotations": 0, "labels": {}, "users": {}})
+
+    for name, total in db.session.execute(videos):
+        entry(name)["videos"] = int(total or 0)
+    for count in db.session.execute(counts).scalars():
+        sign_entry = entry(count.sign)
+        sign_entry["annotations"] += count.count
+        sign_entry["labels"][count.label] = sign_entry["labels"].get(count.label, 0) + count.count
+        sign_entry["users"].setdefault(count.user, {})[count.label] = count.count
+    return signs
+
+
+# What annot_counts should hold, counted from annots
+def recount():
+    rows = db.session.execute(
+        db.select(Annot.sign, Annot.user, Annot.label, func.count()).group_by(Annot.sign, Annot.user, Annot.label)
+    )
+    return {(sign, user, label): n for sign, user, label, n in rows}
+
+
+def stored_counts():
+    return {
+        (count.sign, count.user, count.label): count.count
+        for count in db.session.execute(db.select(AnnotCount)).scalars()
+        if count.count
+    }
+
+
+# Differences between the incremental and the recounted aggregates, as (key, stored, expected)
+def compare():
+    expected = recount()
+    stored = stored_counts()
+    return [
+        (key, stored.get(key, 0), expected.get(key, 0))
+        for key in sorted(set(expected) | set(stored))
+        if stored.get(key, 0) != expected.get(key, 0)
+    ]
+
+
+def rebuild():
+    begin_write()
+    expected = recount()
+    db.session.query(AnnotCount).delete()
+    if expected:
+        db.session.execute(db.insert(AnnotCount), [
+            {"sign": sign, "user": user, "label": label, "count": n}
+            for (sign, user, label), n in expected.items()
+        ])
+    db.session.commit()
+    return len(expected)
+
+
+# Recounts sign_videos from the clip_catalog.jsonl of every batch under review_source
+# (laid out as review_source/<batch>/<sign>/<file>, like the annotation UI expects)
+def load_catalogs(review_source):
+    videos = Counter()
+    for batch in sorted(os.listdir(review_source)):
+        catalog_path = os.path.join(review_source, batch, CATALOG_FILENAME)
+        if not os.path.isfile(catalog_path):
+            continue
+        latest = {}
+        with open(catalog_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                latest[entry["path"]] = entry
+        for entry in latest.values():
+            if entry["status"] == "ok" and entry["path"] == f"{entry['sign']}/{entry['filename']}":
+                videos[(batch, entry["sign"])] += 1
+
+    db.session.query(SignVideos).delete()
+    if videos:
+        db.session.execute(db.insert(SignVideos), [
+            {"batch": batch, "sign": sign, "videos": n} for (batch, sign), n in videos.items()
+        ])
+    db.session.commit()
+    return videos
+
+
+if __name__ == "__main__":
+    from app import app
+
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    with app.app_context():
+        if command == "verify":
+            differences = compare()
+            for (sign, user, label), stored, expected in differences:
+                print(f"{sign!r} {user!r} {label!r}: stored {stored}, annots has {expected}")
+            print(f"{len(differences)} differences")
+            sys.exit(1 if differences else 0)
+        elif command == "rebuild":
+            differences = compare()
+            print(f"{len(differences)} differences before rebuilding")
+            print(f"Rebuilt annot_counts: {rebuild()} (sign, user, label) buckets")
+        elif command == "load_catalogs" and len(sys.argv) > 2:
+            videos = load_catalogs(sys.argv[2])
+            print(f"{sum(videos.values())} videos in {len({sign for _, sign in videos})} signs across {len({batch for batch, _ in videos})} batches")
+        else:
+            print("Usage: python progress.py verify | rebuild | load_catalogs <review_source>")
+            sys.exit(2)
@@ -0,0 +1,79 @@
+from sqlalchemy import event
+from sqlalchemy.dialects import mysql, sqlite
+
+from config import Config
+from models import db
+
+
+# SQLALCHEMY_ENGINE_OPTIONS for the configured database
+def engine_options(uri):
+    if uri.startswith("sqlite"):
+        # The connection is handed between request threads by the pool
+        return {"connect_args": {"timeout": Config.SQLITE_BUSY_TIMEOUT, "check_same_thread": False}}
+    return {
+        "pool_size": Config.DB_POOL_SIZE,
+        "max_overflow": Config.DB_MAX_OVERFLOW,
+        "pool_timeout": Config.DB_POOL_TIMEOUT,
+        "pool_recycle": Config.DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+# Execution option that makes a SQLite transaction begin with BEGIN IMMEDIATE (see begin_write)
+SQLITE_WRITE = "sqlite_write"
+
+
+# SQLite runs in WAL mode so reads never wait on the writer. Transactions begin
+# deferred, so a read (an export, an agreement reload) holds no lock; write
+# transactions begin with BEGIN IMMEDIATE instead, through begin_write.
+def configure_engine(engine):
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        # Let SQLAlchemy's begin event, not the driver, start transactions
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def on_begin(connection):
+        if connection.get_execution_options().get(SQLITE_WRITE):
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+        else:
+            connection.exec_driver_sql("BEGIN")
+
+
+# Starts the session's transaction as a write, before its first statement. Writes read
+# the rows they are about to change first (see progress.record_label_changes); on
+# SQLite, taking the write lock up front makes a concurrent writer wait its turn the way
+# MySQL's FOR UPDATE does, rather than fail with "database is locked" when it tries to
+# upgrade a read transaction. A read transaction the request already has open (the
+# user check) is committed first, since it can't be upgraded.
+def begin_write():
+    if db.engine.dialect.name != "sqlite":
+        return
+    if db.session().in_transaction():
+        db.session.commit()
+    db.session.connection(execution_options={SQLITE_WRITE: True})
+
+
+# One multi-row INSERT that updates rows whose key already exists: ON DUPLICATE KEY
+# UPDATE on MySQL, ON CONFLICT (key) DO UPDATE on SQLite. update columns take the new
+# row's value; increment columns add it to the stored one.
+def upsert(model, rows, key, update=(), increment=()):
+    if db.engine.dialect.name == "mysql":
+        cmd = mysql.insert(model).values(rows)
+        new = cmd.inserted
+        values = {column: new[column] for column in update}
+        values.update({column: getattr(model, column) + new[column] for column in increment})
+        return cmd.on_duplicate_key_update(**values)
+
+    cmd = sqlite.insert(model).values(rows)
+    new = cmd.excluded
+    values = {column: new[column] for column in update}
+    values.update({column: getattr(model, column) + new[column] for column in increment})
+    return cmd.on_conflict_do_update(index_elements=list(key), set_=values)
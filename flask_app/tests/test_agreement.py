@@ -0,0 +1,49 @@
+from datetime import datetime
+
+from agreement import AgreementIndex
+from models import db, Annot
+from progress import write_annots
+
+
+def annot(user, label, time, video="u1-apple-1-1.mp4"):
+    return {"sign": "apple", "user": user, "label": label, "comments": "", "time": time, "video_path": video, "batch": "b1"}
+
+
+def save(rows):
+    write_annots(rows)
+    db.session.commit()
+
+
+# Annotation times come from the browsers; a relabel whose clock is behind the sign's
+# latest annotation must still be picked up
+def test_refresh_sees_relabel_with_older_time(app):
+    save([annot("a", "Good", datetime(2025, 1, 1, 12, 0)), annot("b", "Good", datetime(2025, 1, 1, 11, 55))])
+    index = AgreementIndex(ttl=0)
+    assert index.current().sign_detail("apple")["disagreements"] == 0
+
+    save([annot("b", "Bad", datetime(2025, 1, 1, 11, 59))])
+    detail = index.current().sign_detail("apple")
+    assert detail["disagreements"] == 1
+    assert detail["disagreement_videos"][0]["labels"] == {"a": "Good", "b": "Bad"}
+    assert index.summary()["reloaded_signs"] == 1
+
+    # Nothing changed, nothing reloaded
+    assert index.current().summary()["reloaded_signs"] == 0
+
+
+# A request keeps working from the view it took while another request refreshes
+def test_refresh_leaves_taken_views_alone(app):
+    save([annot("a", "Good", datetime(2025, 1, 1, 12)), annot("b", "Bad", datetime(2025, 1, 1, 12))])
+    index = AgreementIndex(ttl=0)
+    view = index.current().view
+    signs, pairs = dict(view.signs), {pair: total.copy() for pair, total in view.pair_totals.items()}
+
+    db.session.execute(db.delete(Annot))
+    db.session.commit()
+    save([annot("c", "Good", datetime(2025, 1, 1, 12), video="u1-banana-1-1.mp4")])
+    index.current()
+
+    assert view.signs == signs
+    assert view.pair_totals.keys() == pairs.keys()
+    assert all((view.pair_totals[pair] == total).all() for pair, total in pairs.items())
+    assert index.view.pair_totals == {}
@@ -0,0 +1,107 @@
+import json
+from datetime import datetime
+
+import pytest
+
+import annot_journal
+from annot_journal import AnnotJournal, read_checkpoint, read_unflushed
+
+
+def row(label, video="u1-apple-1-1.mp4"):
+    return {"sign": "apple", "user": "ann", "label": label, "comments": "", "time": datetime(2025, 1, 1, 12), "video_path": video, "batch": "b1"}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(annot_journal.time, "time", lambda: now[0])
+    return now
+
+
+def test_lag_counts_from_first_unflushed_edit(tmp_path, clock):
+    written = []
+
+    def write(rows):
+        if fail:
+            raise RuntimeError("database is down")
+        written.extend(rows)
+
+    fail = True
+    journal = AnnotJournal(str(tmp_path / "annots.jsonl"), write, start=False)
+    journal.append([row("Good")])
+    clock[0] += 5
+    journal.append([row("Bad")])
+    assert journal.stats()["lag_seconds"] == 5
+    assert journal.stats()["coalesced"] == 1
+
+    # Still waiting since the first edit after a failed flush and another edit
+    assert not journal.flush()
+    clock[0] += 5
+    journal.append([row("Variant")])
+    assert journal.stats()["lag_seconds"] == 10
+
+    # And as a restart would replay it
+    pending, entries, _ = read_unflushed(journal.path, read_checkpoint(journal.path))
+    assert entries == 3
+    (seq, at, pending_row), = pending.values()
+    assert at == 1000.0 and pending_row["label"] == "Variant"
+
+    fail = False
+    assert journal.flush()
+    assert [r["label"] for r in written] == ["Variant"]
+    assert journal.stats()["lag_seconds"] == 0.0
+    journal.close()
+
+
+class DatabaseDown(Exception):
+    pass
+
+
+def test_rejected_rows_are_dead_lettered(tmp_path):
+    written = []
+    down = False
+
+    def write(rows):
+        if down:
+            raise DatabaseDown()
+        if any(not isinstance(r["label"], str) for r in rows):
+            raise TypeError("unhashable type: 'list'")
+        written.extend(rows)
+
+    path = str(tmp_path / "annots.jsonl")
+    journal = AnnotJournal(path, write, start=False, transient=lambda e: isinstance(e, DatabaseDown))
+
+    # While the database is down nothing is given up on
+    journal.append([row(["Good"]), row("Good", video="u1-apple-2-1.mp4")])
+    down = True
+    assert not journal.flush()
+    assert journal.stats()["pending"] == 2 and journal.stats()["dead_lettered"] == 0
+
+    down = False
+    assert journal.flush()
+    assert [r["video_path"] for r in written] == ["u1-apple-2-1.mp4"]
+    stats = journal.stats()
+    assert (stats["pending"], stats["flushed"], stats["dead_lettered"], stats["unflushed_entries"]) == (0, 1, 1, 0)
+    journal.close()
+
+    with open(path + ".dead") as f:
+        dead, = [json.loads(line) for line in f]
+    assert dead["row"]["label"] == ["Good"] and dead["error"].startswith("TypeError")
+    # Nothing left to replay
+    assert read_unflushed(path, read_checkpoint(path))[0] == {}
+
+
+# The review's repro: a malformed row journaled ahead of a valid one no longer keeps
+# the valid one out of the database
+def test_flush_annots_sets_aside_malformed_rows(client, tmp_path):
+    import app as labels_app
+    from models import db, Annot
+
+    journal = AnnotJournal(str(tmp_path / "annots.jsonl"), labels_app.flush_annots, start=False, transient=labels_app.transient_write_error)
+    journal.append([row(["Good"])])
+    journal.append([row("Good", video="u1-apple-2-1.mp4")])
+    assert journal.flush()
+    assert journal.stats()["dead_lettered"] == 1
+    journal.close()
+    with labels_app.app.app_context():
+        assert db.session.execute(db.select(Annot.video_path, Annot.label)).all() == [("u1-apple-2-1.mp4", "Good")]
@@ -0,0 +1,89 @@
+# The write endpoints on app.py's own app (the client fixture in conftest.py)
+from models import db, Annot
+
+VALID = {"sign": "apple", "label": "Good", "comments": "", "time": 1735732800000, "video_path": "/api/video/review/b1/apple/u1-apple-1-1.mp4"}
+
+
+def stored_rows():
+    import app as labels_app
+
+    with labels_app.app.app_context():
+        return [(a.video_path, a.label, a.batch) for a in db.session.execute(db.select(Annot).order_by(Annot.id)).scalars()]
+
+
+def test_add_annots_reports_each_item(client):
+    annotations = [
+        VALID,
+        dict(VALID, label=["Good"]),
+        dict(VALID, sign=7),
+        dict(VALID, video_path=None),
+        dict(VALID, comments={"a": 1}),
+        dict(VALID, time=True),
+        dict(VALID, time=1e300),
+        dict(VALID, time=-1e20),
+        dict(VALID, label="x" * 256),
+        "not an object",
+        dict(VALID, video_path="/api/video/review/b1/apple/u1-apple-2-1.mp4", comments=None),
+    ]
+    response = client.post("/add_annots", json={"user": "ann", "annotations": annotations})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["added"] == 2
+    assert [result["status"] for result in body["results"]] == ["ok"] + ["error"] * 9 + ["ok"]
+    assert [result.get("error") for result in body["results"][1:10]] == [
+        "label must be a string",
+        "sign must be a string",
+        "Missing video_path",
+        "comments must be a string",
+        "time must be milliseconds since the epoch",
+        "time is out of range",
+        "time is out of range",
+        "label is longer than 255 characters",
+        "Annotation must be an object",
+    ]
+    assert stored_rows() == [("u1-apple-1-1.mp4", "Good", "b1"), ("u1-apple-2-1.mp4", "Good", "b1")]
+
+
+def test_add_annot_errors_are_json(client):
+    for body in [dict(VALID), dict(VALID, user=["ann"])]:
+        response = client.post("/add_annot", json=body)
+        assert response.status_code == 400 and "error" in response.get_json()
+    response = client.post("/add_annot", data="not json", content_type="text/plain")
+    assert response.status_code == 400 and "error" in response.get_json()
+    response = client.post("/add_annot", json=dict(VALID, user="ann", label=["Good"]))
+    assert response.status_code == 400 and response.get_json() == {"error": "label must be a string"}
+    response = client.post("/add_annot", json=dict(VALID, user="nobody"))
+    assert response.status_code == 403
+
+    assert client.post("/add_annot", json=dict(VALID, user="ann")).status_code == 200
+    assert stored_rows() == [("u1-apple-1-1.mp4", "Good", "b1")]
+
+
+def test_add_annots_rejects_malformed_requests(client):
+    for body in [{"annotations": [VALID]}, {"user": 1, "annotations": [VALID]}, {"user": "ann", "annotations": {}}]:
+        response = client.post("/add_annots", json=body)
+        assert response.status_code == 400 and "error" in response.get_json()
+
+
+def test_annots_pages(client):
+    annotations = [dict(VALID, video_path=f"/api/video/review/b1/apple/u1-apple-{i}-1.mp4", label=["Good", "Bad"][i % 2]) for i in range(7)]
+    assert client.post("/add_annots", json={"user": "ann", "annotations": annotations}).get_json()["added"] == 7
+    seen = []
+    cursor = 0
+    while cursor is not None:
+        page = client.get(f"/annots?user=ann&label=Bad&limit=2&cursor={cursor}").get_json()
+        seen += [annot["video_path"] for annot in page["annotations"]]
+        cursor = page["next_cursor"]
+    assert seen == [f"u1-apple-{i}-1.mp4" for i in (1, 3, 5)]
+
+
+# Every single-filter page is a range scan of an index already in id order: no sort
+def test_annots_pages_scan_in_id_order(client):
+    import app as labels_app
+
+    with labels_app.app.app_context():
+        for field in labels_app.ANNOT_FILTERS:
+            query = labels_app.annots_page_query({field: "x"}, 10, 100)
+            sql = str(query.compile(db.engine, compile_kwargs={"literal_binds": True}))
+            plan = " ".join(row[-1] for row in db.session.execute(db.text("EXPLAIN QUERY PLAN " + sql)))
+            assert "INDEX" in plan and "TEMP B-TREE" not in plan, (field, plan)
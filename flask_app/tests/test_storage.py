@@ -0,0 +1,122 @@
+# The annotation write path (progress.write_annots: the upsert plus the annot_counts
+# it moves) on each backend of the app fixture (conftest.py)
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from export_annots import export_query, iter_export_batches
+from models import db, Annot
+from progress import compare, progress, stored_counts, write_annots
+
+
+def annot(video, label, user="ann", sign="apple", minutes=0):
+    return {
+        "sign": sign,
+        "user": user,
+        "label": label,
+        "comments": "",
+        "time": datetime(2025, 1, 1, 12) + timedelta(minutes=minutes),
+        "video_path": f"u1-{sign}-{video}-1.mp4",
+        "batch": "b1",
+    }
+
+
+def save(rows):
+    write_annots(rows)
+    db.session.commit()
+
+
+def stored_labels():
+    return {(a.user, a.video_path): a.label for a in db.session.execute(db.select(Annot)).scalars()}
+
+
+def test_upsert_inserts_then_updates(app):
+    save([annot(1, "Good"), annot(2, "Bad")])
+    save([annot(2, "Variant", minutes=1), annot(3, "Good")])
+    assert stored_labels() == {
+        ("ann", "u1-apple-1-1.mp4"): "Good",
+        ("ann", "u1-apple-2-1.mp4"): "Variant",
+        ("ann", "u1-apple-3-1.mp4"): "Good",
+    }
+    assert db.session.query(Annot).count() == 3
+
+
+def test_label_changes_move_counts(app):
+    save([annot(1, "Good"), annot(2, "Good"), annot(1, "Good", user="bob")])
+    # A relabel, an unchanged row and one video twice in a batch (the last row wins)
+    save([annot(1, "Bad"), annot(2, "Good"), annot(3, "Good"), annot(3, "Variant")])
+    assert stored_counts() == {
+        ("apple", "ann", "Good"): 1,
+        ("apple", "ann", "Bad"): 1,
+        ("apple", "ann", "Variant"): 1,
+        ("apple", "bob", "Good"): 1,
+    }
+    assert progress(sign="apple")["apple"]["labels"] == {"Good": 2, "Bad": 1, "Variant": 1}
+    assert compare() == []
+
+
+def test_concurrent_writers_keep_counts(app):
+    labels = ["Good", "Variant", "Bad", "Further Review"]
+    errors = []
+
+    # Every writer relabels every video, in batches, in a different order
+    def relabel(writer):
+        rows = [annot(video, labels[(video + writer) % 4]) for video in range(40)]
+        rows = rows[writer:] + rows[:writer]
+        with app.app_context():
+            try:
+                for i in range(0, len(rows), 10):
+                    save(rows[i:i + 10])
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=relabel, args=(writer,)) for writer in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert db.session.query(Annot).count() == 40
+    assert compare() == []
+
+
+def test_reads_do_not_block_writes(app):
+    save([annot(video, "Good") for video in range(30)])
+    reading = threading.Event()
+    written = threading.Event()
+    errors = []
+
+    # An export holding its read open, like a client downloading /export slowly
+    def export():
+        with app.app_context():
+            try:
+                batches = iter_export_batches(export_query(), batch_size=10)
+                next(batches)
+                reading.set()
+                written.wait(10)
+                for _ in batches:
+                    pass
+            except Exception as e:
+                errors.append(e)
+            finally:
+                reading.set()
+                db.session.remove()
+
+    reader = threading.Thread(target=export)
+    reader.start()
+    reading.wait()
+    try:
+        save([annot(0, "Bad")])
+    finally:
+        written.set()
+        reader.join()
+    assert errors == []
+    assert stored_labels()[("ann", "u1-apple-0-1.mp4")] == "Bad"
+    assert compare() == []
+
+
+def test_sqlite_is_wal(app):
+    if db.engine.dialect.name != "sqlite":
+        pytest.skip("SQLite only")
+    assert db.session.execute(db.text("PRAGMA journal_mode")).scalar() == "wal"
@@ -0,0 +1,62 @@
+import os
+import threading
+import time
+
+from config import Config
+from models import db, User
+
+
+# Every username, held in memory so checking the user of a request needs no query.
+# The set is reloaded in one query when it is older than ttl seconds or when the
+# version marker file (bumped by add_user.py) has changed; checking the marker is one
+# stat per request.
+class UserCache:
+    def __init__(self, ttl=Config.USER_CACHE_TTL, version_path=Config.USER_VERSION_FILE):
+        self.ttl = ttl
+        self.version_path = version_path
+        self.lock = threading.Lock()
+        self.usernames = None
+        self.loaded_at = 0.0
+        self.version = None
+
+    def marker_version(self):
+        try:
+            stat = os.stat(self.version_path)
+        except OSError:
+            return None
+        # add_user.py replaces the file, so the inode changes even where mtimes are coarse
+        return stat.st_ino, stat.st_mtime_ns
+
+    def is_stale(self, usernames, version):
+        return (
+            usernames is None
+            or version != self.version
+            or time.monotonic() - self.loaded_at > self.ttl
+        )
+
+    # Needs an app context
+    def refresh(self, version):
+        usernames = frozenset(db.session.execute(db.select(User.username)).scalars())
+        self.usernames, self.version, self.loaded_at = usernames, version, time.monotonic()
+        return usernames
+
+    # Works on one read of self.usernames, which a concurrent refresh may replace
+    def contains(self, username):
+        if not isinstance(username, str):
+            return False
+        version = self.marker_version()
+        usernames = self.usernames
+        if self.is_stale(usernames, version):
+            with self.lock:
+                usernames = self.usernames
+                if self.is_stale(usernames, version):
+                    usernames = self.refresh(version)
+        return username in usernames
+
+
+# Tells running apps their user cache is out of date
+def bump_user_version(path=Config.USER_VERSION_FILE):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(f"{time.time_ns()}\n")
+    os.replace(tmp_path, path)
@@ -0,0 +1,169 @@
+import json
+import os
+from collections import defaultdict
+
+from cut_plan import Clip, clean_sign
+
+
+# One row per planned clip. Paths are absolute so a plan can be executed from anywhere
+# that sees the same filesystem.
+PLAN_COLUMNS = [
+    "uid",
+    "sign",
+    "sign_name",
+    "attempt",
+    "is_valid",
+    "is_hold",
+    "timestamps_file",
+    "recording_file",
+    "source",
+    "start",
+    "duration",
+    "dest",
+]
+
+PARQUET_BATCH_ROWS = 10000
+
+
+def plan_rows(timestamps_file, videopath, plan):
+    rows = []
+    for i in range(len(plan)):
+        rows.append({
+            "uid": plan.uid,
+            "sign": clean_sign(plan.signs[i]),
+            "sign_name": plan.signs[i],
+            "attempt": int(plan.attempts[i]),
+            "is_valid": bool(plan.is_valid[i]),
+            "is_hold": bool(plan.is_hold[i]),
+            "timestamps_file": timestamps_file,
+            "recording_file": plan.filenames[i],
+            "source": os.path.abspath(videopath),
+            "start": float(plan.start[i]),
+            "duration": float(plan.duration[i]),
+            "dest": os.path.abspath(plan.paths[i]),
+        })
+    return rows
+
+
+def clip_from_row(row):
+    return Clip(
+        row["start"], row["duration"], row["dest"], row["is_valid"],
+        row["recording_file"], row["sign_name"], row["uid"], row["attempt"], row["is_hold"]
+    )
+
+
+def shard_path(path, shard_index, num_shards):
+    stem, ext = os.path.splitext(path)
+    return f"{stem}-{shard_index:05d}-of-{num_shards:05d}{ext}"
+
+
+def plan_format(path):
+    if path.endswith(".parquet"):
+        return "parquet"
+    if path.endswith(".jsonl"):
+        return "jsonl"
+    raise ValueError(f"Plan files must end in .jsonl or .parquet: {path}")
+
+
+class PlanWriter:
+    def __init__(self, path):
+        self.path = path
+        self.format = plan_format(path)
+        self.buffer = []
+        self.writer = None
+        if self.format == "jsonl":
+            self.file = open(path, "w")
+        else:
+            import pyarrow  # noqa: F401  (fail early if parquet output is not available)
+
+    def write(self, rows):
+        if self.format == "jsonl":
+            for row in rows:
+                self.file.write(json.dumps(row) + "\n")
+            return
+
+        self.buffer.extend(rows)
+        if len(self.buffer) >= PARQUET_BATCH_ROWS:
+            self.flush_parquet()
+
+    def flush_parquet(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pylist(self.buffer, schema=parquet_schema())
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+        self.buffer = []
+
+    def close(self):
+        if self.format == "jsonl":
+            self.file.close()
+            return
+        if self.buffer or self.writer is None:
+            self.flush_parquet()
+        self.writer.close()
+
+
+def parquet_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("uid", pa.string()),
+        ("sign", pa.string()),
+        ("sign_name", pa.string()),
+        ("attempt", pa.int64()),
+        ("is_valid", pa.bool_()),
+        ("is_hold", pa.bool_()),
+        ("timestamps_file", pa.string()),
+        ("recording_file", pa.string()),
+        ("source", pa.string()),
+        ("start", pa.float64()),
+        ("duration", pa.float64()),
+        ("dest", pa.string()),
+    ])
+
+
+def read_plan(path):
+    if plan_format(path) == "jsonl":
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+
+    import pyarrow.parquet as pq
+
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=PARQUET_BATCH_ROWS):
+        yield from batch.to_pylist()
+
+
+# Counts per sign and per uid, i.e. how many recordings a wave yields before anything is encoded
+class PlanSummary:
+    def __init__(self):
+        self.by_sign = defaultdict(lambda: {"clips": 0, "valid": 0, "seconds": 0.0})
+        self.by_uid = defaultdict(lambda: {"videos": 0, "clips": 0, "valid": 0, "seconds": 0.0})
+        self.videos = 0
+        self.parse_errors = 0
+
+    def add_video(self, rows):
+        self.videos += 1
+        if rows:
+            self.by_uid[rows[0]["uid"]]["videos"] += 1
+        for row in rows:
+            for counts in (self.by_sign[row["sign"]], self.by_uid[row["uid"]]):
+                counts["clips"] += 1
+                counts["valid"] += int(row["is_valid"])
+                counts["seconds"] += max(0.0, row["duration"])
+
+    def to_dict(self):
+        return {
+            "videos": self.videos,
+            "clips": sum(counts["clips"] for counts in self.by_uid.values()),
+            "valid": sum(counts["valid"] for counts in self.by_uid.values()),
+            "seconds": sum(counts["seconds"] for counts in self.by_uid.values()),
+            "signs": len(self.by_sign),
+            "parse_errors": self.parse_errors,
+            "by_sign": dict(sorted(self.by_sign.items())),
+            "by_uid": dict(sorted(self.by_uid.items())),
+        }
@@ -0,0 +1,204 @@
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+from collections import namedtuple
+
+
+PROBE_CACHE_FILENAME = "probe_cache.sqlite"
+
+# What ffprobe told us about a source video's first video stream. duration is the
+# container's, in seconds; keyframes are in seconds from the start of the file;
+# rotation is the display rotation in degrees (0 when there is none); audio_codec is the
+# first audio stream's codec (None when there is no audio)
+VideoProbe = namedtuple(
+    "VideoProbe",
+    ["codec_name", "pix_fmt", "profile", "duration", "fps", "width", "height", "rotation", "audio_codec", "keyframes"]
+)
+
+
+def parse_rate(rate):
+    try:
+        num, den = (rate or "0/0").split("/")
+        return float(num) / float(den) if float(den) else None
+    except ValueError:
+        return None
+
+
+# Phones store rotation either as a "rotate" tag (older ffmpeg) or in the display matrix side data
+def stream_rotation(stream):
+    rotate = stream.get("tags", {}).get("rotate")
+    if rotate is None:
+        for side_data in stream.get("side_data_list", []):
+            if "rotation" in side_data:
+                rotate = side_data["rotation"]
+                break
+    return int(float(rotate or 0)) % 360
+
+
+# Reads a source video's stream info and keyframe positions from its headers and packet
+# headers (nothing is decoded)
+def probe_video(videopath):
+    out = subprocess.run(
+        [
+            "ffprobe", "-v", "error",
+            "-select_streams", "v:0",
+            "-show_entries",
+            "format=start_time,duration"
+            ":stream=codec_name,pix_fmt,profile,width,height,avg_frame_rate,r_frame_rate"
+            ":stream_tags=rotate:stream_side_data=rotation"
+            ":packet=pts_time,flags",
+            "-of", "json",
+            videopath,
+        ],
+        capture_output=True, text=True, check=True
+    )
+    info = json.loads(out.stdout)
+
+    stream = info["streams"][0] if info.get("streams") else {}
+    fmt = info.get("format", {})
+    start_time = float(fmt.get("start_time", 0) or 0)
+    keyframes = sorted(
+        float(packet["pts_time"]) - start_time
+        for packet in info.get("packets", [])
+        if "K" in packet.get("flags", "") and packet.get("pts_time", "N/A") != "N/A"
+    )
+    duration = float(fmt["duration"]) if fmt.get("duration", "N/A") != "N/A" else None
+    return VideoProbe(
+        stream.get("codec_name"), stream.get("pix_fmt"), stream.get("profile"),
+        duration, parse_rate(stream.get("avg_frame_rate")) or parse_rate(stream.get("r_frame_rate")),
+        stream.get("width"), stream.get("height"), stream_rotation(stream), probe_audio_codec(videopath), keyframes,
+    )
+
+
+# The codec of a video's first audio stream, None when it has none
+def probe_audio_codec(videopath):
+    out = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=codec_name", "-of", "json", videopath],
+        capture_output=True, text=True, check=True
+    )
+    streams = json.loads(out.stdout).get("streams")
+    return streams[0].get("codec_name") if streams else None
+
+
+# Persistent ffprobe results for source videos, keyed on path, size and mtime so a
+# recording is probed once and again only if it changes. Failed probes are stored too,
+# so a broken file isn't reprobed on every run. Shared by the planning thread and the
+# scheduler, and by shard jobs writing to the same dest_dir.
+class ProbeCache:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS probes (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                status TEXT NOT NULL,
+                error TEXT,
+                codec_name TEXT,
+                pix_fmt TEXT,
+                profile TEXT,
+                duration REAL,
+                fps REAL,
+                width INTEGER,
+                height INTEGER,
+                rotation INTEGER,
+                audio_codec TEXT,
+                keyframes TEXT,
+                probed_at REAL NOT NULL
+            )
+            """
+        )
+        self.add_audio_codec()
+        self.probed = 0
+        self.hits = 0
+
+    # Caches from before audio_codec was probed can't say whether a video has audio, so
+    # their rows are dropped and probed again. Checked under the write lock, since shard
+    # jobs may open the same old cache at once.
+    def add_audio_codec(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(probes)")}
+            if "audio_codec" not in columns:
+                self.conn.execute("DELETE FROM probes")
+                self.conn.execute("ALTER TABLE probes ADD COLUMN audio_codec TEXT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    # (found, probe) for what is stored for this exact version of the file; probe is
+    # None when the stored probe failed. Never runs ffprobe.
+    def lookup(self, videopath, size, mtime):
+        with self.lock:
+            row = self.conn.execute(
+                """
+                SELECT status, codec_name, pix_fmt, profile, duration, fps, width, height, rotation, audio_codec, keyframes
+                FROM probes WHERE path = ? AND size = ? AND mtime = ?
+                """,
+                (os.path.abspath(videopath), size, mtime)
+            ).fetchone()
+        if row is None:
+            return False, None
+        status, *fields, keyframes = row
+        if status != "ok":
+            return True, None
+        return True, VideoProbe(*fields, json.loads(keyframes))
+
+    def store(self, videopath, size, mtime, probe, error=None):
+        if probe is not None:
+            fields = list(probe[:-1]) + [json.dumps(probe.keyframes)]
+        else:
+            fields = [None] * len(VideoProbe._fields)
+        with self.lock:
+            self.conn.execute(
+                """
+                INSERT OR REPLACE INTO probes (
+                    path, size, mtime, status, error, codec_name, pix_fmt, profile, duration, fps,
+                    width, height, rotation, audio_codec, keyframes, probed_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [os.path.abspath(videopath), size, mtime, "ok" if probe is not None else "failed", error] + fields + [time.time()]
+            )
+
+    # The probe of a video, from the cache when the file hasn't changed since it was
+    # stored and from ffprobe otherwise. None when the video can't be probed.
+    # size/mtime can be passed in when the caller already has them from a listing.
+    def probe(self, videopath, size=None, mtime=None):
+        if size is None or mtime is None:
+            try:
+                stat = os.stat(videopath)
+            except OSError:
+                return None
+            size, mtime = stat.st_size, stat.st_mtime
+
+        found, probe = self.lookup(videopath, size, mtime)
+        if found:
+            self.hits += 1
+            return probe
+
+        self.probed += 1
+        try:
+            probe = probe_video(videopath)
+            error = None
+        except subprocess.CalledProcessError as e:
+            probe, error = None, (e.stderr or "").strip()[-500:] or f"ffprobe exited with {e.returncode}"
+        except ValueError as e:
+            probe, error = None, f"unreadable ffprobe output: {e}"
+        except OSError:
+            # ffprobe itself is missing or unrunnable; that says nothing about the file
+            return None
+        self.store(videopath, size, mtime, probe, error)
+        return probe
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
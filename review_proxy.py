@@ -0,0 +1,54 @@
+import os
+
+
+# Proxies and posters go in a hidden dir next to the clips, so anything listing the
+# clips' dir for .mp4 files (the annotation UI, our own counts) doesn't pick them up:
+#   Batch/sign/clip.mp4 -> Batch/sign/.review/clip.mp4 and Batch/sign/.review/clip.jpg
+REVIEW_DIRNAME = ".review"
+
+PROXY_HEIGHT = 360
+PROXY_CRF = 30
+PROXY_PRESET = "veryfast"
+PROXY_AUDIO_BITRATE = "64k"
+
+# mjpeg qscale, 2 (best) to 31
+POSTER_QUALITY = 5
+
+
+def review_dir(clip_path):
+    return os.path.join(os.path.dirname(clip_path), REVIEW_DIRNAME)
+
+
+# (proxy, poster) paths of a clip
+def review_paths(clip_path):
+    stem = os.path.splitext(os.path.basename(clip_path))[0]
+    directory = review_dir(clip_path)
+    return os.path.join(directory, stem + ".mp4"), os.path.join(directory, stem + ".jpg")
+
+
+# Extra ffmpeg outputs writing a clip's proxy and poster from the same decoded frames
+# as the clip itself. offset/duration select the clip the way the clip's own output
+# does (output-side -ss/-t); the poster is the frame halfway through it. The proxy is
+# small and moov-first so the browser can start playing it before it has all of it.
+def review_output_args(clip_path, duration, offset=0.0, height=PROXY_HEIGHT, crf=PROXY_CRF, threads=1, audio=True):
+    proxy, poster = review_paths(clip_path)
+    scale = f"scale=-2:'min({height},ih)'"
+    return [
+        "-ss", f"{offset:.2f}",
+        "-t", f"{duration:.2f}",
+        "-vf", scale,
+        "-c:v", "libx264",
+        "-preset", PROXY_PRESET,
+        "-crf", str(crf),
+        "-threads", str(threads),
+        "-pix_fmt", "yuv420p",
+    ] + (["-c:a", "aac", "-b:a", PROXY_AUDIO_BITRATE] if audio else ["-an"]) + [
+        "-movflags", "+faststart",
+        proxy,
+        "-ss", f"{offset + max(0.0, duration) / 2:.2f}",
+        "-frames:v", "1",
+        "-vf", scale,
+        "-q:v", str(POSTER_QUALITY),
+        "-an",
+        poster,
+    ]
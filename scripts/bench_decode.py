@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# End-to-end benchmark of decode_split_by_length.py on a synthetic corpus generated
+# offline: lavfi testsrc recordings plus matching -timestamps.jpg files whose EXIF
+# ImageDescription uses every recorder format. Times parsing, planning, encoding and
+# a full run, and writes a JSON report meant to be diffed between commits.
+#
+#   python3 scripts/bench_decode.py --output bench/$(git rev-parse --short HEAD).json
+#   python3 scripts/bench_decode.py --users 4 --sessions 5 --extract_mode video --num_threads 8
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_DIR)
+
+from timestamps_parser import TimestampsParseError, load_timestamps  # noqa: E402
+
+DECODE_SCRIPT = os.path.join(REPO_DIR, "decode_split_by_length.py")
+
+SIGNS = ["apple", "pet's name", "Thank you.", "don't", "before", "calendar", "kitchen", "yellow"]
+
+# attempt: current recorder; is_valid: isValid but no attempt (legacy 6-field);
+# legacy: no isValid/attempt at all
+VARIANTS = ["attempt", "is_valid", "legacy"]
+
+
+# ---- Corpus ----
+
+def timestamp(base, seconds):
+    ms = int(round(seconds * 1000))
+    return f"{base}_{ms // 60000 % 60:02d}_{ms // 1000 % 60:02d}.{ms % 1000:03d}"
+
+
+# Signs follow each other through the recording: taps (0.3s) and holds (1.5-3s)
+# separated by gaps, all inside the video's duration
+def make_description(rng, base, duration, num_signs, variant):
+    video_start = timestamp(base, 0)
+    clock = 0.5
+    entries = {}
+    for sign in rng.sample(SIGNS, min(num_signs, len(SIGNS))):
+        recordings = []
+        for attempt in range(rng.randint(1, 2)):
+            clock += rng.uniform(0.5, 1.5)
+            start = clock
+            clock += rng.choice([0.3, rng.uniform(1.5, 3.0)])
+            if clock >= duration - 0.5:
+                break
+            fields = (
+                f"file=\\/storage\\/emulated\\/0\\/Movies\\/{base}.mp4, videoStart={video_start}, "
+                f"signStart={timestamp(base, start)}, signEnd={timestamp(base, clock)}"
+            )
+            if variant == "attempt":
+                fields += f", isValid={rng.choice(['true', 'false'])}, attempt={attempt}"
+            elif variant == "is_valid":
+                fields += f", isValid={rng.choice(['true', 'false'])}"
+            recordings.append(f"({fields})")
+        if recordings:
+            entries[sign] = f'"[{", ".join(recordings)}]"'
+    parts = [f'"{sign}": {value}' for sign, value in entries.items()] + ['"version": "1.2."']
+    return "{" + ", ".join(parts) + "}"
+
+
+# A JPEG whose APP1 segment holds a one-entry EXIF IFD0 with the ImageDescription
+def write_timestamps_jpg(path, description, template):
+    value = description.encode() + b"\x00"
+    tiff = b"II*\x00" + struct.pack("<I", 8)
+    tiff += struct.pack("<H", 1) + struct.pack("<HHII", 0x010E, 2, len(value), 26) + struct.pack("<I", 0)
+    tiff += value
+    segment = b"Exif\x00\x00" + tiff
+    with open(path, "wb") as f:
+        f.write(template[:2] + b"\xff\xe1" + struct.pack(">H", len(segment) + 2) + segment + template[2:])
+
+
+def make_corpus(args, corpus_dir):
+    rng = random.Random(args.seed)
+    template_path = os.path.join(corpus_dir, "template.jpg")
+    subprocess.run(
+        ["ffmpeg", "-y", "-nostdin", "-loglevel", "error", "-f", "lavfi", "-i", "color=c=gray:s=64x64", "-frames:v", "1", template_path],
+        check=True
+    )
+    with open(template_path, "rb") as f:
+        template = f.read()
+    os.remove(template_path)
+
+    # Every session of a user shares one rendered recording; only the descriptions differ
+    video_path = os.path.join(corpus_dir, "testsrc.mp4")
+    subprocess.run(
+        [
+            "ffmpeg", "-y", "-nostdin", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"testsrc=size={args.size}:rate=30",
+            "-f", "lavfi", "-i", "sine=frequency=440",
+            "-t", str(args.duration), "-c:v", "libx264", "-g", "60", "-c:a", "aac", "-shortest",
+            video_path,
+        ],
+        check=True
+    )
+
+    backup_dirs = []
+    variant_counts = {variant: 0 for variant in VARIANTS}
+    for u in range(args.users):
+        uid = f"4a.2.{1000 + u}"
+        backup_dir = os.path.join(corpus_dir, uid)
+        os.makedirs(backup_dir)
+        backup_dirs.append(backup_dir)
+        for n in range(args.sessions):
+            variant = VARIANTS[(u * args.sessions + n) % len(VARIANTS)]
+            variant_counts[variant] += 1
+            base = f"2024_03_{1 + n % 28:02d}_1{u % 10}"
+            name = f"{uid}-session{n:03d}"
+            shutil.copy(video_path, os.path.join(backup_dir, name + ".mp4"))
+            description = make_description(rng, base, args.duration, args.signs, variant)
+            write_timestamps_jpg(os.path.join(backup_dir, name + "-timestamps.jpg"), description, template)
+
+    os.remove(video_path)
+    with open(os.path.join(corpus_dir, "config.json"), "w") as f:
+        json.dump({}, f)
+    return backup_dirs, variant_counts
+
+
+# ---- Measurements ----
+
+def timestamps_files(backup_dirs):
+    return [
+        os.path.join(backup_dir, name)
+        for backup_dir in backup_dirs
+        for name in sorted(os.listdir(backup_dir))
+        if name.endswith("-timestamps.jpg")
+    ]
+
+
+def measure_parse(paths, repeat):
+    best = float("inf")
+    errors = 0
+    for _ in range(repeat):
+        errors = 0
+        start = time.perf_counter()
+        for path in paths:
+            try:
+                load_timestamps(path)
+            except TimestampsParseError:
+                errors += 1
+        best = min(best, time.perf_counter() - start)
+    return best, errors
+
+
+# Runs one decode command; returns its wall time and the peak RSS (MB) of the
+# largest process it started, python or ffmpeg
+def run_decode(args, corpus_dir, command, extra):
+    cmd = [sys.executable, DECODE_SCRIPT, command] + extra + [
+        "--extract_mode", args.extract_mode,
+        "--ffmpeg_loglevel", "error",
+    ]
+    if args.num_threads is not None:
+        cmd += ["--num_threads", str(args.num_threads)]
+
+    start = time.perf_counter()
+    process = subprocess.Popen(cmd, cwd=corpus_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # wait4's usage covers the child and everything it reaped, so ffmpeg counts too
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+    return elapsed, usage.ru_maxrss / 1024
+
+
+def count_clips(dest_dir):
+    return sum(
+        1 for _, _, names in os.walk(dest_dir) for name in names
+        if name.endswith(".mp4")
+    )
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=3)
+    parser.add_argument("--sessions", type=int, default=4, help="Recordings per user")
+    parser.add_argument("--signs", type=int, default=6, help="Signs per recording")
+    parser.add_argument("--duration", type=float, default=20.0, help="Length of each recording in seconds")
+    parser.add_argument("--size", type=str, default="640x360")
+    parser.add_argument("--extract_mode", choices=["clip", "video", "smart_cut"], default="clip")
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=5, help="Repeats of the in-process parse timing (best is kept)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work_dir", type=str, default=None, help="Where to build the corpus. Defaults to a temp dir that is removed afterwards")
+    parser.add_argument("--output", type=str, default=None, help="Write the JSON report here as well as to stdout")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    corpus_dir = args.work_dir or tempfile.mkdtemp(prefix="bench_decode-")
+    os.makedirs(corpus_dir, exist_ok=True)
+    try:
+        start = time.perf_counter()
+        backup_dirs, variant_counts = make_corpus(args, corpus_dir)
+        corpus_seconds = time.perf_counter() - start
+
+        paths = timestamps_files(backup_dirs)
+        parse_seconds, parse_errors = measure_parse(paths, args.repeat)
+
+        # plan = parse + cut plan only; execute = encoding only; run = both, as used in production
+        plan_dir = os.path.join(corpus_dir, "out_plan")
+        plan_seconds, plan_rss = run_decode(args, corpus_dir, "plan", ["--backup_dir"] + backup_dirs + ["--dest_dir", plan_dir])
+        execute_seconds, execute_rss = run_decode(
+            args, corpus_dir, "execute", ["--dest_dir", plan_dir, "--plan_file", os.path.join(plan_dir, "plan.jsonl"), "--no_manifest"]
+        )
+
+        encoded_clips = count_clips(plan_dir)
+
+        run_dir = os.path.join(corpus_dir, "out_run")
+        run_seconds, run_rss = run_decode(args, corpus_dir, "run", ["--backup_dir"] + backup_dirs + ["--dest_dir", run_dir, "--no_manifest"])
+        clips = count_clips(run_dir)
+
+        with open(os.path.join(plan_dir, "plan.summary.json")) as f:
+            planned = json.load(f)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+
+    report = {
+        "commit": git_commit(),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {
+            "users": args.users, "sessions": args.sessions, "signs": args.signs, "duration": args.duration,
+            "size": args.size, "extract_mode": args.extract_mode, "num_threads": args.num_threads, "seed": args.seed,
+        },
+        "corpus": {
+            "timestamps_files": len(paths),
+            "variants": variant_counts,
+            # Recordings without an attempt number can map to the same output file, so
+            # this can be more than the clips actually written
+            "planned_clips": planned["clips"],
+            "planned_clip_seconds": planned["seconds"],
+            "build_seconds": corpus_seconds,
+        },
+        "parse": {
+            "seconds": parse_seconds,
+            "files_per_sec": len(paths) / parse_seconds if parse_seconds else None,
+            "errors": parse_errors,
+        },
+        "plan": {"seconds": plan_seconds, "peak_rss_mb": plan_rss},
+        "encode": {
+            "seconds": execute_seconds,
+            "clips": encoded_clips,
+            "clips_per_sec": encoded_clips / execute_seconds if execute_seconds else None,
+            "peak_rss_mb": execute_rss,
+        },
+        "end_to_end": {
+            "seconds": run_seconds,
+            "clips": clips,
+            "files_per_sec": len(paths) / run_seconds,
+            "clips_per_sec": clips / run_seconds,
+            "peak_rss_mb": run_rss,
+        },
+    }
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print(text)
+    if args.output is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# Micro-benchmark: timestamps_parser vs. the regex + eval() description parsing
+# decode_split_by_length.py used before it. Parses a synthetic corpus covering every
+# recorder format (and optionally the -timestamps.jpg files of real backup dirs),
+# checks both parsers agree, and reports descriptions/sec.
+#
+#   python3 scripts/bench_timestamps_parser.py --num_descriptions 2000
+#   python3 scripts/bench_timestamps_parser.py --backup_dir /data/.../4a.2.1032 --json bench.json
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from timestamps_parser import TimestampsParseError, parse_description, read_image_description  # noqa: E402
+
+
+# ---- Legacy implementation (as it was in decode_split_by_length.py) ----
+
+def legacy_get_image_description(exifdata):
+    from PIL.ExifTags import TAGS
+
+    description = ""
+    for tag_id in exifdata:
+        tag = TAGS.get(tag_id, tag_id)
+        data = exifdata.get(tag_id)
+        if isinstance(data, bytes):
+            data = data.decode()
+        if tag == "ImageDescription":
+            description = data
+    return description
+
+
+def legacy_clean_contractions(input_string):
+    input_string = re.sub(r'pet\'s name', 'pets name', input_string)
+    input_string = re.sub(r'don\'t', 'dont', input_string)
+    return input_string
+
+
+def legacy_get_data_from_description(description):
+    is_valid_exists = "isValid" in description
+
+    subbed = re.sub(r"file=(.*?),", r'"\1",', description)
+    subbed = re.sub(r"videoStart=(.*?),", r'"\1",', subbed)
+    subbed = re.sub(r"signStart=(.*?),", r'"\1",', subbed)
+
+    if is_valid_exists:
+        subbed = re.sub(r"signEnd=(.*?),", r'"\1",', subbed)
+        subbed = re.sub(r"isValid=(.*?),", r'\1,', subbed)
+    else:
+        subbed = re.sub(r"signEnd=(.*?),", r'"\1")', subbed)
+
+    subbed = re.sub(r'\\/', '/', subbed)
+    subbed = re.sub(r'"\[', '[', subbed)
+    subbed = re.sub(r'\]"', ']', subbed)
+    subbed = re.sub(r'\\r', '', subbed)
+    subbed = re.sub(r'\."', '"', subbed)
+
+    subbed = re.sub(r'attempt=(.*?)', r'\1', subbed)
+    subbed = re.sub(r'isValid=(.*?)', r'\1', subbed)
+
+    subbed = legacy_clean_contractions(subbed)
+
+    try:
+        data = eval(subbed)
+    except Exception:
+        return -1, -1
+
+    return data, is_valid_exists
+
+
+# Flattens the legacy dict into the (sign, file, ..., is_valid, attempt) tuples process_file built from it
+def legacy_recordings(data):
+    recordings = []
+    for sign, recording_list in data.items():
+        if not isinstance(recording_list, list):
+            continue
+        for recording in recording_list:
+            values = [sign] + list(recording)
+            if len(values) == 5:
+                values += [True, 0]
+            elif len(values) == 6:
+                values.append(0)
+            recordings.append(tuple(values))
+    return recordings
+
+
+# ---- Synthetic corpus ----
+
+SIGNS = ["apple", "pet's name", "Thank you.", "don't", "before", "calendar", "kitchen", "yellow"]
+
+# attempt: current recorder; is_valid: isValid but no attempt (legacy 6-field);
+# legacy: no isValid/attempt at all
+VARIANTS = ["attempt", "is_valid", "legacy"]
+
+
+def timestamp(base, seconds):
+    ms = int(round(seconds * 1000))
+    return f"{base}_{ms // 60000 % 60:02d}_{ms // 1000 % 60:02d}.{ms % 1000:03d}"
+
+
+def make_description(rng, num_signs, variant):
+    base = "2024_03_0%d_1%d" % (rng.randint(1, 9), rng.randint(0, 9))
+    video_start = timestamp(base, 0)
+    clock = 1.0
+    entries = []
+    for sign in rng.sample(SIGNS, min(num_signs, len(SIGNS))):
+        recordings = []
+        for attempt in range(rng.randint(1, 3)):
+            clock += rng.uniform(0.5, 3.0)
+            start = timestamp(base, clock)
+            clock += rng.choice([0.2, rng.uniform(1.2, 4.0)])
+            end = timestamp(base, clock)
+            fields = f"file=\\/storage\\/emulated\\/0\\/Movies\\/{base}.mp4, videoStart={video_start}, signStart={start}, signEnd={end}"
+            if variant == "attempt":
+                fields += f", isValid={rng.choice(['True', 'False'])}, attempt={attempt}"
+            elif variant == "is_valid":
+                fields += f", isValid={rng.choice(['True', 'False'])}"
+            recordings.append(f"({fields})")
+        entries.append(f'"{sign}": "[{", ".join(recordings)}]"')
+    entries.append('"version": "1.2."')
+    return "{" + ", ".join(entries) + "}"
+
+
+def bench(func, descriptions, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for description in descriptions:
+            func(description)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_descriptions", type=int, default=1000)
+    parser.add_argument("--signs_per_description", type=int, default=8)
+    parser.add_argument("--backup_dir", nargs="*", default=[], help="Also benchmark the descriptions of real -timestamps.jpg files")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=str, default=None, help="Write the results to this file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    rng = random.Random(args.seed)
+
+    descriptions = [
+        make_description(rng, args.signs_per_description, VARIANTS[i % len(VARIANTS)])
+        for i in range(args.num_descriptions)
+    ]
+
+    results = {"corpus": {"synthetic": len(descriptions)}}
+
+    image_paths = []
+    for backup_dir in args.backup_dir:
+        image_paths += [
+            os.path.join(backup_dir, name) for name in os.listdir(backup_dir)
+            if name.endswith("-timestamps.jpg") and not name.startswith("._")
+        ]
+    if image_paths:
+        from PIL import Image
+
+        start = time.perf_counter()
+        for path in image_paths:
+            legacy_get_image_description(Image.open(path).getexif())
+        pil_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        real_descriptions = []
+        for path in image_paths:
+            try:
+                real_descriptions.append(read_image_description(path))
+            except TimestampsParseError:
+                pass
+        header_time = time.perf_counter() - start
+
+        descriptions += real_descriptions
+        results["corpus"]["images"] = len(image_paths)
+        results["exif_read"] = {
+            "pil_files_per_sec": len(image_paths) / pil_time,
+            "app1_files_per_sec": len(image_paths) / header_time,
+            "speedup": pil_time / header_time,
+        }
+
+    # Correctness: wherever the legacy parser succeeds, both must yield the same recordings
+    mismatches = legacy_failures = new_failures = 0
+    for description in descriptions:
+        data, _ = legacy_get_data_from_description(description)
+        try:
+            new = [tuple(r) for r in parse_description(description).recordings]
+        except TimestampsParseError:
+            new = None
+            new_failures += 1
+        if data == -1:
+            legacy_failures += 1
+            continue
+        if new is not None and sorted(new) != sorted(legacy_recordings(data)):
+            mismatches += 1
+
+    def new_parse(description):
+        try:
+            parse_description(description)
+        except TimestampsParseError:
+            pass
+
+    legacy_time = bench(legacy_get_data_from_description, descriptions, args.repeat)
+    new_time = bench(new_parse, descriptions, args.repeat)
+
+    results["parse"] = {
+        "legacy_descriptions_per_sec": len(descriptions) / legacy_time,
+        "parser_descriptions_per_sec": len(descriptions) / new_time,
+        "speedup": legacy_time / new_time,
+        "legacy_failures": legacy_failures,
+        "parser_failures": new_failures,
+        "mismatches": mismatches,
+    }
+
+    for section, values in results.items():
+        print(section)
+        for name, value in values.items():
+            print(f"  {name:30} {value:,.1f}" if isinstance(value, float) else f"  {name:30} {value}")
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -11,19 +11,16 @@ dest_dir=/data/sign_language_videos/review_sets/review_313/review_7
 #List of users whose stuff we are going to decore
 declare -a users=("4a.2.1032" "4a.2.1042" "4a.2.1043" "4a.2.1047" "4a.2.1048" "4a.2.1049" "4a.2.1050" "4a.2.1051" "4a.2.1052" "4a.2.1054" "4a.2.1055" "4a.2.1057")
 
-# get length of an array
-numusers=${#users[@]}
-
-# use for loop to read all values and indexes
-for (( i=0; i<${numusers}; i++ ));
-do
-  #echo "${users[$i]}"
-  python3 decode_split_by_length.py \
-    --backup_dir $source_dir/"${users[$i]}" \
-    --dest_dir $dest_dir \
-    --make_sign_dirs \
-    --num_threads $thread_count \
-    --ffmpeg_loglevel quiet 1> $dest_dir/logs/"${users[$i]}".log 2> /tmp/garbage.txt
+# Every user's backup dir goes to a single run so the clip scheduler can keep
+# all threads busy across users instead of draining the pool after each one
+backup_dirs=()
+for user in "${users[@]}"; do
+  backup_dirs+=("$source_dir/$user")
 done
 
-
+python3 decode_split_by_length.py \
+  --backup_dir "${backup_dirs[@]}" \
+  --dest_dir $dest_dir \
+  --make_sign_dirs \
+  --num_threads $thread_count \
+  --ffmpeg_loglevel quiet 1> $dest_dir/logs/decode.log 2> /tmp/garbage.txt
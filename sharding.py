@@ -0,0 +1,38 @@
+import heapq
+import os
+import zlib
+
+
+SHARD_STRATEGIES = ["hash", "balance"]
+
+
+# Stable across machines and Python runs (unlike hash()), so every array job agrees on
+# which shard a source video belongs to without sharing a file list
+def shard_of(key, num_shards):
+    return zlib.crc32(os.path.basename(key).encode()) % num_shards
+
+
+# Greedy longest-first balance: the heaviest remaining source goes to the least loaded
+# shard. Ties are broken on the key and the shard index, so every node computes the
+# same assignment from the same set of sources, whatever order it listed them in.
+def balance_shards(keys, weights, num_shards):
+    order = sorted(range(len(keys)), key=lambda i: (-weights[i], os.path.basename(keys[i])))
+
+    loads = [(0.0, shard) for shard in range(num_shards)]
+    assignment = [0] * len(keys)
+    for i in order:
+        load, shard = heapq.heappop(loads)
+        assignment[i] = shard
+        heapq.heappush(loads, (load + weights[i], shard))
+    return assignment
+
+
+# Shard index of every key. weights (estimated clip-seconds per key) are only used by "balance"
+def assign_shards(keys, num_shards, strategy="hash", weights=None):
+    if num_shards < 1:
+        raise ValueError(f"num_shards must be at least 1, got {num_shards}")
+    if strategy == "hash":
+        return [shard_of(key, num_shards) for key in keys]
+    if strategy == "balance":
+        return balance_shards(keys, weights, num_shards)
+    raise ValueError(f"Unknown shard strategy: {strategy}")
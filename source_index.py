@@ -0,0 +1,129 @@
+import json
+import os
+import tempfile
+from collections import namedtuple
+
+
+TIMESTAMPS_SUFFIX = "-timestamps.jpg"
+VIDEO_SUFFIX = ".mp4"
+
+INDEX_CACHE_FILENAME = "source_index.json"
+INDEX_CACHE_VERSION = 1
+
+# One recording in a backup dir: its -timestamps.jpg and the .mp4 it describes
+SourceRecord = namedtuple(
+    "SourceRecord",
+    ["uid", "timestamps_path", "video_path", "timestamps_size", "timestamps_mtime", "video_size", "video_mtime"]
+)
+
+# Everything found under the indexed backup dirs. Orphans are paths whose partner is missing.
+SourceIndex = namedtuple("SourceIndex", ["records", "orphan_timestamps", "orphan_videos", "scanned_dirs", "cached_dirs"])
+
+
+# uid-whatever-timestamps.jpg describes uid-whatever.mp4, recorded by uid
+def video_name_for(timestamps_name):
+    return timestamps_name[:-len(TIMESTAMPS_SUFFIX)] + VIDEO_SUFFIX
+
+
+def uid_of(video_name):
+    return video_name.split("-")[0]
+
+
+# One os.scandir pass over a backup dir. Returns the pairs and orphans as names plus stat
+# results, which is also what the cache stores; resource forks (._*) and zips are skipped.
+def scan_dir(backup_dir):
+    images = {}
+    videos = {}
+    with os.scandir(backup_dir) as entries:
+        for entry in entries:
+            name = entry.name
+            if name.startswith("._"):
+                continue
+            if name.endswith(TIMESTAMPS_SUFFIX):
+                target = images
+            elif name.endswith(VIDEO_SUFFIX):
+                target = videos
+            else:
+                continue
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            target[name] = (stat.st_size, stat.st_mtime)
+
+    pairs = []
+    orphan_timestamps = []
+    for name in sorted(images):
+        video = video_name_for(name)
+        if video in videos:
+            pairs.append([name, video, uid_of(video), *images[name], *videos.pop(video)])
+        else:
+            orphan_timestamps.append(name)
+    return {"pairs": pairs, "orphan_timestamps": orphan_timestamps, "orphan_videos": sorted(videos)}
+
+
+def dir_mtime_ns(backup_dir):
+    return os.stat(backup_dir).st_mtime_ns
+
+
+def load_index_cache(path):
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if cache.get("version") != INDEX_CACHE_VERSION:
+        return {}
+    return cache.get("dirs", {})
+
+
+# Shard jobs sharing dest_dir save at the same time, so each writes its own temp file
+def save_index_cache(path, dirs):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path) + ".")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump({"version": INDEX_CACHE_VERSION, "dirs": dirs}, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# Indexes every backup dir. With a cache_path, a dir whose mtime hasn't changed since the
+# last run (no files added, removed or renamed) is taken from the cache instead of being
+# listed again. Files rewritten in place under the same name don't change the dir's
+# mtime; rescan=True ignores the cache for that case.
+def index_sources(backup_dirs, cache_path=None, rescan=False):
+    cached = load_index_cache(cache_path) if cache_path is not None and not rescan else {}
+    dirs = {}
+    records = []
+    orphan_timestamps = []
+    orphan_videos = []
+    scanned_dirs = cached_dirs = 0
+
+    for backup_dir in backup_dirs:
+        key = os.path.abspath(backup_dir)
+        mtime_ns = dir_mtime_ns(backup_dir)
+        entry = cached.get(key)
+        if entry is not None and entry["mtime_ns"] == mtime_ns:
+            cached_dirs += 1
+        else:
+            entry = dict(scan_dir(backup_dir), mtime_ns=mtime_ns)
+            scanned_dirs += 1
+        dirs[key] = entry
+
+        for timestamps_name, video_name, uid, timestamps_size, timestamps_mtime, video_size, video_mtime in entry["pairs"]:
+            records.append(SourceRecord(
+                uid,
+                os.path.join(backup_dir, timestamps_name),
+                os.path.join(backup_dir, video_name),
+                timestamps_size, timestamps_mtime, video_size, video_mtime,
+            ))
+        orphan_timestamps += [os.path.join(backup_dir, name) for name in entry["orphan_timestamps"]]
+        orphan_videos += [os.path.join(backup_dir, name) for name in entry["orphan_videos"]]
+
+    if cache_path is not None:
+        # Keep other dirs' entries so runs over different subsets share one cache
+        save_index_cache(cache_path, dict(load_index_cache(cache_path), **dirs))
+
+    return SourceIndex(records, orphan_timestamps, orphan_videos, scanned_dirs, cached_dirs)
@@ -0,0 +1,41 @@
+# Writes backup dirs of recorder sessions for the tests
+import json
+import os
+import struct
+
+
+# A minimal -timestamps.jpg: SOI, an APP1 Exif segment whose IFD holds only the
+# ImageDescription the recorder writes, and EOI
+def timestamps_jpeg(description):
+    text = description.encode() + b"\x00"
+    ifd_offset = 8
+    value_offset = ifd_offset + 2 + 12 + 4
+    tiff = b"II*\x00" + struct.pack("<I", ifd_offset)
+    tiff += struct.pack("<H", 1) + struct.pack("<HHII", 0x010E, 2, len(text), value_offset) + struct.pack("<I", 0)
+    tiff += text
+    segment = b"Exif\x00\x00" + tiff
+    return b"\xff\xd8" + b"\xff\xe1" + struct.pack(">H", len(segment) + 2) + segment + b"\xff\xd9"
+
+
+# Recorder description for {sign: [(video_start, sign_start, sign_end, attempt), ...]};
+# attempt None leaves the field out, like legacy recorders
+def timestamps_description(signs):
+    def recording(video_start, sign_start, sign_end, attempt):
+        fields = f"file=/sdcard/x.mp4, videoStart={video_start}, signStart={sign_start}, signEnd={sign_end}, isValid=True"
+        if attempt is not None:
+            fields += f", attempt={attempt}"
+        return f"({fields})"
+
+    description = {sign: "[" + ", ".join(recording(*r) for r in recordings) + "]" for sign, recordings in signs.items()}
+    description["version"] = "2"
+    return json.dumps(description)
+
+
+def write_session(backup_dir, uid, session, signs, video=b""):
+    os.makedirs(backup_dir, exist_ok=True)
+    base = os.path.join(backup_dir, f"{uid}-{session}")
+    with open(base + "-timestamps.jpg", "wb") as f:
+        f.write(timestamps_jpeg(timestamps_description(signs)))
+    with open(base + ".mp4", "wb") as f:
+        f.write(video)
+    return base
@@ -0,0 +1,95 @@
+import argparse
+import os
+
+import numpy as np
+import pytest
+
+from cut_plan import build_cut_plan
+from timestamps_parser import Recording
+
+VIDEO_START = "2024_03_01_10_00_00.000"
+
+
+def make_args(dest_dir, buffer=(-0.5, 0.5), invert=False, structured=False, sign_dirs=False):
+    return argparse.Namespace(
+        buffer=buffer, invert=invert, dest_dir=str(dest_dir),
+        make_structured_dirs=structured, make_sign_dirs=sign_dirs, old_filenames=False,
+    )
+
+
+def recording(sign, sign_start, sign_end, is_valid=True, attempt=0):
+    return Recording(sign, "/sdcard/x.mp4", VIDEO_START, f"2024_03_01_10_00_{sign_start}", f"2024_03_01_10_00_{sign_end}", is_valid, attempt)
+
+
+# A tap 0.5s long, a hold 1.5s long and a tap exactly at the threshold, in sign-end order
+RECORDINGS = [
+    recording("apple", "02.000", "02.500"),
+    recording("banana", "05.000", "06.500"),
+    recording("cherry", "08.000", "09.000"),
+]
+
+
+def plan_of(args, recordings=RECORDINGS, buffer_config=None):
+    return build_cut_plan(args, "4a.2.1000", recordings, buffer_config or {}, make_dirs=False)
+
+
+def test_hold_threshold(tmp_path):
+    plan = plan_of(make_args(tmp_path, buffer=(0.0, 0.0)))
+    assert plan.is_hold.tolist() == [False, True, False]
+    # Taps run from the previous sign's end (or the video's start) to their own start;
+    # holds from their start to their end
+    assert plan.start.tolist() == pytest.approx([0.0, 5.0, 6.5])
+    assert plan.duration.tolist() == pytest.approx([2.0, 1.5, 1.5])
+
+
+def test_buffers(tmp_path):
+    plan = plan_of(make_args(tmp_path))
+    assert plan.start.tolist() == pytest.approx([-0.5, 4.5, 6.0])
+    assert plan.duration.tolist() == pytest.approx([3.0, 2.5, 2.5])
+
+
+def test_invert_anchors_on_span_end(tmp_path):
+    plan = plan_of(make_args(tmp_path, invert=True))
+    assert plan.start.tolist() == pytest.approx([1.5, 6.0, 7.5])
+    assert plan.duration.tolist() == pytest.approx([1.0, 1.0, 1.0])
+
+
+def test_uid_config_overrides_args(tmp_path):
+    buffer_config = {"4a.2.1000": {"buffer_start": -1.0, "buffer_end": 0.25, "invert": False}}
+    plan = plan_of(make_args(tmp_path, invert=True), buffer_config=buffer_config)
+    assert plan.start.tolist() == pytest.approx([-1.0, 4.0, 5.5])
+    assert plan.duration.tolist() == pytest.approx([3.25, 2.75, 2.75])
+
+
+def test_invalid_holds_go_to_invalid(tmp_path):
+    recordings = [
+        recording("apple", "02.000", "02.500", is_valid=False),
+        recording("banana", "05.000", "06.500", is_valid=False, attempt=1),
+        recording("cherry", "08.000", "09.500"),
+    ]
+    plan = plan_of(make_args(tmp_path), recordings)
+    assert plan.is_valid.tolist() == [False, False, True]
+    assert plan.paths == [
+        os.path.join(tmp_path, f"4a.2.1000-apple-{VIDEO_START}-0.mp4"),
+        os.path.join(tmp_path, "invalid", "banana", f"4a.2.1000-banana-{VIDEO_START}-1.mp4"),
+        os.path.join(tmp_path, f"4a.2.1000-cherry-{VIDEO_START}-0.mp4"),
+    ]
+
+
+def test_structured_dirs_name_taps_by_span_start(tmp_path):
+    plan = plan_of(make_args(tmp_path, structured=True))
+    assert plan.paths == [
+        os.path.join(tmp_path, "4a.2.1000", "apple", f"{VIDEO_START}-0.mp4"),
+        os.path.join(tmp_path, "4a.2.1000", "banana", "2024_03_01_10_00_05.000-0.mp4"),
+        os.path.join(tmp_path, "4a.2.1000", "cherry", "2024_03_01_10_00_06.500-0.mp4"),
+    ]
+
+
+def test_clips_and_empty_plan(tmp_path):
+    clips = plan_of(make_args(tmp_path)).clips()
+    assert [(clip.sign_name, clip.is_hold, clip.attempt) for clip in clips] == [
+        ("apple", False, 0), ("banana", True, 0), ("cherry", False, 0),
+    ]
+    assert isinstance(clips[0].start, float)
+    empty = plan_of(make_args(tmp_path), [])
+    assert len(empty) == 0 and empty.clips() == [] and np.size(empty.start) == 0
@@ -0,0 +1,127 @@
+# --num_shards/--shard_index through the decode's own selection (source_shards for run
+# and plan, select_row_shard for execute): every shard index is selected separately from
+# its own listing of a sample tree, as separate array jobs would, and the shards must be
+# disjoint and cover every recording.
+import argparse
+import os
+import random
+
+import pytest
+
+from cut_plan import build_cut_plan
+from decode_split_by_length import select_row_shard, select_source_shard
+from plan_files import plan_rows
+from recordings import write_session
+from sharding import SHARD_STRATEGIES
+from source_index import index_sources
+from timestamps_parser import TimestampsParseError, load_timestamps
+
+
+def sample_signs(rng, day):
+    signs = {}
+    second = 1
+    for s in range(rng.randint(1, 12)):
+        recordings = []
+        for attempt in range(rng.randint(1, 3)):
+            length = rng.uniform(0.5, 4.0)
+            recordings.append((
+                f"2024_03_{day:02d}_10_00_00.000",
+                f"2024_03_{day:02d}_10_{second // 60:02d}_{second % 60:02d}.000",
+                f"2024_03_{day:02d}_10_{int(second + length) // 60:02d}_{int(second + length) % 60:02d}.{int(length % 1 * 1000):03d}",
+                attempt if rng.random() < 0.8 else None,
+            ))
+            second += int(length) + 2
+        signs[f"sign {s}"] = recordings
+    return signs
+
+
+@pytest.fixture(scope="module")
+def backup_dirs(tmp_path_factory):
+    root = tmp_path_factory.mktemp("backup")
+    rng = random.Random(7)
+    dirs = []
+    for u in range(4):
+        uid = f"4a.2.{1000 + u}"
+        backup_dir = os.path.join(root, uid)
+        for session in range(15):
+            write_session(backup_dir, uid, f"s{session:02d}", sample_signs(rng, 1 + session % 28))
+        dirs.append(backup_dir)
+    # A file that fails to parse is still a recording some shard has to own
+    with open(os.path.join(dirs[0], "4a.2.1000-broken-timestamps.jpg"), "wb") as f:
+        f.write(b"\xff\xd8\xff\xe1\x00")
+    open(os.path.join(dirs[0], "4a.2.1000-broken.mp4"), "wb").close()
+    return dirs
+
+
+def make_args(dest_dir, num_shards, shard_index, strategy):
+    return argparse.Namespace(
+        buffer=(-0.5, 0.5), invert=False, dest_dir=str(dest_dir),
+        make_structured_dirs=False, make_sign_dirs=False, old_filenames=False,
+        num_shards=num_shards, shard_index=shard_index, shard_strategy=strategy,
+    )
+
+
+# The sources as one job lists them: its own index, in its own order
+def listed_sources(backup_dirs, seed):
+    dirs = list(backup_dirs)
+    random.Random(seed).shuffle(dirs)
+    records = list(index_sources(dirs).records)
+    random.Random(seed + 1).shuffle(records)
+    return records
+
+
+def assert_partition(shards, expected):
+    seen = {}
+    for shard_index, keys in enumerate(shards):
+        for key in keys:
+            assert key not in seen, f"{key} is in shards {seen[key]} and {shard_index}"
+            seen[key] = shard_index
+    assert set(seen) == set(expected), f"in no shard: {sorted(set(expected) - set(seen))[:5]}"
+
+
+@pytest.mark.parametrize("strategy", SHARD_STRATEGIES)
+@pytest.mark.parametrize("num_shards", [1, 3, 8])
+def test_source_shards_partition_recordings(backup_dirs, tmp_path, strategy, num_shards):
+    everything = {source.video_path for source in index_sources(backup_dirs).records}
+    shards = []
+    for shard_index in range(num_shards):
+        args = make_args(tmp_path, num_shards, shard_index, strategy)
+        selected = select_source_shard(args, listed_sources(backup_dirs, shard_index), {})
+        shards.append([source.video_path for source in selected])
+    assert_partition(shards, everything)
+    if num_shards > 1:
+        assert sum(1 for keys in shards if keys) > 1
+
+
+def plan_file_rows(backup_dirs, dest_dir):
+    args = make_args(dest_dir, 1, None, "hash")
+    rows = []
+    for source in index_sources(backup_dirs).records:
+        try:
+            timestamps = load_timestamps(source.timestamps_path)
+        except TimestampsParseError:
+            continue
+        recordings = sorted(timestamps.recordings, key=lambda tup: tup[4])
+        plan = build_cut_plan(args, source.uid, recordings, {}, make_dirs=False)
+        rows += plan_rows(os.path.basename(source.timestamps_path), source.video_path, plan)
+    return rows
+
+
+@pytest.mark.parametrize("strategy", SHARD_STRATEGIES)
+@pytest.mark.parametrize("num_shards", [3, 8])
+def test_row_shards_partition_plan(backup_dirs, tmp_path, strategy, num_shards):
+    rows = plan_file_rows(backup_dirs, tmp_path)
+    row_key = lambda row: (row["source"], row["dest"], row["start"])
+    shards = []
+    for shard_index in range(num_shards):
+        shuffled = list(rows)
+        random.Random(shard_index).shuffle(shuffled)
+        selected = select_row_shard(make_args(tmp_path, num_shards, shard_index, strategy), shuffled)
+        shards.append([row_key(row) for row in selected])
+    assert_partition(shards, [row_key(row) for row in rows])
+
+    # A source's clips are cut in one job
+    owner = {}
+    for shard_index, keys in enumerate(shards):
+        for source, _, _ in keys:
+            assert owner.setdefault(source, shard_index) == shard_index
@@ -0,0 +1,65 @@
+import pytest
+
+from recordings import timestamps_jpeg
+from timestamps_parser import Recording, TimestampsParseError, load_timestamps, parse_description
+
+CURRENT = (
+    '{"apple": "[(file=\\/sdcard\\/a.mp4, videoStart=2024_03_01_10_00_00.000, signStart=2024_03_01_10_00_02.000, '
+    'signEnd=2024_03_01_10_00_02.500, isValid=False, attempt=2)]", "version": "2"}'
+)
+# Before attempt was recorded
+WITH_IS_VALID = (
+    '{"apple": "[Recording(file=/sdcard/a.mp4, videoStart=2024_03_01_10_00_00.000, signStart=2024_03_01_10_00_02.000, '
+    'signEnd=2024_03_01_10_00_02.500, isValid=true)]"}'
+)
+# Before isValid too; single-quoted keys may hold apostrophes
+LEGACY = (
+    "{'pet's name.': [(file=/sdcard/a.mp4, videoStart=2024_03_01_10_00_00.000, signStart=2024_03_01_10_00_02.000, "
+    "signEnd=2024_03_01_10_00_02.500)], 'banana': []}"
+)
+
+
+def test_current_description():
+    timestamps = parse_description(CURRENT)
+    assert timestamps.recordings == [Recording(
+        "apple", "/sdcard/a.mp4", "2024_03_01_10_00_00.000", "2024_03_01_10_00_02.000", "2024_03_01_10_00_02.500", False, 2,
+    )]
+    assert timestamps.keys == ["apple", "version"]
+    assert timestamps.has_is_valid
+
+
+def test_description_without_attempt():
+    timestamps = parse_description(WITH_IS_VALID)
+    recording, = timestamps.recordings
+    assert (recording.is_valid, recording.attempt) == (True, 0)
+    assert timestamps.has_is_valid
+
+
+def test_legacy_description():
+    timestamps = parse_description(LEGACY)
+    recording, = timestamps.recordings
+    assert recording.sign == "pets name"
+    assert (recording.is_valid, recording.attempt) == (True, 0)
+    assert timestamps.keys == ["pets name", "banana"]
+    assert not timestamps.has_is_valid
+
+
+@pytest.mark.parametrize("description, reason", [
+    ('{"apple": "[(file=/a.mp4, videoStart=x, signStart=y)]"}', "missing signEnd"),
+    ('{"apple": "[(file=/a.mp4, videoStart=x, signStart=y, signEnd=z, attempt=one)]"}', "attempt is not an integer"),
+    ('{"apple": [] "banana": []}', "expected ',' or '}'"),
+])
+def test_malformed_description(description, reason):
+    with pytest.raises(TimestampsParseError) as error:
+        parse_description(description, "x-timestamps.jpg")
+    assert reason in error.value.reason
+    assert error.value.path == "x-timestamps.jpg"
+
+
+def test_load_from_jpeg(tmp_path):
+    path = tmp_path / "x-timestamps.jpg"
+    path.write_bytes(timestamps_jpeg(CURRENT))
+    assert load_timestamps(str(path)) == parse_description(CURRENT)
+    path.write_bytes(timestamps_jpeg(CURRENT)[:30])
+    with pytest.raises(TimestampsParseError):
+        load_timestamps(str(path))
@@ -0,0 +1,325 @@
+import re
+import struct
+from collections import namedtuple
+
+
+# One recorded sign, in the field order the rest of the pipeline indexes into
+# (sign is [0], attempt is [6]). Legacy recorders without isValid/attempt get True/0.
+Recording = namedtuple(
+    "Recording",
+    ["sign", "file", "video_start", "sign_start", "sign_end", "is_valid", "attempt"]
+)
+
+# Parsed contents of a -timestamps.jpg. keys holds every top-level key of the
+# description (including metadata like the version), in file order.
+Timestamps = namedtuple("Timestamps", ["recordings", "keys", "has_is_valid"])
+
+# Recorder field name -> Recording index
+FIELDS = {
+    "file": 1,
+    "videoStart": 2,
+    "signStart": 3,
+    "signEnd": 4,
+    "isValid": 5,
+    "attempt": 6,
+}
+
+IMAGE_DESCRIPTION_TAG = 0x010E
+
+JPEG_SOI = b"\xff\xd8"
+JPEG_APP1 = 0xE1
+JPEG_SOS = 0xDA
+JPEG_EOI = 0xD9
+EXIF_HEADER = b"Exif\x00\x00"
+
+SINGLE_QUOTED_KEY_END = re.compile(r"'\s*:")
+RECORDING = re.compile(r"\s*\w*\(([^()]*)\)")
+FIELD = re.compile(r"(\w+)\s*=\s*([^,]*)")
+
+
+class TimestampsParseError(ValueError):
+    def __init__(self, reason, offset=None, path=None):
+        self.reason = reason
+        self.offset = offset
+        self.path = path
+        super().__init__(reason)
+
+    def __str__(self):
+        where = f" at offset {self.offset}" if self.offset is not None else ""
+        prefix = f"{self.path}: " if self.path is not None else ""
+        return f"{prefix}{self.reason}{where}"
+
+    def to_dict(self):
+        return {"path": self.path, "reason": self.reason, "offset": self.offset}
+
+
+#Only cleaning up stuff that appears in review_313 right now
+def clean_contractions(input_string):
+    #When parsing strings that use '' as boundary markers, replace apostrophes
+    #in common contractions with \'
+    input_string = re.sub(r'pet\'s name', 'pets name', input_string)
+    input_string = re.sub(r'don\'t', 'dont', input_string)
+    return input_string
+
+
+# Reads the EXIF ImageDescription by walking the JPEG markers up to the APP1
+# segment, so only the first few KB of the file are read and nothing is decoded
+def read_image_description(path):
+    with open(path, "rb") as f:
+        if f.read(2) != JPEG_SOI:
+            raise TimestampsParseError("not a JPEG file", 0, path)
+
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                raise TimestampsParseError("truncated or corrupt JPEG header", f.tell(), path)
+            code = marker[1]
+            while code == 0xFF:  # fill bytes
+                fill = f.read(1)
+                if not fill:
+                    raise TimestampsParseError("truncated JPEG header", f.tell(), path)
+                code = fill[0]
+
+            if code in (JPEG_SOS, JPEG_EOI):
+                break
+            if 0xD0 <= code <= 0xD7 or code == 0x01:  # markers without a length
+                continue
+
+            raw_length = f.read(2)
+            if len(raw_length) < 2:
+                raise TimestampsParseError("truncated JPEG header", f.tell(), path)
+            length = struct.unpack(">H", raw_length)[0]
+            # The length counts its own two bytes
+            if length < 2:
+                raise TimestampsParseError("truncated JPEG header", f.tell(), path)
+            if code == JPEG_APP1:
+                segment = f.read(length - 2)
+                if len(segment) < length - 2:
+                    raise TimestampsParseError("truncated JPEG header", f.tell(), path)
+                if segment.startswith(EXIF_HEADER):
+                    description = _description_from_tiff(segment[len(EXIF_HEADER):], path)
+                    if description is not None:
+                        return description
+            else:
+                f.seek(length - 2, 1)
+
+    raise TimestampsParseError("no EXIF ImageDescription", None, path)
+
+
+def _description_from_tiff(tiff, path):
+    if tiff[:2] == b"II":
+        order = "<"
+    elif tiff[:2] == b"MM":
+        order = ">"
+    else:
+        raise TimestampsParseError("bad TIFF byte order in EXIF segment", None, path)
+
+    try:
+        ifd_offset = struct.unpack(order + "I", tiff[4:8])[0]
+        (num_entries,) = struct.unpack(order + "H", tiff[ifd_offset:ifd_offset + 2])
+        for i in range(num_entries):
+            entry = ifd_offset + 2 + 12 * i
+            tag, _, count = struct.unpack(order + "HHI", tiff[entry:entry + 8])
+            if tag != IMAGE_DESCRIPTION_TAG:
+                continue
+            if count <= 4:
+                raw = tiff[entry + 8:entry + 8 + count]
+            else:
+                (value_offset,) = struct.unpack(order + "I", tiff[entry + 8:entry + 12])
+                raw = tiff[value_offset:value_offset + count]
+            return raw.split(b"\x00", 1)[0].decode("utf-8", errors="replace")
+    except struct.error:
+        raise TimestampsParseError("truncated EXIF IFD", None, path)
+    return None
+
+
+# Single left-to-right pass over the recorder's description, e.g.
+#   {"apple": "[(file=\/a.mp4, videoStart=..., signStart=..., signEnd=..., isValid=true, attempt=1)]", "version": "2"}
+# Lists may also appear unquoted, keys may use single quotes, and older recorders
+# leave out isValid and/or attempt.
+class _DescriptionParser:
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+        self.has_is_valid = False
+
+    def error(self, reason):
+        raise TimestampsParseError(reason, self.pos)
+
+    def skip_ws(self):
+        text, pos = self.text, self.pos
+        while pos < len(text) and text[pos] in " \t\r\n":
+            pos += 1
+        self.pos = pos
+
+    def expect(self, char):
+        self.skip_ws()
+        if self.pos >= len(self.text) or self.text[self.pos] != char:
+            self.error(f"expected {char!r}")
+        self.pos += 1
+
+    def peek(self):
+        self.skip_ws()
+        return self.text[self.pos] if self.pos < len(self.text) else ""
+
+    def parse(self):
+        recordings = []
+        keys = []
+
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return Timestamps(recordings, keys, self.has_is_valid)
+
+        while True:
+            key = clean_contractions(_clean_text(self.parse_key(), strip_period=True))
+            keys.append(key)
+            self.expect(":")
+            self.parse_value(key, recordings)
+
+            char = self.peek()
+            self.pos += 1
+            if char == "}":
+                break
+            if char != ",":
+                self.pos -= 1
+                self.error("expected ',' or '}'")
+
+        self.skip_ws()
+        if self.pos != len(self.text):
+            self.error("trailing data after description")
+        return Timestamps(recordings, keys, self.has_is_valid)
+
+    def parse_key(self):
+        quote = self.peek()
+        if quote not in "\"'":
+            self.error("expected quoted key")
+        start = self.pos + 1
+
+        if quote == '"':
+            end = self.find_closing_quote(start)
+        else:
+            # Single-quoted keys can contain apostrophes (pet's name), so only a
+            # quote followed by ':' closes them
+            match = SINGLE_QUOTED_KEY_END.search(self.text, start)
+            if match is None:
+                self.error("unterminated key")
+            end = match.start()
+
+        self.pos = end + 1
+        return self.text[start:end]
+
+    def find_closing_quote(self, start):
+        text = self.text
+        pos = start
+        while True:
+            end = text.find('"', pos)
+            if end < 0:
+                self.pos = start
+                self.error("unterminated string")
+            backslashes = 0
+            while text[end - 1 - backslashes] == "\\":
+                backslashes += 1
+            if backslashes % 2 == 0:
+                return end
+            pos = end + 1
+
+    def parse_value(self, sign, recordings):
+        char = self.peek()
+        if char == "[":
+            end = self.parse_recording_list(sign, recordings, self.pos)
+            self.pos = end
+        elif char == '"':
+            start = self.pos + 1
+            end = self.find_closing_quote(start)
+            inner = start
+            while inner < end and self.text[inner] in " \t\r\n":
+                inner += 1
+            if inner < end and self.text[inner] == "[":
+                list_end = self.parse_recording_list(sign, recordings, inner)
+                trailing = self.text[list_end:end].strip(" \t\r\n.")
+                if trailing:
+                    self.pos = list_end
+                    self.error("unexpected data after recording list")
+            self.pos = end + 1
+        else:
+            # Bare scalar such as a version number
+            start = self.pos
+            while self.pos < len(self.text) and self.text[self.pos] not in ",}":
+                self.pos += 1
+            if self.pos == start:
+                self.error("expected value")
+
+    # Parses "[(...), (...)]" starting at pos and returns the offset just past "]"
+    def parse_recording_list(self, sign, recordings, pos):
+        self.pos = pos + 1
+        if self.peek() == "]":
+            return self.pos + 1
+
+        while True:
+            recordings.append(self.parse_recording(sign))
+            char = self.peek()
+            self.pos += 1
+            if char == "]":
+                return self.pos
+            if char != ",":
+                self.pos -= 1
+                self.error("expected ',' or ']' in recording list")
+
+    def parse_recording(self, sign):
+        # Some recorders print the class name before the field list
+        match = RECORDING.match(self.text, self.pos)
+        if match is None:
+            self.skip_ws()
+            self.error("expected '(' starting a recording")
+
+        body = match.group(1)
+        pairs = FIELD.findall(body)
+        if len(pairs) != body.count("="):
+            self.error("malformed name=value pair in recording")
+
+        values = [sign, None, None, None, None, True, 0]
+        for name, raw in pairs:
+            index = FIELDS.get(name)
+            if index is None:
+                continue
+            raw = raw.rstrip()
+            if index == 5:
+                self.has_is_valid = True
+                values[5] = raw.lower() in ("true", "1")
+            elif index == 6:
+                try:
+                    values[6] = int(raw)
+                except ValueError:
+                    self.error(f"attempt is not an integer: {raw!r}")
+            elif "\\" in raw:
+                values[index] = _clean_text(raw)
+            else:
+                values[index] = raw
+
+        self.pos = match.end()
+        if None in values:
+            missing = [name for name, index in FIELDS.items() if values[index] is None]
+            self.error(f"recording for {sign!r} is missing {', '.join(missing)}")
+        return Recording(*values)
+
+
+# Undoes the recorder's JSON escaping; keys also lose a trailing period ("Thank you." -> "Thank you")
+def _clean_text(value, strip_period=False):
+    value = value.replace("\\/", "/").replace("\\r", "")
+    if strip_period and value.endswith("."):
+        value = value[:-1]
+    return value
+
+
+# path is only used to say which file a TimestampsParseError came from
+def parse_description(description, path=None):
+    try:
+        return _DescriptionParser(description).parse()
+    except TimestampsParseError as e:
+        e.path = path
+        raise
+
+
+def load_timestamps(path):
+    return parse_description(read_image_description(path), path)